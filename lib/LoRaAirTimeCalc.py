@@ -2,41 +2,99 @@
 # LoRaAirTimeCalc.py v0.1 (26/04/2018) for normal Python 3 (for PC) or Pycom MicroPython
 # By Roberto Colistete Jr (roberto.colistete at gmail.com)
 
-from network import WLAN, LoRa   # For Pycom MicroPython
-#import LoRa   # For Python3
+try:
+   from network import WLAN, LoRa   # For Pycom MicroPython
+except ImportError:
+   # For Python3, same values as the Pycom constants
+   class LoRa:
+      BW_125KHZ = 0
+      BW_250KHZ = 1
+      BW_500KHZ = 2
+      CODING_4_5 = 1
+      CODING_4_6 = 2
+      CODING_4_7 = 3
+      CODING_4_8 = 4
 import struct
 from math import ceil
+from array import array
 
 # From atom console (pycom)
 #from LoRaAirTimeCalc import *
 #airtimetheoretical(20, 10, LoRa.BW_125KHZ, LoRa.CODING_4_5)
 
-# Using Pycom constants for bw and cr, calculates the DR (datarate) in bps
-def dataratetheoretical(sf, bw, cr):
+# Bandwidth (in kHz) for the Pycom constants (all the bandwidths used in EU868)
+def bandwidthkhz(bw):
    if bw == LoRa.BW_125KHZ:
-       bwv = 125
+       return 125
    if bw == LoRa.BW_250KHZ:
-       bwv = 250
+       return 250
    if bw == LoRa.BW_500KHZ:
-       bwv = 500
+       return 500
+   raise ValueError('Unsupported bandwidth (%s)' % bw)
+
+# Low data rate optimization is mandatory when the symbol time exceeds 16 ms
+# (i.e. SF11 and SF12 at 125 kHz, SF12 at 250 kHz)
+def lowdatarateoptimization(sf, bw):
+   if (2**sf)/bandwidthkhz(bw) > 16:
+       return 1
+   return 0
+
+# Using Pycom constants for bw and cr, calculates the DR (datarate) in bps
+def dataratetheoretical(sf, bw, cr):
+   bwv = bandwidthkhz(bw)
    crv = 4/(4 + cr)
    return 1000*sf*bwv*(crv)/2**sf
 
-# Air time (in seconds) theoretical calculation for LoRa-RAW, where there is a default preamble of 8 bytes plus 5 bytes of CRC, etc
-def airtimetheoretical(payloadsize, sf, bw, cr):
-   if bw == LoRa.BW_125KHZ:
-       bwv = 125
-   if bw == LoRa.BW_250KHZ:
-       bwv = 250
-   if bw == LoRa.BW_500KHZ:
-       bwv = 500
-   if sf in [11,12]:
-       lowDRopt = 1
-   else:
-       lowDRopt = 0
+# Number of symbols of the payload (including the 8 symbols of the header), from
+# the Semtech formula (SX1272/SX1276 datasheet)
+def numbersymbolspayloadtheoretical(payloadsize, sf, cr, lowDRopt, implicitheader=False, crc=True):
+   crcbits = 16 if crc else 0
+   headerbits = 20 if implicitheader else 0
+   return 8 + max(ceil((8*payloadsize - 4*sf + 28 + crcbits - headerbits)/(4*(sf - 2*lowDRopt)))*(4 + cr),0)
+
+# Air time (in seconds) theoretical calculation for LoRa-RAW. By default, preamble of 8 symbols,
+# explicit header, CRC on and low data rate optimization depending on the symbol time (lowDRopt=None)
+def airtimetheoretical(payloadsize, sf, bw, cr, preamblelength=8, implicitheader=False, crc=True, lowDRopt=None):
+   bwv = bandwidthkhz(bw)
+   if lowDRopt is None:
+       lowDRopt = lowdatarateoptimization(sf, bw)
    tsym = (2**sf)/(bwv*1000)
-   tpreamble = (8 + 4.25)*tsym # Preamble with 8 bytes
-   numbersymbolspayload = 8 + max(ceil((8*payloadsize - 4*sf + 28 + 16)/(4*(sf - 2*lowDRopt)))*(4 + cr),0)
+   tpreamble = (preamblelength + 4.25)*tsym
+   numbersymbolspayload = numbersymbolspayloadtheoretical(payloadsize, sf, cr, lowDRopt, implicitheader, crc)
    tpayload = numbersymbolspayload*tsym
    tpacket = tpreamble + tpayload
    return tpacket, tpreamble, tpayload, tsym, numbersymbolspayload
+
+# Air time lookup tables, one per set of PHY parameters (sf, bw, cr, preamble length,
+# header mode, CRC, low data rate optimization), built the first time they are used.
+# Each table keeps tpreamble, tsym and the number of payload symbols for every
+# payload size (0...MAX_PAYLOAD_SIZE), so the air time is obtained with the same
+# operations as airtimetheoretical (i.e. exactly the same value)
+MAX_PAYLOAD_SIZE = 255
+_airtimetables = {}
+
+def airtimetable(sf, bw=LoRa.BW_125KHZ, cr=LoRa.CODING_4_5, preamblelength=8, implicitheader=False, crc=True, lowDRopt=None):
+   key = (sf, bw, cr, preamblelength, implicitheader, crc, lowDRopt)
+   table = _airtimetables.get(key)
+   if table is None:
+      if lowDRopt is None:
+         lowDRopt = lowdatarateoptimization(sf, bw)
+      tpacket, tpreamble, tpayload, tsym, numbersymbolspayload = airtimetheoretical(0, sf, bw, cr, preamblelength, implicitheader, crc, lowDRopt)
+      numbersymbols = array('H', [numbersymbolspayloadtheoretical(payloadsize, sf, cr, lowDRopt, implicitheader, crc) for payloadsize in range(MAX_PAYLOAD_SIZE + 1)])
+      table = (tpreamble, tsym, numbersymbols)
+      _airtimetables[key] = table
+   return table
+
+# Air time (in seconds) using the lookup tables (same value as airtimetheoretical(...)[0])
+def airtime(payloadsize, sf, bw=LoRa.BW_125KHZ, cr=LoRa.CODING_4_5, preamblelength=8, implicitheader=False, crc=True, lowDRopt=None):
+   tpreamble, tsym, numbersymbols = airtimetable(sf, bw, cr, preamblelength, implicitheader, crc, lowDRopt)
+   return tpreamble + numbersymbols[payloadsize]*tsym
+
+# Air time (in seconds) for all the combinations of payload sizes and spreading
+# factors, as a list (one per sf) of lists (one per payload size)
+def airtimegrid(payloadsizes, sfs, bw=LoRa.BW_125KHZ, cr=LoRa.CODING_4_5, preamblelength=8, implicitheader=False, crc=True, lowDRopt=None):
+   grid = []
+   for sf in sfs:
+      tpreamble, tsym, numbersymbols = airtimetable(sf, bw, cr, preamblelength, implicitheader, crc, lowDRopt)
+      grid.append([tpreamble + numbersymbols[payloadsize]*tsym for payloadsize in payloadsizes])
+   return grid
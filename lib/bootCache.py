@@ -0,0 +1,86 @@
+# Boot cache: CARA parameters and #JOINACC# assignment of the last cold boot
+#
+# After a cold boot (Wi-Fi, NTP, HTTP parameters, LoRaWAN join and #JOINACC#),
+# main.py saves these values in a small binary file in the flash, and the
+# LoRaWAN session (keys, counters) with lora.nvram_save(). In the next boot, if
+# the RTC still has the time and the file is valid (same BOOT_CACHE_VERSION,
+# checksum) and has not expired, the device restores the session and goes
+# straight to the main loop, and the parameters are revalidated in the
+# background.
+#
+# File (little endian, BOOT_CACHE_FORMAT + Fletcher-16 checksum):
+#   version, flags (bit 0: load hints, bit 1: duration of period of the #JOINACC#),
+#   saved at (s since 1970), max age (s),
+#   randomTimeForJoining, fixedTime, randomTime, durationOfPeriod,
+#   borderEffectGuardTime, avoidBorderEffect, caraEnabled, initialResourceBlock,
+#   sfMask, selectedDR, assignment algorithm, load hints (SF7..SF12)
+
+import struct
+
+from caraScheduler import ASSIGNMENT_ALGORITHM_NAMES
+
+BOOT_CACHE_VERSION = 1
+BOOT_CACHE_FILE = '/flash/caraBoot.bin'
+BOOT_CACHE_FORMAT = '<BBqIfffffBBBBBB6B'
+BOOT_CACHE_SIZE = struct.calcsize(BOOT_CACHE_FORMAT)
+
+BOOT_CACHE_PARAMETERS = ('randomTimeForJoining', 'fixedTime', 'randomTime', 'durationOfPeriod', 'borderEffectGuardTime')
+BOOT_CACHE_ASSIGNMENT = ('avoidBorderEffect', 'caraEnabled', 'initialResourceBlock', 'sfMask', 'selectedDR')
+
+def fletcher16(data):
+  sum1 = 0
+  sum2 = 0
+  for b in data:
+    sum1 = (sum1 + b) % 255
+    sum2 = (sum2 + sum1) % 255
+  return (sum2 << 8) | sum1
+
+def encodeBootCache(values, savedAt, maxAge):
+  # values: dict with BOOT_CACHE_PARAMETERS, BOOT_CACHE_ASSIGNMENT, 'algorithm'
+  # (name or number), 'loadHints' (list or None) and 'durationOfPeriodFromJoinAccept'
+  # (the duration of period was assigned by the #JOINACC#, not by the HTTP parameters)
+  algorithm = values['algorithm']
+  if isinstance(algorithm, str):
+    algorithm = ASSIGNMENT_ALGORITHM_NAMES.index(algorithm)
+  loadHints = values['loadHints']
+  flags = (1 if loadHints else 0) | (2 if values['durationOfPeriodFromJoinAccept'] else 0)
+  hints = [min(255, max(0, int(load))) for load in (loadHints or [])[0:6]]
+  hints = hints + [0]*(6 - len(hints))
+  data = struct.pack(BOOT_CACHE_FORMAT, BOOT_CACHE_VERSION, flags, int(savedAt), int(maxAge),
+                     *([values[name] for name in BOOT_CACHE_PARAMETERS] + [values[name] for name in BOOT_CACHE_ASSIGNMENT] + [algorithm] + hints))
+  return data + struct.pack('<H', fletcher16(data))
+
+def decodeBootCache(data, now=None):
+  # Returns the values (dict, also 'savedAt'), or None if the data is not valid
+  # or has expired at the time now (s since 1970)
+  if data is None or len(data) != BOOT_CACHE_SIZE + 2:
+    return None
+  if struct.unpack_from('<H', data, BOOT_CACHE_SIZE)[0] != fletcher16(memoryview(data)[0:BOOT_CACHE_SIZE]):
+    return None
+  fields = struct.unpack_from(BOOT_CACHE_FORMAT, data)
+  if fields[0] != BOOT_CACHE_VERSION:
+    return None
+  flags, savedAt, maxAge = fields[1:4]
+  if now is not None and not (savedAt <= now < savedAt + maxAge):
+    return None
+  values = {'savedAt': savedAt}
+  i = 4
+  for name in BOOT_CACHE_PARAMETERS + BOOT_CACHE_ASSIGNMENT:
+    values[name] = fields[i]
+    i = i + 1
+  values['algorithm'] = fields[i]
+  values['loadHints'] = list(fields[i+1:i+7]) if flags & 1 else None
+  values['durationOfPeriodFromJoinAccept'] = (flags & 2) != 0
+  return values
+
+def saveBootCache(values, savedAt, maxAge, path=BOOT_CACHE_FILE):
+  with open(path, 'wb') as f:
+    f.write(encodeBootCache(values, savedAt, maxAge))
+
+def loadBootCache(now, path=BOOT_CACHE_FILE):
+  try:
+    with open(path, 'rb') as f:
+      data = f.read()
+  except OSError:
+    return None
+  return decodeBootCache(data, now)
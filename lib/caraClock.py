@@ -0,0 +1,152 @@
+# Monotonic time base for the CARA periods
+#
+# The time is kept as an integer number of microseconds since the midnight (UTC)
+# of the day of the NTP synchronization, advanced with the tick counter
+# (utime.ticks_us, which wraps around, so it has to be read at least every half
+# tick period) instead of reading the RTC, so it does not wrap at midnight: the
+# next day continues with 86400 s, 86401 s, ... and the CARA period indices keep
+# increasing. The CARA schedule aligns its periods with 1970 from the absolute
+# time of this midnight (epochDayUs, see caraScheduler.py), so the day of the
+# synchronization (cold or warm boot) does not change the periods.
+# The RTC (synchronized with NTP) is only used for the initial offset and for the
+# drift correction: the difference with the RTC is applied gradually (at most
+# MAX_SLEW of the elapsed time), so the time never goes backwards, and the drift
+# of the tick counter (ppm) is estimated between corrections.
+
+try:
+  import utime
+except ImportError:
+  utime = None
+
+SECONDS_PER_DAY = 86400
+US_PER_DAY = SECONDS_PER_DAY*1000000
+# Maximum time between two readings of the tick counter (us)
+MAX_SLEEP_US = 60000000
+# Maximum correction applied per elapsed time (1/10 = 100 ms per second)
+MAX_SLEW = 10
+# Differences with the RTC larger than this are applied at once (us), forward only
+MAX_SLEW_ERROR_US = 2000000
+# Maximum drift of the tick counter (larger differences with the RTC are NTP
+# steps, not drift) and minimum time between corrections to estimate it (us)
+MAX_DRIFT_PPM = 500
+MIN_DRIFT_INTERVAL_US = 30000000
+
+def daysFromCivil(year, month, day):
+  # Days since 1970-01-01 of a date (proleptic Gregorian calendar)
+  if month <= 2:
+    year = year - 1
+  era = year // 400
+  yearOfEra = year - era*400
+  dayOfYear = (153*(month + (-3 if month > 2 else 9)) + 2)//5 + day - 1
+  dayOfEra = yearOfEra*365 + yearOfEra//4 - yearOfEra//100 + dayOfYear
+  return era*146097 + dayOfEra - 719468
+
+def civilFromDays(days):
+  # Date (year, month, day) of a number of days since 1970-01-01
+  days = days + 719468
+  era = days // 146097
+  dayOfEra = days - era*146097
+  yearOfEra = (dayOfEra - dayOfEra//1460 + dayOfEra//36524 - dayOfEra//146096)//365
+  dayOfYear = dayOfEra - (365*yearOfEra + yearOfEra//4 - yearOfEra//100)
+  mp = (5*dayOfYear + 2)//153
+  day = dayOfYear - (153*mp + 2)//5 + 1
+  month = mp + (3 if mp < 10 else -9)
+  return (yearOfEra + era*400 + (1 if month <= 2 else 0), month, day)
+
+def rtcToUs(rtcNow):
+  # (year, month, day, hour, minute, second, usecond, tzinfo) -> us since 1970
+  year, month, day, hour, minute, second, usecond = rtcNow[0:7]
+  return (daysFromCivil(year, month, day)*SECONDS_PER_DAY + hour*3600 + minute*60 + second)*1000000 + usecond
+
+def usToRtc(us):
+  # us since 1970 -> (year, month, day, hour, minute, second, usecond, None)
+  days, us = divmod(us, US_PER_DAY)
+  seconds, usecond = divmod(us, 1000000)
+  year, month, day = civilFromDays(days)
+  return (year, month, day, seconds//3600, (seconds//60) % 60, seconds % 60, usecond, None)
+
+class CARAClock:
+  """ monotonic seconds since the midnight of the synchronization day """
+
+  def __init__(self, rtc, ticks_us=None, ticks_diff=None, sleep_us=None, epochDayUs=None):
+    self.rtc = rtc
+    # Tick counter and sleep (utime by default, virtual ones for the host tests)
+    self.ticks_us = ticks_us or utime.ticks_us
+    self.ticks_diff = ticks_diff or utime.ticks_diff
+    self.sleep_us = sleep_us or utime.sleep_us
+    self.driftPpm = 0
+    self.pendingUs = 0
+    self.corrections = 0
+    self.sync(epochDayUs)
+
+  def sync(self, epochDayUs=None):
+    # Initial offset (from the RTC, already synchronized with NTP). The midnight
+    # of a previous day (epochDayUs) is kept after waking up from deep sleep
+    self.lastTicks = self.ticks_us()
+    rtcUs = rtcToUs(self.rtc.now())
+    if epochDayUs is None:
+      epochDayUs = (rtcUs // US_PER_DAY)*US_PER_DAY
+    self.epochDayUs = epochDayUs
+    self.us = rtcUs - self.epochDayUs
+    self.lastCorrectionUs = self.us
+    self.pendingUs = 0
+
+  def nowUs(self):
+    ticks = self.ticks_us()
+    elapsed = self.ticks_diff(ticks, self.lastTicks)
+    self.lastTicks = ticks
+    if elapsed <= 0:
+      return self.us
+    elapsed = elapsed - elapsed*self.driftPpm//1000000
+    if self.pendingUs != 0:
+      # Gradual correction, never more than elapsed/MAX_SLEW
+      slew = max(-elapsed//MAX_SLEW, min(elapsed//MAX_SLEW, self.pendingUs))
+      self.pendingUs = self.pendingUs - slew
+      elapsed = elapsed + slew
+    self.us = self.us + elapsed
+    return self.us
+
+  def now(self):
+    # Seconds since the midnight of the synchronization day (without wrapping).
+    # Single precision float on the device (62 ms apart after a week), so only for
+    # durations and messages: the CARA periods are computed with nowUs()
+    return self.nowUs()/1000000
+
+  def correct(self):
+    # Compare with the RTC: new correction to apply and drift estimation
+    us = self.nowUs()
+    error = rtcToUs(self.rtc.now()) - self.epochDayUs - us
+    if error > MAX_SLEW_ERROR_US:
+      self.us = self.us + error
+      self.pendingUs = 0
+      error = 0
+    else:
+      self.pendingUs = error
+    interval = us - self.lastCorrectionUs
+    if interval >= MIN_DRIFT_INTERVAL_US:
+      drift = error*1000000//interval
+      if abs(drift) <= MAX_DRIFT_PPM:
+        self.driftPpm = max(-MAX_DRIFT_PPM, min(MAX_DRIFT_PPM, self.driftPpm - drift))
+      self.lastCorrectionUs = us
+    self.corrections = self.corrections + 1
+    return error
+
+  def sleepUntil(self, t):
+    # Sleep until the time t (seconds)
+    self.sleepUntilUs(int(t*1000000))
+
+  def sleepUntilUs(self, targetUs):
+    # Sleep until targetUs, reading the tick counter at least every MAX_SLEEP_US
+    while True:
+      remaining = targetUs - self.nowUs()
+      if remaining <= 0:
+        return
+      # Ticks to sleep, taking into account the drift of the tick counter
+      self.sleep_us(min(remaining + remaining*self.driftPpm//1000000, MAX_SLEEP_US))
+
+  def timeOfDay(self, us=None):
+    # [hour, minute, second, usecond] of the current time (or of us)
+    if us is None:
+      us = self.nowUs()
+    seconds, usecond = divmod((self.epochDayUs + us) % US_PER_DAY, 1000000)
+    return [seconds//3600, (seconds//60) % 60, seconds % 60, usecond]
@@ -0,0 +1,94 @@
+# CARA experiment parameters, obtained from the CARA web server
+#
+# The server can provide all the parameters in a single request (bundle
+# endpoint, by default <caraServerURL>parameters), either as a JSON object
+# or as key=value lines, e.g.
+#   {"joinTime": 10, "fixedTime": 60, "randomTime": 30, "durationOfPeriod": 5,
+#    "avoidBorderEffect": 1, "borderEffectGuardTime": 0.1, "count_v2.php": 3}
+# or
+#   joinTime=10
+#   fixedTime=60
+#   ...
+# If the server does not provide the bundle endpoint, each parameter is
+# obtained from its own endpoint (<caraServerURL>joinTime, ...), reusing the
+# same TCP connection if keepAlive is set (HTTP/1.1 persistent connection).
+
+from microWebCli import MicroWebCli
+
+# (server key, attribute name, type)
+CARA_PARAMETERS = (
+  ('joinTime', 'randomTimeForJoining', float),
+  ('fixedTime', 'fixedTime', float),
+  ('randomTime', 'randomTime', float),
+  ('durationOfPeriod', 'durationOfPeriod', float),
+  ('avoidBorderEffect', 'avoidBorderEffect', int),
+  ('borderEffectGuardTime', 'borderEffectGuardTime', float),
+  ('count_v2.php', 'countNodes', int),
+)
+
+class CARAParameters:
+  """ CARA parameters of the experiment """
+
+  def __init__(self):
+    for key, name, valueType in CARA_PARAMETERS:
+      setattr(self, name, None)
+    # Number of HTTP requests used to obtain the parameters
+    self.requests = 0
+    self.bundled = False
+
+  def set(self, key, value):
+    for k, name, valueType in CARA_PARAMETERS:
+      if k == key:
+        setattr(self, name, valueType(value))
+        return True
+    return False
+
+  def missingKeys(self):
+    return [key for key, name, valueType in CARA_PARAMETERS if getattr(self, name) is None]
+
+  def asList(self):
+    return [self.randomTimeForJoining, self.fixedTime, self.randomTime, self.durationOfPeriod, self.avoidBorderEffect, self.borderEffectGuardTime]
+
+def parseCARAParameters(contentBytes, params=None):
+  # Parse the content of the bundle endpoint (JSON or key=value lines)
+  if params is None:
+    params = CARAParameters()
+  content = bytes(contentBytes).decode('utf-8').strip()
+  if content.startswith('{'):
+    import json
+    try:
+      values = json.loads(content)
+    except:
+      raise Exception('Error to parse CARA parameters : %s' % content)
+    for key in values:
+      params.set(key, values[key])
+  else:
+    for line in content.replace('&', '\n').split('\n'):
+      keyValue = line.split('=', 1)
+      if len(keyValue) == 2:
+        params.set(keyValue[0].strip(), keyValue[1].strip())
+  return params
+
+def fetchCARAParameters(caraServerURL, bundleName='parameters', keepAlive=False):
+  params = CARAParameters()
+
+  if bundleName:
+    # GETRequest returns None if the server does not have the bundle endpoint
+    contentBytes = MicroWebCli.GETRequest(caraServerURL + bundleName, keepAlive=keepAlive)
+    params.requests = params.requests + 1
+    if contentBytes is not None:
+      parseCARAParameters(contentBytes, params)
+      params.bundled = True
+
+  # Per-key endpoints (only for the parameters not included in the bundle)
+  for key in params.missingKeys():
+    contentBytes = MicroWebCli.GETRequest(caraServerURL + key, keepAlive=keepAlive)
+    params.requests = params.requests + 1
+    if contentBytes is None:
+      raise Exception('Error to get CARA parameter %s' % key)
+    params.set(key, contentBytes)
+
+  if keepAlive:
+    MicroWebCli.ClosePool()
+
+  return params
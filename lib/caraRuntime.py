@@ -0,0 +1,280 @@
+# Asynchronous runtime of the main loop (uasyncio on the device, asyncio on the host)
+#
+# After the boot (Wi-Fi, NTP, CARA parameters and join, see main.py), the main
+# loop runs as tasks of one event loop instead of a blocking loop:
+#   scheduler: waits (await) for the next CARA transmission time, then sends the
+#              next frame of the transmit queue (border effect and duty cycle as
+#              in main.py) and keeps the lateness of every uplink (time it is sent
+#              - scheduled time). The transmission times are integer microseconds
+#              of the time base (see CARASchedule.periodAtUs)
+#   radio RX:  receives the downlinks (Class C) and passes them to the downlink
+#              dispatcher (reconfigurations, see downlinkDispatcher.py) or to onDownlink
+#   refresh:   obtains the CARA parameters every refreshPeriod seconds with
+#              fetchParameters (blocking HTTP, run in a thread), applied by the
+#              scheduler before the next uplink
+#   telemetry: sample() every telemetryPeriod seconds, pushed into the transmit queue
+#              (not while a frame is held at the border effect, as main.py)
+# Blocking calls (HTTP requests) run in a thread (runInThread) and the LoRa socket
+# is non-blocking (AsyncLoRaSocket), so the event loop is never blocked.
+
+try:
+  import uasyncio as asyncio
+except ImportError:
+  import asyncio
+import _thread
+from array import array
+
+from caraScheduler import checkBorderEffectUs, deferTransmissionUs, convertDRtoSF
+from LoRaAirTimeCalc import airtime, LoRa
+from microWebCli import MicroWebCli
+
+# Debug messages
+debug = 0
+# Interval to check a thread or the non-blocking socket (seconds)
+POLL_INTERVAL = 0.01
+# Lateness of the last uplinks kept (seconds)
+LATENESS_SAMPLES = 256
+# LoRaWAN FPort of the frames (Pycom default)
+DEFAULT_FPORT = 2
+
+async def runInThread(function, *args):
+  # Runs a blocking function in a thread and waits for it without blocking the
+  # event loop. Returns its result (or raises its exception)
+  result = []
+  def worker():
+    try:
+      result.append((True, function(*args)))
+    except Exception as e:
+      result.append((False, e))
+  _thread.start_new_thread(worker, ())
+  while len(result) == 0:
+    await asyncio.sleep(POLL_INTERVAL)
+  ok, value = result[0]
+  if not ok:
+    raise value
+  return value
+
+async def getRequest(url, queryParams=None, auth=None, connTimeoutSec=10, socks5Addr=None, keepAlive=False):
+  # Awaitable MicroWebCli.GETRequest
+  return await runInThread(MicroWebCli.GETRequest, url, queryParams, auth, connTimeoutSec, socks5Addr, keepAlive)
+
+async def postRequest(url, formData={}, auth=None, connTimeoutSec=10, socks5Addr=None, keepAlive=False):
+  # Awaitable MicroWebCli.POSTRequest
+  return await runInThread(MicroWebCli.POSTRequest, url, formData, auth, connTimeoutSec, socks5Addr, keepAlive)
+
+class AsyncLoRaSocket:
+  """ LoRa socket with awaitable send and receive (non-blocking socket) """
+
+  def __init__(self, s, pollInterval=POLL_INTERVAL):
+    self.s = s
+    self.pollInterval = pollInterval
+    self.port = DEFAULT_FPORT
+    s.setblocking(False)
+
+  async def send(self, data, airTime, port=DEFAULT_FPORT):
+    # The frame is sent in the background; waits for its air time
+    if port != self.port:
+      self.s.bind(port)
+      self.port = port
+    self.s.send(data)
+    await asyncio.sleep(airTime)
+
+  async def recv(self, size=64):
+    # (data, port) of the next downlink
+    while True:
+      try:
+        data, port = self.s.recvfrom(size)
+      except OSError:
+        data = b''
+      if len(data) > 0:
+        return (data, port)
+      await asyncio.sleep(self.pollInterval)
+
+class CARARuntime:
+  """ scheduler, radio RX, parameter refresh and telemetry tasks """
+
+  def __init__(self, socket, radioState, schedule, params, txQueue, dutyCycle, now, random,
+               scheduleFactory=None, guardTime=None, fetchParameters=None, refreshPeriod=0,
+               sample=None, telemetryPeriod=0, onDownlink=None, bMerge=False, bDefer=False, mergedFPort=3, fixedBlock=None,
+               downlinks=None, histogram=None, joinAcceptPeriod=False):
+    self.socket = socket
+    self.radioState = radioState
+    self.schedule = schedule
+    # CARA parameters (fixedTime, randomTime, durationOfPeriod, avoidBorderEffect,
+    # borderEffectGuardTime attributes, see caraParameters.py)
+    self.params = params
+    self.txQueue = txQueue
+    self.dutyCycle = dutyCycle
+    # now(): time of the CARA schedule (integer us, CARAClock.nowUs); random():
+    # random number in [0, 1]
+    self.now = now
+    self.random = random
+    # scheduleFactory(durationOfPeriod): new schedule if the period changes
+    self.scheduleFactory = scheduleFactory
+    # guardTime(borderEffectGuardTime): guard time of the next uplink
+    self.guardTime = guardTime or (lambda guard: guard)
+    self.fetchParameters = fetchParameters
+    self.refreshPeriod = refreshPeriod
+    self.sample = sample
+    self.telemetryPeriod = telemetryPeriod
+    self.onDownlink = onDownlink
+    self.bMerge = bMerge
+    self.bDefer = bDefer
+    self.mergedFPort = mergedFPort
+    # Resource block of all the uplinks (main.py bFixedChannelAndDR), None = schedule
+    self.fixedBlock = fixedBlock
+    # DownlinkDispatcher: reconfigurations swap the schedule at a period boundary
+    self.downlinks = downlinks
+    # txTiming.LatenessHistogram: lateness of the uplinks (automatic guard time)
+    self.histogram = histogram
+    # The duration of period was assigned by the #JOINACC# (kept by the refresh)
+    self.joinAcceptPeriod = joinAcceptPeriod
+    self.pendingParameters = None
+    # The last frame was held at the border effect (no new samples until it is sent)
+    self.frameHeldAtBorder = False
+    # Statistics
+    self.framesSent = 0
+    self.framesDeferred = 0
+    self.framesBorderHeld = 0
+    self.framesHeld = 0
+    self.downlinksReceived = 0
+    self.refreshes = 0
+    self.lateness = array('f', [0.0]*LATENESS_SAMPLES)
+    self.latenessCount = 0
+    self.maxLateness = 0.0
+
+  async def sleepUntil(self, us):
+    remaining = us - self.now()
+    if remaining > 0:
+      await asyncio.sleep(remaining/1000000)
+
+  def applyParameters(self):
+    # New CARA parameters from the refresh task (the #JOINACC# assignment is kept,
+    # also its duration of period or the one of a reconfiguration downlink)
+    params = self.pendingParameters
+    self.pendingParameters = None
+    if self.joinAcceptPeriod or (self.downlinks is not None and self.downlinks.periodFromCommand):
+      params.durationOfPeriod = self.schedule.durationOfPeriod
+    if params.durationOfPeriod != self.schedule.durationOfPeriod:
+      if self.downlinks is not None:
+        self.downlinks.setPeriod(params.durationOfPeriod)
+        self.schedule = self.downlinks.schedule
+      elif self.scheduleFactory is not None:
+        self.schedule = self.scheduleFactory(params.durationOfPeriod)
+    self.params = params
+
+  def addLateness(self, lateness):
+    self.lateness[self.latenessCount % LATENESS_SAMPLES] = lateness
+    self.latenessCount = self.latenessCount + 1
+    self.maxLateness = max(self.maxLateness, lateness)
+    if self.histogram is not None:
+      self.histogram.add(int(1000000*lateness))
+
+  def latenessSamples(self):
+    return list(self.lateness[0:min(self.latenessCount, LATENESS_SAMPLES)])
+
+  def plan(self, timeNextTransmissionUs, payloadsize, bDefer):
+    # [timeNextTransmissionUs, selectedFreq, selectedDR, borderTransmission, airTime]
+    # of a transmission scheduled at timeNextTransmissionUs
+    params = self.params
+    if self.downlinks is not None:
+      self.schedule = self.downlinks.scheduleAt(timeNextTransmissionUs)
+    schedule = self.schedule
+    selectedFreq, selectedDR = schedule.parametersAtUs(timeNextTransmissionUs)
+    # (the border effect is checked with the DR actually used)
+    if self.fixedBlock is not None:
+      selectedFreq, selectedDR = schedule.parametersOfBlock(self.fixedBlock)
+    borderTransmission = False
+    if params.avoidBorderEffect == 1:
+      guardTime = self.guardTime(params.borderEffectGuardTime)
+      borderTransmission = checkBorderEffectUs(timeNextTransmissionUs, selectedFreq, selectedDR, guardTime, payloadsize, schedule.periodUs, schedule.epochOffsetUs)
+      if borderTransmission and bDefer:
+        # (before the earliest next transmission, fixedTime after the scheduled one)
+        deferred = deferTransmissionUs(schedule, timeNextTransmissionUs, guardTime, payloadsize, self.fixedBlock, timeNextTransmissionUs + int(1000000*params.fixedTime))
+        # (not deferred beyond a pending reconfiguration)
+        if deferred is not None and not (self.downlinks is not None and self.downlinks.pendingBefore(deferred[0])):
+          timeNextTransmissionUs, selectedFreq, selectedDR = deferred
+          borderTransmission = False
+          self.framesDeferred = self.framesDeferred + 1
+    airTime = airtime(payloadsize, convertDRtoSF(selectedDR), LoRa.BW_125KHZ, LoRa.CODING_4_5)
+    return [timeNextTransmissionUs, selectedFreq, selectedDR, borderTransmission, airTime]
+
+  async def scheduler(self):
+    timeLastTransmissionUs = None
+    while True:
+      if self.pendingParameters is not None:
+        self.applyParameters()
+      params = self.params
+      randNoUs = int(1000000*(params.fixedTime + self.random()*params.randomTime))
+      if timeLastTransmissionUs is None:
+        timeNextTransmissionUs = self.now() + randNoUs
+      else:
+        timeNextTransmissionUs = timeLastTransmissionUs + randNoUs
+      # The next transmission is computed from the scheduled time (as main.py)
+      timeLastTransmissionUs = timeNextTransmissionUs
+
+      payloadsize, framePayloads = self.txQueue.frameSize(self.bMerge)
+      if framePayloads == 0:
+        # Nothing to send in this transmission time
+        await self.sleepUntil(timeNextTransmissionUs)
+        continue
+      timeNextTransmissionUs, selectedFreq, selectedDR, borderTransmission, airTime = self.plan(timeNextTransmissionUs, payloadsize, self.bDefer)
+      self.radioState.setTransmissionParameters(selectedFreq, selectedDR)
+
+      await self.sleepUntil(timeNextTransmissionUs)
+      if self.downlinks is not None and self.downlinks.pendingBefore(timeNextTransmissionUs):
+        # Reconfiguration received while waiting, in effect for this transmission
+        timeNextTransmissionUs, selectedFreq, selectedDR, borderTransmission, airTime = self.plan(timeNextTransmissionUs, payloadsize, False)
+        self.radioState.setTransmissionParameters(selectedFreq, selectedDR)
+      lateness = (self.now() - timeNextTransmissionUs)/1000000
+      if borderTransmission:
+        # The frame stays in the queue for the next transmission time
+        self.framesBorderHeld = self.framesBorderHeld + 1
+        self.frameHeldAtBorder = True
+        continue
+      # (the duty cycle ledger is kept in seconds)
+      if not self.dutyCycle.allowed(selectedFreq, airTime, self.now()/1000000):
+        self.framesHeld = self.framesHeld + 1
+        continue
+      self.addLateness(lateness)
+      message = self.txQueue.pop(framePayloads)
+      self.frameHeldAtBorder = False
+      self.dutyCycle.record(selectedFreq, self.now()/1000000, airTime)
+      await self.socket.send(message, airTime, self.mergedFPort if framePayloads > 1 else DEFAULT_FPORT)
+      self.framesSent = self.framesSent + 1
+      if (debug > 0):
+        print("[DEBUG] Uplink at t={:.3f} on {:d} Hz with DR {:d}, {:.1f} ms late".format(timeNextTransmissionUs/1000000, selectedFreq, selectedDR, 1000*lateness))
+
+  async def radioRx(self):
+    while True:
+      data, port = await self.socket.recv(64)
+      self.downlinksReceived = self.downlinksReceived + 1
+      if self.downlinks is not None:
+        self.downlinks.handle(data, port, self.now())
+      elif self.onDownlink is not None:
+        self.onDownlink(data, port)
+
+  async def refresh(self):
+    while True:
+      await asyncio.sleep(self.refreshPeriod)
+      try:
+        self.pendingParameters = await runInThread(self.fetchParameters)
+        self.refreshes = self.refreshes + 1
+      except Exception as e:
+        print("[INFO] CARA parameters not refreshed:", e)
+
+  async def telemetry(self):
+    while True:
+      if not self.frameHeldAtBorder:
+        data = self.sample()
+        if data is not None and not self.txQueue.push(data):
+          print("[INFO] Transmit queue full, payload dropped ({:d} dropped)".format(self.txQueue.dropped))
+      await asyncio.sleep(self.telemetryPeriod)
+
+  async def run(self):
+    tasks = [self.scheduler(), self.radioRx()]
+    if self.fetchParameters is not None and self.refreshPeriod > 0:
+      tasks.append(self.refresh())
+    if self.sample is not None and self.telemetryPeriod > 0:
+      tasks.append(self.telemetry())
+    await asyncio.gather(*tasks)
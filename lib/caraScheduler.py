@@ -0,0 +1,353 @@
+# CARA resource blocks and assignment algorithms (shared by the device, main.py,
+# and the host side tools, e.g. tools/caraSimulator.py)
+
+from array import array
+
+from LoRaAirTimeCalc import airtime, LoRa
+
+# Debug messages
+debug = 0
+
+def zfill(s, width):
+  return '{:0>{w}}'.format(s, w=width)
+
+def frequencyForChannel(value):
+  return (867100000 + value*200000)
+
+def convertDRtoSF(value):
+  return (12 - value)
+
+def convertSFtoDR(value):
+  return (12 - value)
+
+def createResourceBlocksLists(sfMask):
+  channelsList = []
+  sfList = []
+
+  #print("sfMask = {}".format(bin(sfMask)))
+  if (debug > 0):
+    print("[DEBUG] SF mask = {}".format(zfill(bin(sfMask)[2:], 6)))
+
+  # Bit 0 of the mask enables SF7, ..., bit 5 enables SF12
+  i = 0
+  for bit in range(0, 6):
+    if (sfMask >> bit) & 1:
+      for channel in range(0, 8):
+        sfList.append(7+bit)
+        channelsList.append(frequencyForChannel(channel))
+        if (debug > 0):
+          print("[DEBUG] Resource block {:d} with channel {:d} and SF {:d}".format(i, channel, 7+bit))
+        i = i + 1
+
+  return [channelsList, sfList]
+
+def assignmentAlgorithm1(timeNextTransmission, channelsList, sfList, initialResourceBlock, durationOfPeriod):
+  # THIS ALGORITHM SELECT THE CHANNEL AND SF FOLLOWING A SEQUENTIAL ORDER
+
+  if (debug > 0):
+    print("[DEBUG] Time for next transmission (sec) = {:.3f}".format(timeNextTransmission))
+  #print("durationOfPeriod = {:.2f}".format(durationOfPeriod))
+  indexCurrentPeriod = int(timeNextTransmission / durationOfPeriod)
+  if (debug > 0):
+    print("[DEBUG] Current period = {:d}".format(indexCurrentPeriod))
+
+  noResourceBlocks = len(channelsList)
+  currentResourceBlock = (indexCurrentPeriod+initialResourceBlock) % noResourceBlocks
+  selectedFreq = channelsList[currentResourceBlock]
+  selectedSF = sfList[currentResourceBlock]
+  selectedDR = convertSFtoDR(selectedSF)
+  #nextResourceBlock = (indexCurrentPeriod+initialResourceBlock+1) % noResourceBlocks
+  #selectedFreqForNextPeriod = channelsList[nextResourceBlock]
+  #selectedSFForNextPeriod = sfList[nextResourceBlock]
+  #selectedDRForNextPeriod = convertSFtoDR(selectedSFForNextPeriod)
+
+  if (debug > 0):
+    print("[DEBUG] Current resource block = {:d}".format(currentResourceBlock))
+    print("[DEBUG] Selected frequency = {:d}".format(selectedFreq))
+    print("[DEBUG] Selected DR = {:d}".format(selectedDR))
+
+  #print("Next resource block = {:d}".format(nextResourceBlock))
+  #print("Selected frequency for next period = {:d}".format(selectedFreqForNextPeriod))
+  #print("Selected DR for next period = {:d}".format(selectedDRForNextPeriod))
+
+  #return [selectedFreq, selectedDR, selectedFreqForNextPeriod, selectedDRForNextPeriod]
+  return [selectedFreq, selectedDR]
+
+#def checkBorderEffect(timeNextTransmission, selectedFreq, selectedDR, selectedFreqForNextPeriod, selectedDRForNextPeriod, borderEffectGuardTime, payloadsize):
+def checkBorderEffect(timeNextTransmission, selectedFreq, selectedDR, borderEffectGuardTime, payloadsize, durationOfPeriod, epochOffset=0.0):
+  # CHECK TIME OVER AIR TO AVOID BORDER EFFECTS (WAIT FOR NEXT PERIOD IF NECESSARY)
+  # (epochOffset: CARASchedule.epochOffset, time 0 into its period)
+  # Times in seconds (host tools), checked in microseconds as checkBorderEffectUs
+  return checkBorderEffectUs(int(round(timeNextTransmission*1000000)), selectedFreq, selectedDR, borderEffectGuardTime, payloadsize,
+                             int(round(durationOfPeriod*1000000)), int(round(epochOffset*1000000)))
+
+def checkBorderEffectUs(timeNextTransmissionUs, selectedFreq, selectedDR, borderEffectGuardTime, payloadsize, periodUs, epochOffsetUs=0):
+  # Same check with the time of the transmission in integer microseconds of the time
+  # base (CARAClock.nowUs(), exact whatever the uptime, unlike the single precision
+  # floats of the device), periodUs and epochOffsetUs of the CARASchedule
+
+  airTime = airtime(payloadsize, convertDRtoSF(selectedDR), LoRa.BW_125KHZ, LoRa.CODING_4_5)
+  limitForThisPeriodUs = ((timeNextTransmissionUs + epochOffsetUs) // periodUs + 1) * periodUs - epochOffsetUs
+  if (debug > 0):
+    print("checkBorderEffect: timeNextTransmissionUs={:d}, airTime={:.2f}, limitForThisPeriodUs={:d}".format(timeNextTransmissionUs, airTime, limitForThisPeriodUs))
+
+  if ( (timeNextTransmissionUs + int(round((airTime + borderEffectGuardTime)*1000000))) > limitForThisPeriodUs ):
+    # The transmission has to wait for next period
+    borderTransmission = True
+  else:
+    # The transmission can be fitted in the current period
+    borderTransmission = False
+
+  return borderTransmission
+
+
+# Resource block schedule
+#
+# The resource blocks are stored in an array of bytes, (channel << 4) | DR, built
+# once from the #JOINACC# parameters (and unpacked into arrays of frequencies and
+# DRs for the lookups). Each assignment algorithm precomputes the resource blocks
+# of one cycle of periods, so the resource block of any period is a table lookup,
+# sequence[indexPeriod % len(sequence)], and no memory is used per period.
+#
+# Assignment algorithms (selected by name or by the number sent in #JOINACC#):
+#   0 = 'sequential': resource blocks in order from the initial resource block
+#       (same as assignmentAlgorithm1)
+#   1 = 'hashed': pseudo-random hopping, seeded with a hash of the DevEUI
+#   2 = 'weighted': each resource block used in proportion to the inverse of its
+#       air time (more periods in the faster SFs)
+#   3 = 'loadAware': each resource block used in proportion to the inverse of
+#       the load of its SF sent by the server (downlink hints, SF7 to SF12)
+# A sequence builder receives the CARASchedule and returns an array('B') with
+# the resource block of each period of the cycle.
+#
+# The periods are aligned with an absolute epoch (1970-01-01): epochUs is the
+# absolute time (us) of the time 0 of the schedule (CARAClock.epochDayUs, the
+# midnight of the synchronization day), so the period boundaries and the position
+# in the cycle are the same for every device and every boot, whatever the day of
+# the synchronization (also if durationOfPeriod does not divide a day). The
+# indices of periodAt() are counted from the time 0 (small numbers).
+#
+# The lookups are done in integer microseconds of the time base (periodAtUs(),
+# parametersAtUs(), ... with CARAClock.nowUs()): the float seconds of the device are
+# single precision, so after a week of uptime they are only 62 ms apart (0.25 s
+# after a month). The methods in seconds (periodAt(), parametersAt(), ...) are the
+# same lookups for the host tools (double precision).
+
+HOPPING_SEQUENCE_LENGTH = 256
+WEIGHTING_PAYLOAD_SIZE = 20
+MAX_WEIGHT = 32
+
+def hashDevEUI(devEUI):
+  # FNV-1a (32 bits), the same in the device and in the server
+  h = 0x811C9DC5
+  for b in devEUI:
+    h = ((h ^ b) * 0x01000193) & 0xFFFFFFFF
+  return h
+
+def weightedSequence(weights, offset):
+  # Smooth weighted round robin: block i appears weights[i] times per cycle,
+  # spread over the cycle
+  total = sum(weights)
+  current = [0]*len(weights)
+  sequence = array('B')
+  for i in range(total):
+    best = 0
+    for block in range(len(weights)):
+      current[block] = current[block] + weights[block]
+      if current[block] > current[best]:
+        best = block
+    current[best] = current[best] - total
+    sequence.append(best)
+  # Devices with different initial resource blocks start at different points
+  offset = offset % total
+  return sequence[offset:] + sequence[:offset]
+
+def sequentialSequence(schedule):
+  n = schedule.noResourceBlocks
+  return array('B', [(indexPeriod + schedule.initialResourceBlock) % n for indexPeriod in range(n)])
+
+def hashedSequence(schedule):
+  # xorshift32 seeded with the hash of the DevEUI
+  n = schedule.noResourceBlocks
+  x = hashDevEUI(schedule.devEUI) or 1
+  sequence = array('B')
+  for i in range(HOPPING_SEQUENCE_LENGTH):
+    x = x ^ ((x << 13) & 0xFFFFFFFF)
+    x = x ^ (x >> 17)
+    x = x ^ ((x << 5) & 0xFFFFFFFF)
+    sequence.append((schedule.initialResourceBlock + (x >> 8)) % n)
+  return sequence
+
+def weightedByAirTimeSequence(schedule):
+  airTimes = [airtime(WEIGHTING_PAYLOAD_SIZE, convertDRtoSF(dr)) for dr in schedule.drs]
+  longest = max(airTimes)
+  weights = [min(MAX_WEIGHT, max(1, int(longest/a + 0.5))) for a in airTimes]
+  return weightedSequence(weights, schedule.initialResourceBlock*sum(weights)//schedule.noResourceBlocks)
+
+def loadAwareSequence(schedule):
+  loadHints = schedule.loadHints
+  if not loadHints:
+    # Without hints, all the resource blocks have the same weight
+    return weightedSequence([1]*schedule.noResourceBlocks, schedule.initialResourceBlock)
+  loads = [loadHints[convertDRtoSF(dr) - 7] if convertDRtoSF(dr) - 7 < len(loadHints) else 0 for dr in schedule.drs]
+  highest = max(loads)
+  weights = [min(MAX_WEIGHT, max(1, int((1 + highest)/(1 + load) + 0.5))) for load in loads]
+  return weightedSequence(weights, schedule.initialResourceBlock*sum(weights)//schedule.noResourceBlocks)
+
+ASSIGNMENT_ALGORITHM_NAMES = ('sequential', 'hashed', 'weighted', 'loadAware')
+
+ASSIGNMENT_ALGORITHMS = {
+  'sequential': sequentialSequence,
+  'hashed': hashedSequence,
+  'weighted': weightedByAirTimeSequence,
+  'loadAware': loadAwareSequence,
+}
+
+def knownAssignmentAlgorithm(algorithm):
+  # Number in #JOINACC#, name in ASSIGNMENT_ALGORITHMS or sequence builder
+  if isinstance(algorithm, int):
+    return 0 <= algorithm < len(ASSIGNMENT_ALGORITHM_NAMES)
+  if isinstance(algorithm, str):
+    return algorithm in ASSIGNMENT_ALGORITHMS
+  return callable(algorithm)
+
+def parseLoadHints(value):
+  # '10,20,5' -> [10, 20, 5] (load of SF7, SF8, ...)
+  return [int(load) for load in value.split(',') if load != '']
+
+_resourceBlocksTables = {}
+
+def createResourceBlocksTable(sfMask):
+  # Packed resource blocks (shared by all the schedules with the same SF mask)
+  table = _resourceBlocksTables.get(sfMask)
+  if table is None:
+    table = array('B')
+    for bit in range(0, 6):
+      if (sfMask >> bit) & 1:
+        for channel in range(0, 8):
+          table.append((channel << 4) | convertSFtoDR(7+bit))
+    _resourceBlocksTables[sfMask] = table
+  return table
+
+class CARASchedule:
+  """ channel and DR for each CARA period (times in seconds) """
+
+  def __init__(self, sfMask, initialResourceBlock, durationOfPeriod, algorithm='sequential', devEUI=b'', loadHints=None, epochUs=0):
+    self.table = createResourceBlocksTable(sfMask)
+    self.noResourceBlocks = len(self.table)
+    if self.noResourceBlocks == 0:
+      raise ValueError("SF mask without resource blocks")
+    self.freqs = array('L', [frequencyForChannel(packed >> 4) for packed in self.table])
+    self.drs = array('B', [packed & 0x0F for packed in self.table])
+    self.initialResourceBlock = initialResourceBlock
+    self.durationOfPeriod = durationOfPeriod
+    self.devEUI = devEUI
+    self.loadHints = loadHints
+    # Number in #JOINACC#, name in ASSIGNMENT_ALGORITHMS or sequence builder
+    if isinstance(algorithm, int):
+      if not (0 <= algorithm < len(ASSIGNMENT_ALGORITHM_NAMES)):
+        raise ValueError("Unknown assignment algorithm {:d}".format(algorithm))
+      algorithm = ASSIGNMENT_ALGORITHM_NAMES[algorithm]
+    if isinstance(algorithm, str):
+      if algorithm not in ASSIGNMENT_ALGORITHMS:
+        raise ValueError("Unknown assignment algorithm " + algorithm)
+      self.algorithmName = algorithm
+      algorithm = ASSIGNMENT_ALGORITHMS[algorithm]
+    else:
+      self.algorithmName = getattr(algorithm, '__name__', 'custom')
+    self.sequence = algorithm(self)
+    self.sequenceLength = len(self.sequence)
+    # Time 0 is epochOffsetUs into its period, which is the epochIndex-th of the
+    # cycle (integer arithmetic)
+    self.periodUs = int(round(durationOfPeriod*1000000))
+    periods, self.epochOffsetUs = divmod(epochUs, self.periodUs)
+    self.epochOffset = self.epochOffsetUs/1000000
+    self.epochIndex = periods % self.sequenceLength
+
+  def periodAtUs(self, us):
+    return (us + self.epochOffsetUs) // self.periodUs
+
+  def periodStartUs(self, indexPeriod):
+    return indexPeriod * self.periodUs - self.epochOffsetUs
+
+  def blockAtUs(self, us):
+    # Resource block of the period that contains us
+    return self.sequence[(self.periodAtUs(us) + self.epochIndex) % self.sequenceLength]
+
+  def nextBoundaryUs(self, us):
+    # Start of the next period
+    return self.periodStartUs(self.periodAtUs(us)+1)
+
+  def parametersAtUs(self, us):
+    # [selectedFreq, selectedDR] for a transmission at us
+    block = self.sequence[((us + self.epochOffsetUs) // self.periodUs + self.epochIndex) % self.sequenceLength]
+    return [self.freqs[block], self.drs[block]]
+
+  def periodAt(self, t):
+    return self.periodAtUs(int(round(t*1000000)))
+
+  def periodStart(self, indexPeriod):
+    return self.periodStartUs(indexPeriod)/1000000
+
+  def blockAt(self, t):
+    # Resource block of the period that contains t
+    return self.blockAtUs(int(round(t*1000000)))
+
+  def nextBoundary(self, t):
+    # Start of the next period
+    return self.periodStart(self.periodAt(t)+1)
+
+  def slotsUntil(self, t, fromTime):
+    # Period boundaries between fromTime and t
+    return self.periodAt(t) - self.periodAt(fromTime)
+
+  def parametersOfBlock(self, block):
+    return [self.freqs[block], self.drs[block]]
+
+  def parametersOfPeriod(self, indexPeriod):
+    block = self.sequence[(indexPeriod + self.epochIndex) % self.sequenceLength]
+    return [self.freqs[block], self.drs[block]]
+
+  def parametersAt(self, t):
+    # [selectedFreq, selectedDR] for a transmission at time t
+    return self.parametersAtUs(int(round(t*1000000)))
+
+def deferTransmission(schedule, timeNextTransmission, borderEffectGuardTime, payloadsize, fixedBlock=None, latestTime=None):
+  # deferTransmissionUs with the times in seconds (host tools)
+  deferred = deferTransmissionUs(schedule, int(round(timeNextTransmission*1000000)), borderEffectGuardTime, payloadsize, fixedBlock,
+                                 None if latestTime is None else int(round(latestTime*1000000)))
+  if deferred is None:
+    return None
+  return [deferred[0]/1000000, deferred[1], deferred[2]]
+
+def deferTransmissionUs(schedule, timeNextTransmissionUs, borderEffectGuardTime, payloadsize, fixedBlock=None, latestTimeUs=None):
+  # A TRANSMISSION THAT WOULD CROSS THE END OF ITS PERIOD IS MOVED borderEffectGuardTime AFTER
+  # THE START OF THE FIRST FOLLOWING PERIOD WHERE IT FITS (WITH THE FREQUENCY AND DR OF THAT
+  # PERIOD, OR OF fixedBlock WITH main.py bFixedChannelAndDR), SO THE GUARD TIME IS KEPT
+  # AT BOTH BORDERS OF THE PERIOD
+  # With latestTimeUs (the earliest time of the next scheduled transmission), the deferred
+  # transmission and its guard time must end before it, so it never overlaps the next one
+  # Times in integer microseconds of the time base (see CARASchedule.periodAtUs)
+  # Returns [timeNextTransmissionUs, selectedFreq, selectedDR], or None if it does not
+  # fit in any period of the cycle (i.e. air time + 2 guard times > duration of period)
+  # or before latestTimeUs (the frame is then held)
+
+  indexPeriod = schedule.periodAtUs(timeNextTransmissionUs)
+  guardTimeUs = int(round(borderEffectGuardTime*1000000))
+  periods = schedule.sequenceLength if fixedBlock is None else 1
+  for i in range(1, periods+1):
+    deferredUs = schedule.periodStartUs(indexPeriod + i) + guardTimeUs
+    if latestTimeUs is not None and deferredUs >= latestTimeUs:
+      break
+    if fixedBlock is None:
+      selectedFreq, selectedDR = schedule.parametersOfPeriod(indexPeriod + i)
+    else:
+      selectedFreq, selectedDR = schedule.parametersOfBlock(fixedBlock)
+    airTime = airtime(payloadsize, convertDRtoSF(selectedDR), LoRa.BW_125KHZ, LoRa.CODING_4_5)
+    if latestTimeUs is not None and deferredUs + int(round(airTime*1000000)) + guardTimeUs > latestTimeUs:
+      continue
+    if (airTime + 2*borderEffectGuardTime <= schedule.durationOfPeriod):
+      if (debug > 0):
+        print("[DEBUG] Transmission deferred {:d} periods".format(i))
+      return [deferredUs, selectedFreq, selectedDR]
+  return None
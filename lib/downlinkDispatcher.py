@@ -0,0 +1,143 @@
+# Class C downlinks during the steady-state operation (after the #JOINACC#)
+#
+# Between uplinks, the main loop (or the radio RX task of caraRuntime.py) passes
+# every received downlink to DownlinkDispatcher.handle(). Command frames:
+#   #JOINACC# (binary or text, see joinAccept.py): reconfiguration of the CARA
+#   assignment (SF mask and initial resource block; assignment algorithm, duration
+#   of period and load hints if included, otherwise the current ones are kept).
+# The new schedule is built when the command is received and replaces the current
+# one at the next period boundary of the current schedule (within one period), so
+# every period of the current schedule uses a single schedule and the LoRaWAN
+# session is kept (with a new duration of period, the first period of the new
+# schedule starts before the swap). A command received before the swap replaces
+# the pending one. A command whose schedule cannot be built is rejected. Other
+# downlinks (application data) are passed to onOther. The times are integer
+# microseconds of the time base (CARAClock.nowUs(), see CARASchedule.periodAtUs).
+# While main.py waits for the next transmission (waitUntil), the device blocks in
+# poller.poll() (select.poll with the LoRa socket registered), so it wakes up for
+# every downlink; the last SLEEP_MARGIN_US are slept with the time base.
+
+from joinAccept import parseJoinAccept
+
+# CARA assignment of a schedule (keys of the #JOINACC# dict, see joinAccept.py)
+CONFIG_KEYS = ('sfMask', 'initialResourceBlock', 'algorithm', 'durationOfPeriod', 'loadHints')
+# End of the wait slept with the time base, without the socket (us)
+SLEEP_MARGIN_US = 50000
+# Maximum time blocked in poller.poll(), the tick counter of the time base is read
+# at least every minute (ms, see caraClock.py)
+MAX_POLL_MS = 60000
+
+def swapTime(current, nowUs):
+  # Next period boundary of the current schedule after nowUs
+  return current.periodStartUs(current.periodAtUs(nowUs) + 1)
+
+class DownlinkDispatcher:
+  """ command frames of the downlinks, schedule swapped at a period boundary """
+
+  def __init__(self, schedule, config, scheduleFactory, onOther=None):
+    self.schedule = schedule
+    # Assignment of the schedule (dict with CONFIG_KEYS)
+    self.config = config
+    # scheduleFactory(config): schedule of an assignment (raises if not valid)
+    self.scheduleFactory = scheduleFactory
+    # onOther(data, port): downlinks that are not commands
+    self.onOther = onOther
+    self.pendingSchedule = None
+    self.pendingConfig = None
+    self.pendingPeriodFromCommand = False
+    self.activationUs = None
+    # The duration of period of the schedule was sent in a command (kept when the
+    # CARA parameters are refreshed)
+    self.periodFromCommand = False
+    # Statistics
+    self.received = 0
+    self.commands = 0
+    self.rejected = 0
+    self.swaps = 0
+
+  def handle(self, data, port, nowUs):
+    # Returns True if the downlink is a reconfiguration (applied at activationUs)
+    self.received = self.received + 1
+    joinAccept = parseJoinAccept(data)
+    if joinAccept is None:
+      if self.onOther is not None:
+        self.onOther(data, port)
+      return False
+    if joinAccept['caraEnabled'] != 1:
+      self.rejected = self.rejected + 1
+      print("[INFO] Reconfiguration without CARA ignored")
+      return False
+    config = dict(self.config)
+    for key in CONFIG_KEYS:
+      if joinAccept[key] is not None:
+        config[key] = joinAccept[key]
+    try:
+      schedule = self.scheduleFactory(config)
+      activationUs = swapTime(self.schedule, nowUs)
+    except Exception as e:
+      self.rejected = self.rejected + 1
+      print("[INFO] Reconfiguration ignored:", e)
+      return False
+    self.pendingSchedule = schedule
+    self.pendingConfig = config
+    self.pendingPeriodFromCommand = joinAccept['durationOfPeriod'] is not None
+    self.activationUs = activationUs
+    self.commands = self.commands + 1
+    print("[INFO] Reconfiguration received (SF mask = {:d}, initial resource block = {:d}, duration of period = {:.3f} s), from t={:.3f}".format(
+      config['sfMask'], config['initialResourceBlock'], config['durationOfPeriod'], self.activationUs/1000000))
+    return True
+
+  def poll(self, s, nowUs, size=64):
+    # Dispatches the downlinks received by the (non-blocking) LoRa socket
+    count = 0
+    while True:
+      try:
+        data, port = s.recvfrom(size)
+      except OSError:
+        break
+      if len(data) == 0:
+        break
+      self.handle(data, port, nowUs)
+      count = count + 1
+    return count
+
+  def waitUntil(self, s, poller, clock, us):
+    # Sleeps until us (clock: CARAClock) and dispatches the downlinks received
+    # meanwhile (s: non-blocking LoRa socket, registered in poller). Returns the
+    # number of wake ups of the socket
+    wakeups = 0
+    while True:
+      remaining = us - clock.nowUs()
+      if remaining <= SLEEP_MARGIN_US:
+        clock.sleepUntilUs(us)
+        return wakeups
+      if len(poller.poll(min((remaining - SLEEP_MARGIN_US + 999)//1000, MAX_POLL_MS))) > 0:
+        wakeups = wakeups + 1
+        self.poll(s, clock.nowUs())
+
+  def setSchedule(self, schedule, config):
+    # Schedule replaced outside the downlinks (new CARA parameters), a pending
+    # reconfiguration is kept
+    self.schedule = schedule
+    self.config = config
+
+  def setPeriod(self, durationOfPeriod):
+    # New duration of period (CARA parameters refreshed), applied at once
+    config = dict(self.config)
+    config['durationOfPeriod'] = durationOfPeriod
+    self.setSchedule(self.scheduleFactory(config), config)
+
+  def pendingBefore(self, us):
+    # A reconfiguration is in effect at us but not swapped yet
+    return self.pendingSchedule is not None and us >= self.activationUs
+
+  def scheduleAt(self, us):
+    # Schedule of a transmission at us (never decreases)
+    if self.pendingBefore(us):
+      self.schedule = self.pendingSchedule
+      self.config = self.pendingConfig
+      self.periodFromCommand = self.periodFromCommand or self.pendingPeriodFromCommand
+      self.pendingSchedule = None
+      self.pendingConfig = None
+      self.swaps = self.swaps + 1
+    return self.schedule
@@ -0,0 +1,142 @@
+# #JOINACC# downlink: compact binary format and text format
+#
+# Text format (as sent by the CARA server so far):
+#   "#JOINACC# caraEnabled initialResourceBlock sfMask [algorithm [loadHints]]"
+#   (if CARA is disabled, the initial resource block is the DR)
+# Binary format (little endian), parsed from the received buffer with
+# struct.unpack_from (no decoding or splitting):
+#   magic (JOINACC_MAGIC), version, flags, initialResourceBlock (or DR), sfMask,
+#   then the optional fields given by the flags, in this order:
+#     FLAG_ALGORITHM:  assignment algorithm (1 byte, see ASSIGNMENT_ALGORITHM_NAMES)
+#     FLAG_PERIOD:     durationOfPeriod (2 bytes, ms)
+#     FLAG_LOAD_HINTS: load of SF7...SF12 (6 bytes)
+# The magic is not '#', so both formats can be received. Downlinks that are not
+# a valid #JOINACC# (or have an unknown version) are ignored (None).
+
+import struct
+
+from caraScheduler import parseLoadHints, ASSIGNMENT_ALGORITHM_NAMES
+
+JOINACC_TEXT = b'#JOINACC#'
+JOINACC_MAGIC = 0xCA
+JOINACC_VERSION = 1
+JOINACC_HEADER = '<BBBBB'
+JOINACC_HEADER_SIZE = struct.calcsize(JOINACC_HEADER)
+
+FLAG_CARA_ENABLED = 0x01
+FLAG_ALGORITHM = 0x02
+FLAG_PERIOD = 0x04
+FLAG_LOAD_HINTS = 0x08
+
+# Valid durationOfPeriod (s): not 0 (the period index divides by it), and at most
+# a minute (the longest frame, SF12 with 255 bytes, lasts about 14 s)
+MAX_DURATION_OF_PERIOD = 60.0
+
+def newJoinAccept(caraEnabled, initialResourceBlock, sfMask=0, algorithm=None, durationOfPeriod=None, loadHints=None):
+  return {'caraEnabled': caraEnabled, 'initialResourceBlock': initialResourceBlock, 'sfMask': sfMask,
+          'algorithm': algorithm, 'durationOfPeriod': durationOfPeriod, 'loadHints': loadHints}
+
+def parseBinaryJoinAccept(data):
+  view = memoryview(data)
+  if len(view) < JOINACC_HEADER_SIZE:
+    return None
+  magic, version, flags, initialResourceBlock, sfMask = struct.unpack_from(JOINACC_HEADER, view, 0)
+  if magic != JOINACC_MAGIC or version != JOINACC_VERSION:
+    return None
+  size = JOINACC_HEADER_SIZE
+  if flags & FLAG_ALGORITHM:
+    size = size + 1
+  if flags & FLAG_PERIOD:
+    size = size + 2
+  if flags & FLAG_LOAD_HINTS:
+    size = size + 6
+  if len(view) != size:
+    return None
+  joinAccept = newJoinAccept(flags & FLAG_CARA_ENABLED, initialResourceBlock, sfMask)
+  offset = JOINACC_HEADER_SIZE
+  if flags & FLAG_ALGORITHM:
+    joinAccept['algorithm'] = view[offset]
+    offset = offset + 1
+  if flags & FLAG_PERIOD:
+    joinAccept['durationOfPeriod'] = struct.unpack_from('<H', view, offset)[0]/1000
+    offset = offset + 2
+  if flags & FLAG_LOAD_HINTS:
+    joinAccept['loadHints'] = list(view[offset:offset + 6])
+  return joinAccept
+
+def parseTextJoinAccept(data):
+  try:
+    fields = bytes(data).decode('utf-8').split()
+    if len(fields) < 3:
+      return None
+    caraEnabled = int(fields[1])
+    if caraEnabled != 1:
+      return newJoinAccept(caraEnabled, int(fields[2]))
+    joinAccept = newJoinAccept(caraEnabled, int(fields[2]), int(fields[3]))
+    # Optional fields: assignment algorithm and load of each SF (SF7,SF8,...)
+    if len(fields) > 4:
+      joinAccept['algorithm'] = int(fields[4])
+    if len(fields) > 5:
+      joinAccept['loadHints'] = parseLoadHints(fields[5])
+    return joinAccept
+  except (ValueError, IndexError, UnicodeError):
+    return None
+
+def validJoinAccept(joinAccept):
+  # The initial resource block exists in the SF mask (8 channels per SF), or is a
+  # DR if CARA is disabled; the duration of period (if included) is in range
+  durationOfPeriod = joinAccept['durationOfPeriod']
+  if durationOfPeriod is not None and not 0 < durationOfPeriod <= MAX_DURATION_OF_PERIOD:
+    return False
+  if joinAccept['caraEnabled'] != 1:
+    return 0 <= joinAccept['initialResourceBlock'] <= 5
+  sfMask = joinAccept['sfMask']
+  blocks = 0
+  for bit in range(0, 6):
+    blocks = blocks + 8*((sfMask >> bit) & 1)
+  if not 0 <= joinAccept['initialResourceBlock'] < blocks:
+    return False
+  algorithm = joinAccept['algorithm']
+  return algorithm is None or 0 <= algorithm < len(ASSIGNMENT_ALGORITHM_NAMES)
+
+def parseJoinAccept(data):
+  # dict (newJoinAccept) from a received downlink (binary or text), None if it
+  # is not a valid #JOINACC#
+  if len(data) == 0:
+    return None
+  if data[0] == JOINACC_MAGIC:
+    joinAccept = parseBinaryJoinAccept(data)
+  elif data[0:len(JOINACC_TEXT)] == JOINACC_TEXT:
+    joinAccept = parseTextJoinAccept(data)
+  else:
+    return None
+  if joinAccept is None or not validJoinAccept(joinAccept):
+    return None
+  return joinAccept
+
+def packJoinAccept(caraEnabled, initialResourceBlock, sfMask=0, algorithm=None, durationOfPeriod=None, loadHints=None):
+  # Binary #JOINACC# (CARA server side and tests)
+  flags = FLAG_CARA_ENABLED if caraEnabled == 1 else 0
+  data = bytearray()
+  if algorithm is not None:
+    flags = flags | FLAG_ALGORITHM
+    data.append(algorithm)
+  if durationOfPeriod is not None:
+    flags = flags | FLAG_PERIOD
+    data.extend(struct.pack('<H', int(round(1000*durationOfPeriod))))
+  if loadHints is not None:
+    flags = flags | FLAG_LOAD_HINTS
+    hints = [min(255, max(0, int(load))) for load in loadHints[0:6]]
+    data.extend(bytes(hints + [0]*(6 - len(hints))))
+  return struct.pack(JOINACC_HEADER, JOINACC_MAGIC, JOINACC_VERSION, flags, initialResourceBlock, sfMask) + bytes(data)
+
+def formatJoinAccept(caraEnabled, initialResourceBlock, sfMask=0, algorithm=None, loadHints=None):
+  # Text #JOINACC# (CARA server side and tests)
+  if caraEnabled != 1:
+    return '#JOINACC# {:d} {:d}'.format(caraEnabled, initialResourceBlock).encode()
+  text = '#JOINACC# 1 {:d} {:d}'.format(initialResourceBlock, sfMask)
+  if algorithm is not None:
+    text = text + ' {:d}'.format(algorithm)
+    if loadHints is not None:
+      text = text + ' ' + ','.join(str(load) for load in loadHints)
+  return text.encode()
@@ -0,0 +1,46 @@
+# Retransmission policy for the CARA #JOINREQ# message
+#
+# Fixed policy: the JOINREQ is retransmitted every rtxTime seconds (all the
+# devices that started at the same time, e.g. after a gateway outage, keep
+# transmitting at the same time).
+# Backoff policy: exponential backoff with full jitter, i.e. the time before the
+# n-th retransmission is minTime + rand(0, min(maxTime, rtxTime*2^n)).
+# Optionally, the spreading factor is increased (DR decreased) every
+# escalateEvery attempts, down to minDR.
+# The exponent n is capped at MAX_BACKOFF_EXPONENT (2^n stays a small int and
+# rtxTime*2^n cannot overflow, whatever the number of attempts).
+
+MAX_BACKOFF_EXPONENT = 30
+
+class JoinReqPolicy:
+  """ time to wait before each JOINREQ retransmission and DR of each attempt """
+
+  def __init__(self, random, rtxTime=5.0, backoff=True, maxTime=60.0, minTime=1.0, initialDR=5, minDR=5, escalateEvery=0):
+    # random() returns a random number in [0, 1]
+    self.random = random
+    self.rtxTime = rtxTime
+    self.backoff = backoff
+    self.maxTime = maxTime
+    self.minTime = minTime
+    self.initialDR = initialDR
+    self.minDR = minDR
+    self.escalateEvery = escalateEvery
+    self.reset()
+
+  def reset(self):
+    self.attempt = 0
+
+  def dataRate(self):
+    # DR for the current attempt
+    if self.escalateEvery <= 0:
+      return self.initialDR
+    return max(self.minDR, self.initialDR - self.attempt//self.escalateEvery)
+
+  def nextTimeout(self):
+    # Time (seconds) to wait for the #JOINACC# after the current attempt
+    if self.backoff:
+      timeout = self.minTime + self.random()*min(self.maxTime, self.rtxTime*(2**min(self.attempt, MAX_BACKOFF_EXPONENT)))
+    else:
+      timeout = self.rtxTime
+    self.attempt = self.attempt + 1
+    return timeout
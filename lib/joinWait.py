@@ -0,0 +1,52 @@
+# Wait for the #JOINACC# after the #JOINREQ# (receiveJoinAccept of main.py)
+#
+# The device blocks in poller.poll() (select.poll with the LoRa socket registered)
+# until a downlink is received or the JOINREQ retransmission deadline (given by a
+# joinReqPolicy.JoinReqPolicy) is reached, instead of polling the socket. The
+# deadline is computed with ticks_add(), so the wrap of the tick counter is
+# handled. The socket, the poller and the tick functions (utime) are parameters,
+# so tools/joinWaitCheck.py runs this loop with fakes in virtual time.
+
+from joinAccept import parseJoinAccept
+
+JOINREQ_MESSAGE = "#JOINREQ#"
+
+# Debug messages
+debug = 0
+
+def waitForJoinAccept(s, poller, policy, ticks_ms, ticks_add, ticks_diff, beforeJoinReq=None, onDownlink=None):
+  # Sends the JOINREQ (and its retransmissions) until a valid #JOINACC# is received:
+  # returns (joinAccept dict, size of the downlink, wake ups). beforeJoinReq() is
+  # called before every JOINREQ (DR of the attempt), onDownlink(data, port) for
+  # every downlink received
+  wakeups = 0
+  timeToRetransmitJoinReq = True
+  while True:
+    if timeToRetransmitJoinReq:
+      if beforeJoinReq is not None:
+        beforeJoinReq()
+      s.setblocking(True)
+      s.send(JOINREQ_MESSAGE)
+      print("[INFO] #JOINREQ# sent!")
+      s.setblocking(False)
+      timeToRetransmitJoinReq = False
+      joinReqTimeout = policy.nextTimeout()
+      if (debug > 0):
+        print("[DEBUG] Next #JOINREQ# in {:.1f} s".format(joinReqTimeout))
+      deadlineJoinReq = ticks_add(ticks_ms(), int(1000*joinReqTimeout))
+
+    timeToWait = ticks_diff(deadlineJoinReq, ticks_ms())
+    if (timeToWait <= 0) or (len(poller.poll(timeToWait)) == 0):
+      # Deadline reached without any downlink
+      timeToRetransmitJoinReq = True
+      continue
+    wakeups = wakeups + 1
+
+    data, port = s.recvfrom(64)
+    if len(data) > 0:
+      if onDownlink is not None:
+        onDownlink(data, port)
+      # Binary or text #JOINACC# (see joinAccept.py), parsed from the received buffer
+      joinAccept = parseJoinAccept(data)
+      if joinAccept is not None:
+        return joinAccept, len(data), wakeups
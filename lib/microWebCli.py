@@ -103,87 +103,148 @@ class MicroWebCli :
     def _unquote_plus(s) :
         return MicroWebCli._unquote(str(s).replace('+', ' '))
 
+    # ============================================================================
+    # ===( Connections pool )=====================================================
+    # ============================================================================
+
+    ConnPoolMaxPerHost = 2
+    ConnOpenedCount    = 0
+    ConnReusedCount    = 0
+    _connPool          = { }
+
+    # Largest read of the content on the socket (ReadContent of the whole content)
+    ContentPartMaxSize = 1024
+
+    # ----------------------------------------------------------------------------
+
+    def _getPooledConnection(key) :
+        conns = MicroWebCli._connPool.get(key, None)
+        if conns :
+            return conns.pop()
+        return None
+
+    # ----------------------------------------------------------------------------
+
+    def _putPooledConnection(key, cli, addr) :
+        conns = MicroWebCli._connPool.get(key, None)
+        if conns is None :
+            conns = [ ]
+            MicroWebCli._connPool[key] = conns
+        if len(conns) < MicroWebCli.ConnPoolMaxPerHost :
+            conns.append((cli, addr))
+            return True
+        return False
+
     # ----------------------------------------------------------------------------
 
-    def GETRequest(url, queryParams=None, auth=None, connTimeoutSec=10, socks5Addr=None) :
-        c = MicroWebCli(url, auth=auth, connTimeoutSec=connTimeoutSec, socks5Addr=socks5Addr)
+    def ClosePool(key=None) :
+        for k in list(MicroWebCli._connPool) :
+            if key is None or k == key :
+                for cli, addr in MicroWebCli._connPool.pop(k) :
+                    try :
+                        cli.close()
+                    except :
+                        pass
+
+    # ----------------------------------------------------------------------------
+
+    def _openRequestAndGetResponse(c, openRequest) :
+        try :
+            openRequest()
+            return c.GetResponse()
+        except :
+            if not c._socketReused :
+                raise
+        # The pooled connection has been closed by the server, retry with a new one
+        c.Close()
+        MicroWebCli.ClosePool(c._poolKey())
+        openRequest()
+        return c.GetResponse()
+
+    # ============================================================================
+    # ===( Requests )=============================================================
+    # ============================================================================
+
+    def GETRequest(url, queryParams=None, auth=None, connTimeoutSec=10, socks5Addr=None, keepAlive=False) :
+        c = MicroWebCli(url, auth=auth, connTimeoutSec=connTimeoutSec, socks5Addr=socks5Addr, keepAlive=keepAlive)
         if queryParams :
             c.QueryParams = queryParams
-        c.OpenRequest()
-        r = c.GetResponse()
+        r = MicroWebCli._openRequestAndGetResponse(c, c.OpenRequest)
         if r.IsSuccess() :
             return r.ReadContent()
-        r.Close()
+        r._discardContent()
         if r.IsLocationMoved() :
-            return MicroWebCli.GETRequest(r.LocationMovedURL(), queryParams, auth, connTimeoutSec, socks5Addr)
+            return MicroWebCli.GETRequest(r.LocationMovedURL(), queryParams, auth, connTimeoutSec, socks5Addr, keepAlive)
         return None
 
     # ----------------------------------------------------------------------------
 
-    def POSTRequest(url, formData={}, auth=None, connTimeoutSec=10, socks5Addr=None) :
-        c = MicroWebCli(url, method='POST', auth=auth, connTimeoutSec=connTimeoutSec, socks5Addr=socks5Addr)
-        c.OpenRequestFormData(formData)
-        r = c.GetResponse()
+    def POSTRequest(url, formData={}, auth=None, connTimeoutSec=10, socks5Addr=None, keepAlive=False) :
+        c = MicroWebCli(url, method='POST', auth=auth, connTimeoutSec=connTimeoutSec, socks5Addr=socks5Addr, keepAlive=keepAlive)
+        r = MicroWebCli._openRequestAndGetResponse(c, lambda : c.OpenRequestFormData(formData))
         if r.IsSuccess() :
             return r.ReadContent()
-        r.Close()
+        r._discardContent()
         if r.IsLocationMoved() :
-            return MicroWebCli.POSTRequest(r.LocationMovedURL(), formData, auth, connTimeoutSec, socks5Addr)
+            return MicroWebCli.POSTRequest(r.LocationMovedURL(), formData, auth, connTimeoutSec, socks5Addr, keepAlive)
         return None
 
     # ----------------------------------------------------------------------------
 
-    def JSONRequest(url, o=None, auth=None, connTimeoutSec=10, socks5Addr=None) :
+    def JSONRequest(url, o=None, auth=None, connTimeoutSec=10, socks5Addr=None, keepAlive=False) :
         c = MicroWebCli( url,
                          method         = ('POST' if o else 'GET'),
                          auth           = auth,
                          connTimeoutSec = connTimeoutSec,
-                         socks5Addr     = socks5Addr )
+                         socks5Addr     = socks5Addr,
+                         keepAlive      = keepAlive )
         if o :
-            c.OpenRequestJSONData(o)
+            r = MicroWebCli._openRequestAndGetResponse(c, lambda : c.OpenRequestJSONData(o))
         else :
-            c.OpenRequest()
-        r = c.GetResponse()
+            r = MicroWebCli._openRequestAndGetResponse(c, c.OpenRequest)
         if r.IsSuccess() :
             return r.ReadContentAsJSON()
-        r.Close()
+        r._discardContent()
         if r.IsLocationMoved() :
-            return MicroWebCli.JSONRequest(r.LocationMovedURL(), o, auth, connTimeoutSec, socks5Addr)
+            return MicroWebCli.JSONRequest(r.LocationMovedURL(), o, auth, connTimeoutSec, socks5Addr, keepAlive)
         return None
 
     # ----------------------------------------------------------------------------
 
-    def FileRequest(url, filepath, progressCallback=None, auth=None, connTimeoutSec=10, socks5Addr=None) :
-        c = MicroWebCli(url, auth=auth, connTimeoutSec=connTimeoutSec, socks5Addr=socks5Addr)
-        c.OpenRequest()
-        r = c.GetResponse()
+    def FileRequest(url, filepath, progressCallback=None, auth=None, connTimeoutSec=10, socks5Addr=None, keepAlive=False) :
+        c = MicroWebCli(url, auth=auth, connTimeoutSec=connTimeoutSec, socks5Addr=socks5Addr, keepAlive=keepAlive)
+        r = MicroWebCli._openRequestAndGetResponse(c, c.OpenRequest)
         if r.IsSuccess() :
             r.WriteContentToFile(filepath, progressCallback)
             return r.GetContentType()
-        r.Close()
+        r._discardContent()
         if r.IsLocationMoved() :
             return MicroWebCli.FileRequest( r.LocationMovedURL(),
                                             filepath,
                                             progressCallback,
                                             auth,
                                             connTimeoutSec,
-                                            socks5Addr )
+                                            socks5Addr,
+                                            keepAlive )
         return None
 
     # ============================================================================
     # ===( Constructor )==========================================================
     # ============================================================================
 
-    def __init__(self, url='', method='GET', auth=None, connTimeoutSec=10, socks5Addr=None) :
+    def __init__(self, url='', method='GET', auth=None, connTimeoutSec=10, socks5Addr=None, keepAlive=False) :
         self.URL            = url
         self.Method         = method
         self.Auth           = auth
         self.ConnTimeoutSec = connTimeoutSec
+        self.KeepAlive      = keepAlive
         self._socks5Addr    = socks5Addr
         self._headers       = { }
         self._socket        = None
         self._socketAddr    = None
+        self._socketReused  = False
         self._response      = None
+        self._head          = None
 
     # ============================================================================
     # ===( Functions )============================================================
@@ -207,28 +268,37 @@ class MicroWebCli :
         qs   = self.QueryString
         if qs != '' :
             path = path + '?' + qs
-        self._write('%s %s HTTP/1.0\r\n' % (self.Method, path))
+        self._head = ['%s %s %s\r\n' % (self.Method, path, 'HTTP/1.1' if self.KeepAlive else 'HTTP/1.0')]
 
     # ------------------------------------------------------------------------
 
     def _writeHeader(self, name, value) :
-        self._write("%s: %s\r\n" % (name, value))
+        self._head.append("%s: %s\r\n" % (name, value))
 
     # ------------------------------------------------------------------------
 
-    def _writeEndHeader(self) :
-        self._write("\r\n")
+    def _writeEndHeader(self, data=None) :
+        # The first line, the headers and the data are sent in a single write:
+        # after the first one, small writes wait for the TCP acknowledgement
+        # (Nagle), which is delayed on a reused connection
+        self._head.append("\r\n")
+        head      = ''.join(self._head)
+        self._head = None
+        if data :
+            if isinstance(data, str) :
+                head += data
+            else :
+                head = head.encode() + bytes(data)
+        self._write(head)
 
     # ------------------------------------------------------------------------
 
-    def OpenRequest( self,
-                     data           = None,
-                     contentType    = None,
-                     contentLength  = None ) :
-        if self._socket :
-            raise Exception('Request is already opened')
-        if not self.URL :
-            raise Exception('No URL defined')
+    def _poolKey(self) :
+        return (self.Proto, self.Host, self.Port, self.Socks5Addr)
+
+    # ------------------------------------------------------------------------
+
+    def _openConnection(self) :
         if self.Socks5Addr :
             if not isinstance(self.Socks5Addr, tuple) or len(self.Socks5Addr) != 2 :
                 raise Exception('"Socks5Addr" must be a tuple of (host, port)')
@@ -238,7 +308,6 @@ class MicroWebCli :
         else :
             host = self.Host
             port = self.Port
-        self._response = None
         try :
             self._socketAddr = socket.getaddrinfo(host, port)[0][-1]
             cli              = socket.socket( socket.AF_INET,
@@ -286,6 +355,27 @@ class MicroWebCli :
             except Exception as ex :
                 cli.close()
                 raise Exception('Error to open a secure SSL/TLS connection (%s)' % ex)
+        MicroWebCli.ConnOpenedCount += 1
+        return cli
+
+    # ------------------------------------------------------------------------
+
+    def OpenRequest( self,
+                     data           = None,
+                     contentType    = None,
+                     contentLength  = None ) :
+        if self._socket :
+            raise Exception('Request is already opened')
+        if not self.URL :
+            raise Exception('No URL defined')
+        self._response = None
+        pooled = MicroWebCli._getPooledConnection(self._poolKey()) if self.KeepAlive else None
+        self._socketReused = pooled is not None
+        if pooled :
+            cli, self._socketAddr = pooled
+            MicroWebCli.ConnReusedCount += 1
+        else :
+            cli = self._openConnection()
         self._socket = cli
         self._writeFirstLine()
         if data :
@@ -306,12 +396,14 @@ class MicroWebCli :
             self._headers['Content-Length'] = contentLength
         else :
             self._headers.pop('Content-Length', None)
+        if self.KeepAlive :
+            self._headers['Connection'] = 'keep-alive'
+        else :
+            self._headers.pop('Connection', None)
         self._headers['User-Agent'] = 'MicroWebCli by JC`zic'
         for h in self._headers :
             self._writeHeader(h, self._headers[h])
-        self._writeEndHeader()
-        if data :
-            self._write(data)
+        self._writeEndHeader(data)
 
     # ------------------------------------------------------------------------
 
@@ -365,6 +457,15 @@ class MicroWebCli :
                 pass
             self._socket = None
 
+    # ------------------------------------------------------------------------
+
+    def _releaseConnection(self) :
+        if self._socket :
+            if MicroWebCli._putPooledConnection(self._poolKey(), self._socket, self._socketAddr) :
+                self._socket = None
+            else :
+                self.Close()
+
     # ============================================================================
     # ===( Properties )===========================================================
     # ============================================================================
@@ -379,6 +480,16 @@ class MicroWebCli :
 
     # ------------------------------------------------------------------------
 
+    @property
+    def KeepAlive(self) :
+        return self._keepAlive
+
+    @KeepAlive.setter
+    def KeepAlive(self, value) :
+        self._keepAlive = bool(value)
+
+    # ------------------------------------------------------------------------
+
     @property
     def Method(self) :
         return self._method
@@ -575,6 +686,10 @@ class MicroWebCli :
             self._headers       = { }
             self._contentType   = None
             self._contentLength = None
+            self._chunked       = False
+            self._keepAlive     = False
+            self._remaining     = None
+            self._contentEnded  = False
             self._processResponse()
 
         # ------------------------------------------------------------------------
@@ -583,8 +698,10 @@ class MicroWebCli :
             try :
                 self._parseFirstLine()
                 self._parseHeader()
-                if self._contentLength == 0 :
-                    self.Close()
+                if self._contentLength == 0 or \
+                   self._code in (204, 304) or \
+                   self._microWebCli.Method == 'HEAD' :
+                    self._endOfContent()
             except :
                 self._microWebCli.Close()
                 raise Exception('Error to get response')
@@ -612,10 +729,127 @@ class MicroWebCli :
                     self._contentType   = self._headers.get("Content-Type", None)
                     ctLen               = self._headers.get("Content-Length", None)
                     self._contentLength = int(ctLen) if ctLen is not None else None
+                    te                  = self._getHeader("Transfer-Encoding")
+                    self._chunked       = te is not None and 'chunked' in te.lower()
+                    if self._chunked :
+                        self._contentLength = None
+                        self._remaining     = 0
+                    else :
+                        self._remaining     = self._contentLength
+                    conn = self._getHeader("Connection")
+                    conn = conn.lower() if conn else ''
+                    if self._httpVer == 'HTTP/1.1' :
+                        keepAlive = (conn != 'close')
+                    else :
+                        keepAlive = (conn == 'keep-alive')
+                    # The connection can only be reused if the end of the content is known
+                    self._keepAlive = self._microWebCli.KeepAlive and keepAlive and \
+                                      ( self._chunked or self._contentLength is not None )
                     break
 
         # ------------------------------------------------------------------------
 
+        def _getHeader(self, name) :
+            name = name.lower()
+            for h in self._headers :
+                if h.lower() == name :
+                    return self._headers[h]
+            return None
+
+        # ------------------------------------------------------------------------
+
+        def _endOfContent(self) :
+            if self._contentEnded :
+                return
+            self._contentEnded = True
+            if self._keepAlive :
+                self._microWebCli._releaseConnection()
+            else :
+                self.Close()
+
+        # ------------------------------------------------------------------------
+
+        def _contentAvailable(self) :
+            # Returns the number of bytes that can be read before the end of the
+            # content (or of the current chunk), None if unknown (until closed)
+            if self._contentEnded :
+                return 0
+            if self._chunked and self._remaining == 0 :
+                line = self._socket.readline()
+                if not line :
+                    raise Exception('Connection closed in chunked content')
+                self._remaining = int(line.split(b';', 1)[0].strip(), 16)
+                if self._remaining == 0 :
+                    # Last chunk, skip trailer headers
+                    while len(self._socket.readline().strip()) > 0 :
+                        pass
+                    self._endOfContent()
+            return self._remaining
+
+        # ------------------------------------------------------------------------
+
+        def _readContentPart(self, size=None) :
+            n = self._contentAvailable()
+            if n == 0 :
+                return b''
+            if n is None :
+                b = self._socket.read(size) if size else self._socket.read()
+                if not b or size is None or len(b) < size :
+                    self._endOfContent()
+                return b
+            if size is None or size > n :
+                size = n
+            b = self._socket.read(size)
+            if not b :
+                raise Exception('Connection closed before the end of content')
+            self._remaining -= len(b)
+            if self._remaining == 0 :
+                if self._chunked :
+                    self._socket.readline()
+                else :
+                    self._endOfContent()
+            return b
+
+        # ------------------------------------------------------------------------
+
+        def _readContentPartInto(self, buf) :
+            n = self._contentAvailable()
+            if n == 0 :
+                return 0
+            if n is not None and len(buf) > n :
+                buf = buf[:n]
+            x = self._socket.readinto(buf)
+            if n is None :
+                if not x or x < len(buf) :
+                    self._endOfContent()
+                return x or 0
+            if not x :
+                raise Exception('Connection closed before the end of content')
+            self._remaining -= x
+            if self._remaining == 0 :
+                if self._chunked :
+                    self._socket.readline()
+                else :
+                    self._endOfContent()
+            return x
+
+        # ------------------------------------------------------------------------
+
+        def _discardContent(self) :
+            # Reads and drops a small content (error page) to keep the connection
+            # reusable, otherwise closes the connection
+            if self._keepAlive and not self._contentEnded and \
+               ( self._chunked or self._contentLength <= 1024 ) :
+                try :
+                    while self._readContentPart(256) :
+                        pass
+                    return
+                except :
+                    pass
+            self.Close()
+
+        # ------------------------------------------------------------------------
+
         def GetClient(self) :
             return self._microWebCli
 
@@ -686,13 +920,23 @@ class MicroWebCli :
         def ReadContent(self, size=None) :
             try :
                 if size is None :
-                    b = self._socket.read()
-                    self.Close()
-                    return b
+                    # Read in parts, never in a single read of unknown size
+                    parts = [ ]
+                    while not self._contentEnded :
+                        b = self._readContentPart(MicroWebCli.ContentPartMaxSize)
+                        if not b :
+                            break
+                        parts.append(b)
+                    return b''.join(parts)
                 elif size > 0 :
-                    b = self._socket.read(size)
+                    b = self._readContentPart(size)
+                    while b and len(b) < size and not self._contentEnded :
+                        x = self._readContentPart(size - len(b))
+                        if not x :
+                            break
+                        b += x
                     if len(b) < size :
-                        self.Close()
+                        self._endOfContent()
                     return b
             except MemoryError as memEx :
                 self.Close()
@@ -708,9 +952,15 @@ class MicroWebCli :
                 nbytes = len(buf)
             if nbytes > 0 :
                 try :
-                    x = self._socket.readinto(buf, nbytes)
+                    buf = memoryview(buf)[:nbytes]
+                    x   = 0
+                    while x < nbytes :
+                        n = self._readContentPartInto(buf[x:])
+                        if n == 0 :
+                            break
+                        x += n
                     if x < nbytes :
-                        self.Close()
+                        self._endOfContent()
                     return x
                 except :
                     self.Close()
@@ -718,13 +968,44 @@ class MicroWebCli :
 
         # ------------------------------------------------------------------------
 
+        def IterContent(self, chunkSize=1024) :
+            # The buffer is allocated once and reused for all the parts, so each
+            # part yielded is only valid until the next one is read
+            buf = MicroWebCli._tryAllocByteArray(chunkSize)
+            if not buf :
+                raise MemoryError('Not enough memory to allocate buffer')
+            return self._iterContent(memoryview(buf))
+
+        # ------------------------------------------------------------------------
+
+        def _iterContent(self, buf) :
+            while not self._contentEnded :
+                x = 0
+                try :
+                    while x < len(buf) :
+                        n = self._readContentPartInto(buf[x:])
+                        if n == 0 :
+                            break
+                        x += n
+                except Exception as ex :
+                    self.Close()
+                    raise Exception('Error to read response content (%s)' % ex)
+                if x == 0 :
+                    break
+                yield buf[:x]
+
+        # ------------------------------------------------------------------------
+
         def ReadContentAsJSON(self) :
-            cnt = self.ReadContent()
+            fSize = self._contentLength
+            cnt   = bytearray()
+            for part in self.IterContent(fSize if fSize and fSize < 1024 else 1024) :
+                cnt.extend(part)
             if cnt :
                 if not 'json' in globals() :
                     import json
                 try :
-                    return json.loads(cnt)
+                    return json.loads(bytes(cnt))
                 except :
                     raise Exception('Error to parse JSON response : %s' % cnt)
             return None
@@ -732,40 +1013,28 @@ class MicroWebCli :
         # ------------------------------------------------------------------------
 
         def WriteContentToFile(self, filepath, progressCallback=None) :
-            fSize = self._contentLength
-            buf   = MicroWebCli._tryAllocByteArray(fSize if fSize and fSize < 1024 else 1024)
-            if not buf :
-                raise MemoryError('Not enough memory to allocate buffer')
-            buf = memoryview(buf)
+            fSize   = self._contentLength
+            content = self.IterContent(fSize if fSize and fSize < 1024 else 1024)
             try :
                 file = open(filepath, 'wb')
             except :
                 raise Exception('Error to create file (%s)' % filepath)
-            sizeRem = fSize
             pgrSize = 0
-            while sizeRem is None or sizeRem > 0 :
-                if sizeRem and sizeRem < len(buf) :
-                    buf = buf[:sizeRem]
-                x = self.ReadContentInto(buf)
-                if x == 0 :
-                    break
-                if x < len(buf) :
-                    buf = buf[:x]
-                if sizeRem :
-                    sizeRem -= x
-                try :
+            try :
+                for buf in content :
                     file.write(buf)
-                except :
-                    break
-                pgrSize += x
-                if progressCallback :
-                    try :
-                        progressCallback(self, pgrSize, fSize)
-                    except Exception as ex :
-                        print('Error in progressCallback : %s' % ex)
+                    pgrSize += len(buf)
+                    if progressCallback :
+                        try :
+                            progressCallback(self, pgrSize, fSize)
+                        except Exception as ex :
+                            print('Error in progressCallback : %s' % ex)
+            except :
+                pass
             file.close()
-            self.Close()
-            if sizeRem and sizeRem > 0 :
+            if not self._contentEnded :
+                self.Close()
+            if not self._contentEnded or (fSize and pgrSize < fSize) :
                 if not 'remove' in globals() :
                     from os import remove
                 remove(filepath)
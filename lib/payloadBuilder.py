@@ -0,0 +1,106 @@
+# Uplink payload builder
+#
+# The payload is written in a preallocated bytearray (no strings or bytes are
+# created for each message, so the GC does not run just before a transmission).
+# A payload is a list of fields with a fixed size, so the payload size (and the
+# air time) is known without building the message:
+#   TextCounterField: "Testing data....1" (the message counter after dots), as
+#                     the previous generateMessage(); the counter wraps around
+#   IntField:         unsigned/signed integer, big endian; the message counter by
+#                     default, or the value returned by read() (e.g. a sensor)
+#   TimestampField:   time of the payload (s since 1970, 4 bytes)
+# Values are written byte by byte (no struct.pack tuples or temporary bytes).
+
+def writeDigits(buffer, offset, size, value, fill):
+  # Decimal value right aligned in buffer[offset:offset+size], filled with fill
+  i = offset + size - 1
+  while i >= offset:
+    buffer[i] = 0x30 + value % 10
+    value = value // 10
+    i = i - 1
+    if value == 0:
+      break
+  while i >= offset:
+    buffer[i] = fill
+    i = i - 1
+
+def writeInt(buffer, offset, size, value):
+  # Big endian (two's complement for negative values)
+  i = offset + size - 1
+  while i >= offset:
+    buffer[i] = value & 0xFF
+    value = value >> 8
+    i = i - 1
+
+class TextCounterField:
+  """ prefix and the message counter after dots (at least one) """
+
+  def __init__(self, prefix=b'Testing data', digits=5):
+    self.prefix = prefix
+    self.digits = digits
+    self.size = len(prefix) + 1 + digits
+    self.modulo = 10**digits
+
+  def start(self, buffer, offset):
+    # Constant part, written once
+    buffer[offset:offset + len(self.prefix)] = self.prefix
+    buffer[offset + len(self.prefix)] = 0x2E
+
+  def write(self, buffer, offset, messageCounter, timestamp):
+    writeDigits(buffer, offset + len(self.prefix) + 1, self.digits, messageCounter % self.modulo, 0x2E)
+
+class IntField:
+  """ integer of size bytes: message counter or read() """
+
+  def __init__(self, size, read=None):
+    self.size = size
+    self.read = read
+
+  def start(self, buffer, offset):
+    pass
+
+  def write(self, buffer, offset, messageCounter, timestamp):
+    writeInt(buffer, offset, self.size, messageCounter if self.read is None else self.read())
+
+class TimestampField(IntField):
+  """ time of the payload (s since 1970) """
+
+  def __init__(self):
+    IntField.__init__(self, 4)
+
+  def write(self, buffer, offset, messageCounter, timestamp):
+    writeInt(buffer, offset, 4, timestamp)
+
+# Payload encodings (main.py payloadEncoding)
+PAYLOAD_ENCODINGS = {
+  'text': lambda: [TextCounterField()],
+  'binary': lambda: [IntField(4), TimestampField()],
+}
+
+class PayloadBuilder:
+  """ payload of fixed size written in a preallocated buffer """
+
+  def __init__(self, fields):
+    self.fields = fields
+    self.offsets = []
+    self.size = 0
+    for field in fields:
+      self.offsets.append(self.size)
+      self.size = self.size + field.size
+    self.buffer = bytearray(self.size)
+    for i in range(len(fields)):
+      fields[i].start(self.buffer, self.offsets[i])
+
+  def build(self, messageCounter, timestamp=0):
+    # Returns the buffer (valid until the next build). Index loop: no iterator object
+    i = 0
+    while i < len(self.fields):
+      self.fields[i].write(self.buffer, self.offsets[i], messageCounter, timestamp)
+      i = i + 1
+    return self.buffer
+
+def createPayloadBuilder(encoding):
+  # encoding: name in PAYLOAD_ENCODINGS or list of fields
+  if isinstance(encoding, str):
+    encoding = PAYLOAD_ENCODINGS[encoding]()
+  return PayloadBuilder(encoding)
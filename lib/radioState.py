@@ -0,0 +1,54 @@
+# Channel plan and data rate currently programmed in the LoRa radio, so that only
+# the changes are programmed before each uplink (with a fixed channel and DR, or
+# several uplinks in the same resource block, nothing has to be programmed)
+
+import socket
+
+# Debug messages
+debug = 0
+
+# Channels used for the CARA resource blocks (all with the same frequency)
+NO_CHANNELS = 15
+
+class RadioState:
+  """ cache of the radio configuration (frequency of the channels and DR) """
+
+  def __init__(self, lora, s, selectedDR=None):
+    self.lora = lora
+    self.s = s
+    self.selectedFreq = None
+    self.selectedDR = selectedDR
+    # Radio configuration calls (lora.add_channel and setsockopt) issued and saved
+    self.callsIssued = 0
+    self.callsSaved = 0
+
+  def invalidate(self):
+    # The channels have been changed without this cache (e.g. removed)
+    self.selectedFreq = None
+
+  def setFrequency(self, selectedFreq):
+    if selectedFreq == self.selectedFreq:
+      self.callsSaved = self.callsSaved + NO_CHANNELS
+      return
+    if (debug > 0):
+      print("[DEBUG] Changing frequency to {:d}".format(selectedFreq))
+    # Add all channels with the selected frequency
+    for channel in range(0, NO_CHANNELS):
+      self.lora.add_channel(channel, frequency=selectedFreq, dr_min=0, dr_max=5)
+    self.callsIssued = self.callsIssued + NO_CHANNELS
+    self.selectedFreq = selectedFreq
+
+  def setDataRate(self, selectedDR):
+    if selectedDR == self.selectedDR:
+      self.callsSaved = self.callsSaved + 1
+      return
+    # Set spreading factor
+    self.s.setsockopt(socket.SOL_LORA, socket.SO_DR, selectedDR)
+    if (debug > 0):
+      print("[DEBUG] Changing DR to {:d} (SF={:d})".format(selectedDR, 12 - selectedDR))
+    self.callsIssued = self.callsIssued + 1
+    self.selectedDR = selectedDR
+
+  def setTransmissionParameters(self, selectedFreq, selectedDR):
+    self.setFrequency(selectedFreq)
+    self.setDataRate(selectedDR)
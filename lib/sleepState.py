@@ -0,0 +1,87 @@
+# State of the device kept across deep sleep (low power mode of main.py)
+#
+# Before sleeping, main.py saves the LoRaWAN session (lora.nvram_save) and this
+# state (message counter, CARA parameters and schedule, time base, energy
+# counters, duty cycle ledger and transmit queue) in a JSON file in the flash.
+# After waking up, if the file is valid (same SLEEP_STATE_VERSION and all the
+# keys), the device restores the LoRaWAN session and this state and goes
+# straight to the next uplink, without Wi-Fi, NTP, HTTP parameters or join.
+
+import json
+try:
+  import uos as os
+except ImportError:
+  import os
+
+SLEEP_STATE_VERSION = 6
+SLEEP_STATE_FILE = '/flash/caraState.json'
+
+SLEEP_STATE_KEYS = (
+  'messageCounter', 'timeLastTransmissionUs', 'nextRandNo',
+  'randomTimeForJoining', 'fixedTime', 'randomTime', 'durationOfPeriod', 'durationOfPeriodFromJoinAccept', 'avoidBorderEffect', 'borderEffectGuardTime',
+  'caraEnabled', 'initialResourceBlock', 'sfMask', 'selectedDR', 'algorithm', 'loadHints',
+  'framesDeferred', 'framesBorderHeld', 'frameHeldAtBorder', 'epochDayUs', 'wakeUpUs', 'energy',
+  'dutyCycle', 'txQueue',
+)
+
+def saveSleepState(state, path=SLEEP_STATE_FILE):
+  state = dict(state)
+  state['version'] = SLEEP_STATE_VERSION
+  # Written to a temporary file first, so a reset while writing keeps the old one
+  with open(path + '.tmp', 'w') as f:
+    f.write(json.dumps(state))
+  try:
+    os.remove(path)
+  except OSError:
+    pass
+  os.rename(path + '.tmp', path)
+
+def loadSleepState(path=SLEEP_STATE_FILE):
+  # Returns the saved state, or None if there is no valid state
+  try:
+    with open(path, 'r') as f:
+      state = json.loads(f.read())
+  except Exception:
+    return None
+  if not isinstance(state, dict) or state.get('version') != SLEEP_STATE_VERSION:
+    return None
+  for key in SLEEP_STATE_KEYS:
+    if key not in state:
+      return None
+  return state
+
+def clearSleepState(path=SLEEP_STATE_FILE):
+  try:
+    os.remove(path)
+  except OSError:
+    pass
+
+# Nominal currents of the FiPy (mA), for the energy estimation
+CURRENT_TX_MA = 110.0
+CURRENT_AWAKE_MA = 65.0
+CURRENT_SLEEP_MA = 0.02
+
+class EnergyEstimate:
+  """ charge used from the time transmitting, awake and sleeping (seconds) """
+
+  def __init__(self, airTime=0.0, awakeTime=0.0, sleepTime=0.0):
+    self.airTime = airTime
+    self.awakeTime = awakeTime
+    self.sleepTime = sleepTime
+
+  def add(self, airTime=0.0, awakeTime=0.0, sleepTime=0.0):
+    self.airTime = self.airTime + airTime
+    self.awakeTime = self.awakeTime + awakeTime
+    self.sleepTime = self.sleepTime + sleepTime
+
+  def charge(self):
+    # mAh (the air time is part of the awake time)
+    return (self.airTime*CURRENT_TX_MA + max(0.0, self.awakeTime - self.airTime)*CURRENT_AWAKE_MA + self.sleepTime*CURRENT_SLEEP_MA)/3600
+
+  def averageCurrent(self):
+    # mA
+    totalTime = self.awakeTime + self.sleepTime
+    return 3600*self.charge()/totalTime if totalTime > 0 else 0.0
+
+  def asList(self):
+    return [self.airTime, self.awakeTime, self.sleepTime]
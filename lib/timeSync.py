@@ -0,0 +1,157 @@
+# NTP synchronization of the RTC with a deadline, fallback and uncertainty
+#
+# rtc.ntp_sync() starts the synchronization in the background; synchronize()
+# waits for it at most `deadline` seconds (polling rtc.synced()), so the device
+# does not hang without NTP. If NTP is not available, the RTC keeps its time
+# (e.g. after a reset) and the time of the last synchronization and the drift
+# estimate, persisted in the flash, give the uncertainty of the time. poll()
+# restarts the synchronization every resyncPeriod seconds (in the background)
+# and estimates the drift of the RTC from the correction of each resync.
+#
+# uncertainty() (seconds) is NTP_UNCERTAINTY plus the drift since the last
+# synchronization, or None if the time is unknown (never synchronized or no
+# valid RTC); main.py widens the border effect guard time to it when it is
+# larger than the configured guard time (widenedGuardTime).
+# If the RTC has lost its time (power loss) and NTP is not available, nothing
+# persisted in the flash gives the current time (the time without power is
+# unknown): waitUntilKnown() holds the device (and its uplinks, which would use
+# the CARA periods of a wrong time) until a synchronization sets the RTC.
+
+import json
+try:
+  import utime
+except ImportError:
+  utime = None
+
+from caraClock import rtcToUs
+
+TIME_SYNC_FILE = '/flash/timeSync.json'
+# Uncertainty just after a NTP synchronization (seconds)
+NTP_UNCERTAINTY = 0.05
+# Drift of the RTC until it is estimated, and limits of the estimate (ppm)
+DEFAULT_DRIFT_PPM = 50
+MIN_DRIFT_PPM = 10
+MAX_DRIFT_PPM = 1000
+# Minimum time between synchronizations to estimate the drift (us)
+MIN_DRIFT_INTERVAL_US = 600000000
+
+def validRTC(rtc):
+  # The RTC has been set (after a power on it starts in 1970)
+  return rtc.now()[0] >= 2020
+
+def widenedGuardTime(guardTime, uncertainty, maxGuardTime):
+  # Border effect guard time, widened to the uncertainty of the time if it is
+  # larger (the configured guard time already covers a smaller uncertainty), up
+  # to maxGuardTime (maxGuardTime if the time is unknown)
+  if uncertainty is None:
+    return max(guardTime, maxGuardTime)
+  return max(guardTime, min(maxGuardTime, uncertainty))
+
+class TimeSync:
+  """ NTP synchronization service of the RTC """
+
+  def __init__(self, rtc, server='pool.ntp.org', deadline=30.0, resyncPeriod=3600.0, pollInterval=0.1,
+               stateFile=TIME_SYNC_FILE, ticks_ms=None, ticks_diff=None, sleep_ms=None):
+    self.rtc = rtc
+    self.server = server
+    # Maximum time to wait in synchronize() and time between synchronizations (seconds)
+    self.deadline = deadline
+    self.resyncPeriod = resyncPeriod
+    self.pollInterval = pollInterval
+    self.stateFile = stateFile
+    self.ticks_ms = ticks_ms or utime.ticks_ms
+    self.ticks_diff = ticks_diff or utime.ticks_diff
+    self.sleep_ms = sleep_ms or utime.sleep_ms
+    # Time (us since 1970) of the last synchronization, and drift of the RTC
+    self.lastSyncUs = None
+    self.driftPpm = DEFAULT_DRIFT_PPM
+    # Resync in progress: (RTC us, ticks ms) when it was started
+    self.pending = None
+    self.syncs = 0
+    self.loadState()
+
+  def loadState(self):
+    try:
+      with open(self.stateFile, 'r') as f:
+        state = json.loads(f.read())
+      self.lastSyncUs = state['lastSyncUs']
+      self.driftPpm = state['driftPpm']
+    except Exception:
+      pass
+
+  def saveState(self):
+    try:
+      with open(self.stateFile, 'w') as f:
+        f.write(json.dumps({'lastSyncUs': self.lastSyncUs, 'driftPpm': self.driftPpm}))
+    except OSError:
+      pass
+
+  def start(self):
+    # Start (or restart) the synchronization in the background
+    if validRTC(self.rtc):
+      self.pending = (rtcToUs(self.rtc.now()), self.ticks_ms())
+    else:
+      self.pending = (None, self.ticks_ms())
+    self.rtc.ntp_sync(None)
+    self.rtc.ntp_sync(self.server, update_period=int(self.resyncPeriod))
+
+  def synced(self):
+    # Check if the synchronization in progress has finished
+    if self.pending is None or not self.rtc.synced():
+      return False
+    nowUs = rtcToUs(self.rtc.now())
+    startUs, startTicks = self.pending
+    if startUs is not None and self.lastSyncUs is not None:
+      # Drift: correction of the RTC since the last synchronization
+      expectedUs = startUs + 1000*self.ticks_diff(self.ticks_ms(), startTicks)
+      interval = expectedUs - self.lastSyncUs
+      if interval >= MIN_DRIFT_INTERVAL_US:
+        drift = abs(nowUs - expectedUs)*1000000//interval
+        self.driftPpm = min(MAX_DRIFT_PPM, max(MIN_DRIFT_PPM, drift))
+    self.lastSyncUs = nowUs
+    self.pending = None
+    self.syncs = self.syncs + 1
+    self.saveState()
+    return True
+
+  def synchronize(self):
+    # Synchronize, waiting at most deadline seconds. Returns True if synchronized
+    # (otherwise the synchronization goes on in the background, see poll())
+    self.start()
+    start = self.ticks_ms()
+    while not self.synced():
+      if self.ticks_diff(self.ticks_ms(), start) >= 1000*self.deadline:
+        return False
+      self.sleep_ms(int(1000*self.pollInterval))
+    return True
+
+  def poll(self, online=True):
+    # Called periodically: finishes a pending synchronization and starts a new one
+    # every resyncPeriod seconds (if online, i.e. Wi-Fi connected)
+    if self.pending is not None:
+      self.synced()
+    elif online and (self.lastSyncUs is None or not validRTC(self.rtc) or rtcToUs(self.rtc.now()) - self.lastSyncUs >= 1000000*self.resyncPeriod):
+      self.start()
+
+  def timeKnown(self):
+    # The RTC has a time (synchronized now or kept since the last synchronization)
+    return validRTC(self.rtc)
+
+  def waitUntilKnown(self, online=None, interval=1.0):
+    # Waits until the RTC has a time, polling the synchronization every interval
+    # seconds (online() returns True if Wi-Fi is connected). Returns the time
+    # waited (seconds)
+    # (the synchronization that sets the RTC is finished by poll())
+    start = self.ticks_ms()
+    while True:
+      self.poll(online is None or online())
+      if self.timeKnown():
+        return self.ticks_diff(self.ticks_ms(), start)/1000
+      self.sleep_ms(int(1000*interval))
+
+  def uncertainty(self):
+    # Uncertainty of the time of the RTC (seconds), None if unknown
+    if self.lastSyncUs is None or not validRTC(self.rtc):
+      return None
+    elapsed = max(0, rtcToUs(self.rtc.now()) - self.lastSyncUs)
+    return NTP_UNCERTAINTY + elapsed*self.driftPpm/1000000/1000000
@@ -0,0 +1,125 @@
+# Latency tracing of the uplink pipeline
+#
+# The spans of the stages between the decision to send and the frame on air
+# (STAGE_NAMES) are measured with the tick counter (utime.ticks_us):
+#   t0 = tracer.start()
+#   ...
+#   tracer.end(STAGE_SEND, t0)
+# and stored in a ring buffer of TRACE_SIZE spans (preallocated arrays, nothing is
+# allocated per span). The count, minimum, sum and maximum of all the spans of
+# every stage are kept; the mean and the p99 (from the spans still in the ring
+# buffer) are computed when the report is made (report(), printed by dump(), or
+# sent to the CARA web server by main.py). Disabled, start() and end() only test
+# an attribute.
+
+try:
+  import utime
+except ImportError:
+  utime = None
+from array import array
+
+# Stages of the uplink pipeline
+STAGE_SCHEDULE = 0       # channel and DR of the transmission (CARA schedule)
+STAGE_BORDER_EFFECT = 1  # checkBorderEffect (and deferTransmission)
+STAGE_RADIO_CONFIG = 2   # setTransmissionParameters
+STAGE_DUTY_CYCLE = 3     # duty cycle ledger
+STAGE_SEND = 4           # blocking s.send
+STAGE_CLOCK = 5          # time base read after s.send (clock.nowUs)
+STAGE_WAKE_TO_AIR = 6    # end of the wait -> end of s.send
+STAGE_CLOCK_CORRECT = 7  # drift correction of the time base with the RTC (clock.correct)
+STAGE_NAMES = ('schedule', 'borderEffect', 'radioConfig', 'dutyCycle', 'send', 'clock', 'wakeToAir', 'clockCorrect')
+TRACE_SIZE = 512
+# Larger than any span (us, small int of MicroPython)
+MAX_SPAN_US = 0x3FFFFFFF
+
+class Tracer:
+  """ spans (us) of the stages in a ring buffer, with aggregates """
+
+  def __init__(self, enabled=True, size=TRACE_SIZE, stageNames=STAGE_NAMES, ticks_us=None, ticks_diff=None):
+    self.enabled = enabled
+    self.size = size
+    self.stageNames = stageNames
+    # Tick counter (utime by default, another one for the host tools)
+    self.ticks_us = ticks_us or utime.ticks_us
+    self.ticks_diff = ticks_diff or utime.ticks_diff
+    # Ring buffer: stage and span of the last spans
+    self.stages = array('B', [0]*size)
+    self.spans = array('l', [0]*size)
+    self.index = 0
+    self.total = 0
+    # Aggregates of every stage (the sum in seconds and us, so it does not overflow)
+    n = len(stageNames)
+    self.counts = array('L', [0]*n)
+    self.mins = array('l', [MAX_SPAN_US]*n)
+    self.maxs = array('l', [0]*n)
+    self.sumsS = array('L', [0]*n)
+    self.sumsUs = array('l', [0]*n)
+
+  def start(self):
+    if not self.enabled:
+      return 0
+    return self.ticks_us()
+
+  def end(self, stage, t0):
+    if not self.enabled:
+      return
+    self.record(stage, self.ticks_diff(self.ticks_us(), t0))
+
+  def record(self, stage, span):
+    if span > MAX_SPAN_US:
+      span = MAX_SPAN_US
+    i = self.index
+    self.stages[i] = stage
+    self.spans[i] = span
+    self.index = (i + 1) % self.size
+    self.total = self.total + 1
+    self.counts[stage] = self.counts[stage] + 1
+    if span < self.mins[stage]:
+      self.mins[stage] = span
+    if span > self.maxs[stage]:
+      self.maxs[stage] = span
+    us = self.sumsUs[stage] + span
+    self.sumsS[stage] = self.sumsS[stage] + us//1000000
+    self.sumsUs[stage] = us % 1000000
+
+  def reset(self):
+    self.index = 0
+    self.total = 0
+    for stage in range(len(self.stageNames)):
+      self.counts[stage] = 0
+      self.mins[stage] = MAX_SPAN_US
+      self.maxs[stage] = 0
+      self.sumsS[stage] = 0
+      self.sumsUs[stage] = 0
+
+  def recentSpans(self, stage):
+    # Spans of the stage in the ring buffer (sorted)
+    spans = [self.spans[i] for i in range(min(self.total, self.size)) if self.stages[i] == stage]
+    spans.sort()
+    return spans
+
+  def stats(self, stage):
+    # {'count', 'min', 'mean', 'max', 'p99'} (us) of a stage, None without spans
+    count = self.counts[stage]
+    if count == 0:
+      return None
+    spans = self.recentSpans(stage)
+    p99 = spans[min(len(spans) - 1, int(0.99*len(spans)))] if len(spans) > 0 else self.maxs[stage]
+    return {'count': count, 'min': self.mins[stage], 'mean': (self.sumsS[stage]*1000000 + self.sumsUs[stage])/count,
+            'max': self.maxs[stage], 'p99': p99}
+
+  def report(self):
+    # {stage name: stats} of the stages with spans
+    report = {}
+    for stage in range(len(self.stageNames)):
+      stats = self.stats(stage)
+      if stats is not None:
+        report[self.stageNames[stage]] = stats
+    return report
+
+  def dump(self):
+    for stage in range(len(self.stageNames)):
+      stats = self.stats(stage)
+      if stats is not None:
+        print("[INFO] Trace {:12s}: {:6d} spans, min {:7d} us, mean {:9.1f} us, max {:7d} us, p99 {:7d} us".format(
+          self.stageNames[stage], stats['count'], stats['min'], stats['mean'], stats['max'], stats['p99']))
@@ -0,0 +1,229 @@
+# Uplink transmit queue and duty cycle ledger (EU868)
+#
+# Application producers push payloads into a TxQueue (bounded, with preallocated
+# slots; if the queue is full the new payload is dropped). At each CARA
+# transmission time, main.py sends the next frame only if the DutyCycleLedger of
+# the sub-band of the frequency allows its air time; otherwise the frame stays in
+# the queue for the next transmission time. Small queued payloads are merged in
+# one frame (each one after its length, 1 byte) up to MERGE_MAX_SIZE bytes, the
+# maximum payload of DR0...DR2, so a merged frame fits in any DR.
+#
+# The ledger keeps, per sub-band, a ring buffer with the start time and the air
+# time of the transmissions of the last DUTY_CYCLE_WINDOW seconds. A transmission
+# counts until it ends DUTY_CYCLE_WINDOW seconds ago (so the used air time is
+# never underestimated); if the ring buffer is full, the oldest transmission is
+# added to the next one (and counts until the next one expires). The ring buffer
+# holds the CARA uplinks of one window (one per minute); more frequent frames are
+# merged, so a little more air time is counted (the shortest frames back to back
+# still use 90% of the budget of a 1% sub-band) with LEDGER_SIZE entries per used
+# sub-band (1 KB) instead of one per possible frame.
+
+from array import array
+from LoRaAirTimeCalc import airtimetheoretical, LoRa
+
+# EU868 sub-bands: (first frequency, last frequency (Hz), duty cycle)
+SUB_BANDS = (
+  (863000000, 865000000, 0.001),
+  (865000000, 868000000, 0.01),
+  (868000000, 868600000, 0.01),
+  (868700000, 869200000, 0.001),
+  (869400000, 869650000, 0.1),
+  (869700000, 870000000, 0.01),
+)
+DUTY_CYCLE_WINDOW = 3600.0
+# Transmissions per sub-band in the ring buffer (one uplink per minute in the window)
+LEDGER_SIZE = 64
+# LoRaWAN header, FPort and MIC (bytes), and shortest frame (SF7, no payload)
+LORAWAN_OVERHEAD = 13
+MIN_FRAME_AIR_TIME = airtimetheoretical(LORAWAN_OVERHEAD, 7, LoRa.BW_125KHZ, LoRa.CODING_4_5)[0]
+
+TX_QUEUE_SIZE = 16
+# Maximum payload of DR5 (EU868)
+MAX_PAYLOAD_SIZE = 222
+MERGE_MAX_SIZE = 51
+
+def subBandOf(freq, subBands=SUB_BANDS):
+  for i in range(len(subBands)):
+    if subBands[i][0] <= freq <= subBands[i][1]:
+      return i
+  raise ValueError("Frequency {:d} Hz outside the sub-bands".format(freq))
+
+class DutyCycleLedger:
+  """ air time used per sub-band in the last window (rolling) """
+
+  def __init__(self, size=LEDGER_SIZE, window=DUTY_CYCLE_WINDOW, subBands=SUB_BANDS):
+    self.size = size
+    self.window = window
+    self.subBands = subBands
+    # Ring buffers, allocated when the sub-band is used
+    self.starts = [None]*len(subBands)
+    self.airTimes = [None]*len(subBands)
+    # Oldest transmission and number of transmissions of every sub-band
+    self.heads = [0]*len(subBands)
+    self.counts = [0]*len(subBands)
+    # Statistics
+    self.coalesced = 0
+
+  def expire(self, band, now):
+    if self.counts[band] == 0:
+      return
+    starts = self.starts[band]
+    airTimes = self.airTimes[band]
+    while self.counts[band] > 0:
+      head = self.heads[band]
+      if starts[head] + airTimes[head] > now - self.window:
+        break
+      self.heads[band] = (head + 1) % self.size
+      self.counts[band] = self.counts[band] - 1
+
+  def usedAirTime(self, freq, now):
+    # Air time (s) used in the sub-band of freq in the last window
+    band = subBandOf(freq, self.subBands)
+    self.expire(band, now)
+    airTimes = self.airTimes[band]
+    used = 0.0
+    for i in range(self.counts[band]):
+      used = used + airTimes[(self.heads[band] + i) % self.size]
+    return used
+
+  def budget(self, freq):
+    return self.subBands[subBandOf(freq, self.subBands)][2]*self.window
+
+  def allowed(self, freq, airTime, now):
+    return self.usedAirTime(freq, now) + airTime <= self.budget(freq) + 1e-9
+
+  def nextAllowedTime(self, freq, airTime, now):
+    # First time (>= now) when a transmission of airTime is allowed
+    excess = self.usedAirTime(freq, now) + airTime - self.budget(freq)
+    if excess <= 1e-9:
+      return now
+    band = subBandOf(freq, self.subBands)
+    starts = self.starts[band]
+    airTimes = self.airTimes[band]
+    for i in range(self.counts[band]):
+      j = (self.heads[band] + i) % self.size
+      excess = excess - airTimes[j]
+      if excess <= 1e-9:
+        return starts[j] + airTimes[j] + self.window
+    return None
+
+  def record(self, freq, start, airTime):
+    band = subBandOf(freq, self.subBands)
+    self.expire(band, start)
+    if self.starts[band] is None:
+      self.starts[band] = array('d', [0.0]*self.size)
+      self.airTimes[band] = array('d', [0.0]*self.size)
+    starts = self.starts[band]
+    airTimes = self.airTimes[band]
+    if self.counts[band] == self.size:
+      head = self.heads[band]
+      nextHead = (head + 1) % self.size
+      end = starts[nextHead] + airTimes[nextHead]
+      airTimes[nextHead] = airTimes[nextHead] + airTimes[head]
+      starts[nextHead] = end - airTimes[nextHead]
+      self.heads[band] = nextHead
+      self.counts[band] = self.counts[band] - 1
+      self.coalesced = self.coalesced + 1
+    i = (self.heads[band] + self.counts[band]) % self.size
+    starts[i] = start
+    airTimes[i] = airTime
+    self.counts[band] = self.counts[band] + 1
+
+  def asList(self):
+    # [[sub-band, start, air time], ...] (sleep state)
+    entries = []
+    for band in range(len(self.subBands)):
+      for i in range(self.counts[band]):
+        j = (self.heads[band] + i) % self.size
+        entries.append([band, self.starts[band][j], self.airTimes[band][j]])
+    return entries
+
+  def load(self, entries):
+    for band, start, airTime in entries:
+      self.record(self.subBands[band][0], start, airTime)
+
+class TxQueue:
+  """ bounded queue of uplink payloads (preallocated slots) """
+
+  def __init__(self, size=TX_QUEUE_SIZE, slotSize=MAX_PAYLOAD_SIZE, mergeMaxSize=MERGE_MAX_SIZE):
+    self.size = size
+    self.slotSize = slotSize
+    self.mergeMaxSize = mergeMaxSize
+    self.slots = [bytearray(slotSize) for i in range(size)]
+    self.lengths = array('H', [0]*size)
+    self.frame = bytearray(slotSize)
+    self.head = 0
+    self.count = 0
+    # Statistics
+    self.pushed = 0
+    self.dropped = 0
+    self.merged = 0
+
+  def push(self, data):
+    # Copies the payload; returns False (dropped) if the queue is full
+    n = len(data)
+    if self.count == self.size or n > self.slotSize:
+      self.dropped = self.dropped + 1
+      return False
+    i = (self.head + self.count) % self.size
+    self.slots[i][0:n] = data
+    self.lengths[i] = n
+    self.count = self.count + 1
+    self.pushed = self.pushed + 1
+    return True
+
+  def frameSize(self, bMerge=False):
+    # (size, payloads) of the next frame, (0, 0) if the queue is empty
+    if self.count == 0:
+      return (0, 0)
+    size = self.lengths[self.head]
+    if not bMerge:
+      return (size, 1)
+    merged = 0
+    payloads = 0
+    while payloads < self.count:
+      n = self.lengths[(self.head + payloads) % self.size]
+      if merged + 1 + n > self.mergeMaxSize:
+        break
+      merged = merged + 1 + n
+      payloads = payloads + 1
+    if payloads < 2:
+      return (size, 1)
+    return (merged, payloads)
+
+  def pop(self, payloads=1):
+    # Removes the next payloads and returns the frame (valid until the next pop):
+    # the payload, or the merged payloads (length, payload, length, payload...)
+    if payloads == 1:
+      n = self.lengths[self.head]
+      self.frame[0:n] = self.slots[self.head][0:n]
+    else:
+      n = 0
+      for i in range(payloads):
+        j = (self.head + i) % self.size
+        length = self.lengths[j]
+        self.frame[n] = length
+        self.frame[n + 1:n + 1 + length] = self.slots[j][0:length]
+        n = n + 1 + length
+      self.merged = self.merged + payloads
+    self.head = (self.head + payloads) % self.size
+    self.count = self.count - payloads
+    return memoryview(self.frame)[0:n]
+
+  def asList(self):
+    # Queued payloads as lists of bytes (sleep state)
+    return [list(self.slots[(self.head + i) % self.size][0:self.lengths[(self.head + i) % self.size]]) for i in range(self.count)]
+
+  def load(self, payloads):
+    for data in payloads:
+      self.push(bytes(data))
+
+def splitMergedFrame(frame):
+  # Payloads of a merged frame (CARA server side and tests)
+  payloads = []
+  i = 0
+  while i < len(frame):
+    n = frame[i]
+    payloads.append(bytes(frame[i + 1:i + 1 + n]))
+    i = i + 1 + n
+  return payloads
@@ -0,0 +1,143 @@
+# Transmit timing of the uplinks: scheduled time vs actual send
+#
+# For every frame sent, main.py keeps a record of fixed width (TIMING_RECORD,
+# 16 bytes) in a ring buffer (TimingLog, preallocated):
+#   scheduled time (ms, since the midnight of the time base, see caraClock.py),
+#   wake-up, start of s.send (us after the scheduled time) and duration of s.send (us)
+# and adds the lateness (start of s.send - scheduled time) to a running histogram
+# (LatenessHistogram, bins of HISTOGRAM_BIN_US; the counts are halved every
+# HISTOGRAM_WINDOW frames, so it follows changes of the lateness, and are kept in
+# 1/HISTOGRAM_WEIGHT of a frame, so a frame weighs until several halvings). With
+# autoGuardTime(), the border effect guard time is the p99 of the lateness plus a
+# margin instead of the static borderEffectGuardTime.
+
+import struct
+from array import array
+
+TIMING_RECORD = '<Iiii'
+TIMING_RECORD_SIZE = struct.calcsize(TIMING_RECORD)
+TIMING_LOG_SIZE = 128
+# Lateness histogram: 1 ms bins from 0 to 255 ms (the last one also for later frames)
+HISTOGRAM_BINS = 256
+HISTOGRAM_BIN_US = 1000
+HISTOGRAM_WINDOW = 1024
+HISTOGRAM_WEIGHT = 16
+# Guard time: p99 of the lateness + margin (s), once there are enough frames
+AUTO_GUARD_TIME_MARGIN = 0.005
+AUTO_GUARD_TIME_MIN_FRAMES = 20
+MAX_INT32 = 0x7FFFFFFF
+
+def clampInt32(value):
+  return max(-MAX_INT32, min(MAX_INT32, value))
+
+class TimingLog:
+  """ timing records of the last frames (ring buffer of fixed-width records) """
+
+  def __init__(self, size=TIMING_LOG_SIZE):
+    self.size = size
+    self.buffer = bytearray(size*TIMING_RECORD_SIZE)
+    self.index = 0
+    self.count = 0
+
+  def add(self, scheduledUs, wakeUs, sendUs, sentUs):
+    # Times of the time base (us): scheduled, wake-up, start and end of s.send
+    struct.pack_into(TIMING_RECORD, self.buffer, self.index*TIMING_RECORD_SIZE, (scheduledUs//1000) & 0xFFFFFFFF,
+                     clampInt32(wakeUs - scheduledUs), clampInt32(sendUs - scheduledUs), clampInt32(sentUs - sendUs))
+    self.index = (self.index + 1) % self.size
+    self.count = self.count + 1
+
+  def records(self):
+    # [(scheduled ms, wake-up lateness us, send lateness us, send duration us), ...]
+    # of the frames in the ring buffer, oldest first
+    n = min(self.count, self.size)
+    first = (self.index - n) % self.size
+    return [struct.unpack_from(TIMING_RECORD, self.buffer, ((first + i) % self.size)*TIMING_RECORD_SIZE) for i in range(n)]
+
+  def save(self, fileName):
+    # Records of the ring buffer (oldest first), in the format of parseTimingRecords()
+    n = min(self.count, self.size)
+    first = (self.index - n) % self.size
+    with open(fileName, 'wb') as f:
+      for i in range(n):
+        offset = ((first + i) % self.size)*TIMING_RECORD_SIZE
+        f.write(self.buffer[offset:offset + TIMING_RECORD_SIZE])
+
+def parseTimingRecords(data):
+  # Records of a file written by TimingLog.save() (host tools)
+  return [struct.unpack_from(TIMING_RECORD, data, offset) for offset in range(0, len(data) - TIMING_RECORD_SIZE + 1, TIMING_RECORD_SIZE)]
+
+class LatenessHistogram:
+  """ running histogram of the lateness (us) """
+
+  def __init__(self, bins=HISTOGRAM_BINS, binUs=HISTOGRAM_BIN_US, window=HISTOGRAM_WINDOW):
+    self.binUs = binUs
+    self.window = window
+    # Weight of the frames of every bin (HISTOGRAM_WEIGHT per frame)
+    self.bins = array('L', [0]*bins)
+    self.weight = 0
+    # Frames of the histogram (weight/HISTOGRAM_WEIGHT)
+    self.count = 0
+    # Maximum lateness of the last window and of the current one (last bin of quantile())
+    self.maxUs = 0
+    # Maximum lateness of the current window
+    self.windowMaxUs = 0
+
+  def add(self, latenessUs):
+    # Frames sent early are counted in the first bin
+    b = latenessUs//self.binUs
+    if b < 0:
+      b = 0
+    elif b >= len(self.bins):
+      b = len(self.bins) - 1
+    self.bins[b] = self.bins[b] + HISTOGRAM_WEIGHT
+    self.weight = self.weight + HISTOGRAM_WEIGHT
+    self.count = self.count + 1
+    if latenessUs > self.windowMaxUs:
+      self.windowMaxUs = latenessUs
+    if latenessUs > self.maxUs:
+      self.maxUs = latenessUs
+    if self.count >= self.window:
+      self.halve()
+
+  def halve(self):
+    # Older frames weigh half, and the maximum of the window before the last one is forgotten
+    self.maxUs = self.windowMaxUs
+    self.windowMaxUs = 0
+    weight = 0
+    for b in range(len(self.bins)):
+      self.bins[b] = self.bins[b]//2
+      weight = weight + self.bins[b]
+    self.weight = weight
+    self.count = weight//HISTOGRAM_WEIGHT
+
+  def quantile(self, q):
+    # Upper edge of the bin of the q quantile (us), the maximum of the last windows
+    # for the last bin
+    target = q*self.weight
+    cumulative = 0
+    for b in range(len(self.bins)):
+      cumulative = cumulative + self.bins[b]
+      if cumulative >= target and cumulative > 0:
+        if b == len(self.bins) - 1:
+          return max(self.maxUs, len(self.bins)*self.binUs)
+        return (b + 1)*self.binUs
+    return 0
+
+  def mean(self):
+    # Mean of the centers of the bins (us)
+    if self.weight == 0:
+      return 0.0
+    total = 0
+    for b in range(len(self.bins)):
+      total = total + self.bins[b]*(2*b + 1)
+    return total*self.binUs/(2*self.weight)
+
+def autoGuardTime(histogram, defaultGuardTime, margin=AUTO_GUARD_TIME_MARGIN, minFrames=AUTO_GUARD_TIME_MIN_FRAMES, maxGuardTime=None):
+  # Border effect guard time (s): p99 of the lateness + margin, or defaultGuardTime
+  # until the histogram has minFrames frames
+  if histogram.count < minFrames:
+    return defaultGuardTime
+  guardTime = histogram.quantile(0.99)/1000000 + margin
+  if maxGuardTime is not None:
+    guardTime = min(guardTime, maxGuardTime)
+  return guardTime
@@ -0,0 +1,131 @@
+# Wi-Fi connection manager
+#
+# Each attempt calls wlan.connect() and polls wlan.isconnected() every
+# pollInterval seconds, so the connection is detected as soon as it is
+# established, until attemptTimeout. Failed attempts are retried after an
+# exponential backoff with full jitter (as the JOINREQ retransmissions), until the
+# overall deadline (the exponent is capped as the JOINREQ one). The BSSID and channel of the access point are cached in the
+# flash, so the next connection goes straight to that access point (without
+# scanning all the channels); if it fails, a normal connection is tried.
+# The credentials are read from a JSON file, e.g. {"ssid": "...", "password": "..."}.
+
+import json
+from joinReqPolicy import MAX_BACKOFF_EXPONENT
+try:
+  import utime
+except ImportError:
+  utime = None
+
+WIFI_CONFIG_FILE = '/flash/wifi.json'
+WIFI_CACHE_FILE = '/flash/wifiCache.json'
+
+def loadWiFiCredentials(ssid, password, path=WIFI_CONFIG_FILE):
+  # (ssid, password) from the config file, or the given ones if there is no file
+  try:
+    with open(path, 'r') as f:
+      config = json.loads(f.read())
+    return (config['ssid'], config.get('password', password))
+  except Exception:
+    return (ssid, password)
+
+class WiFiManager:
+  """ connection to a Wi-Fi network with polling, backoff and BSSID cache """
+
+  def __init__(self, wlan, ssid, password, auth=None, pollInterval=0.1, attemptTimeout=10.0, deadline=120.0,
+               backoffMin=1.0, backoffMax=20.0, random=None, cacheFile=WIFI_CACHE_FILE,
+               ticks_ms=None, ticks_diff=None, sleep_ms=None):
+    self.wlan = wlan
+    self.ssid = ssid
+    self.password = password
+    # WLAN.WPA2 by default
+    self.auth = auth if auth is not None else wlan.WPA2
+    self.pollInterval = pollInterval
+    self.attemptTimeout = attemptTimeout
+    # Overall time (seconds) to get connected, None = no limit
+    self.deadline = deadline
+    self.backoffMin = backoffMin
+    self.backoffMax = backoffMax
+    # random() returns a random number in [0, 1] (jitter of the backoff)
+    self.random = random or (lambda: 0.5)
+    self.cacheFile = cacheFile
+    self.ticks_ms = ticks_ms or utime.ticks_ms
+    self.ticks_diff = ticks_diff or utime.ticks_diff
+    self.sleep_ms = sleep_ms or utime.sleep_ms
+    # Statistics of the last connect()
+    self.attempts = 0
+    self.connectTime = None
+    self.usedCache = False
+
+  def loadCache(self):
+    try:
+      with open(self.cacheFile, 'r') as f:
+        cache = json.loads(f.read())
+      if cache['ssid'] == self.ssid:
+        return cache
+    except Exception:
+      pass
+    return None
+
+  def saveCache(self):
+    # BSSID and channel of the access point (if the firmware provides them)
+    try:
+      info = self.wlan.joined_ap_info()
+      bssid, channel = info[0], info[2]
+    except Exception:
+      return
+    try:
+      with open(self.cacheFile, 'w') as f:
+        f.write(json.dumps({'ssid': self.ssid, 'bssid': list(bssid), 'channel': channel}))
+    except OSError:
+      pass
+
+  def elapsed(self, start):
+    return self.ticks_diff(self.ticks_ms(), start)/1000
+
+  def attempt(self, start, bssid=None):
+    # One connection attempt, polling the state until connected, attemptTimeout or the deadline
+    if bssid is not None:
+      self.wlan.connect(self.ssid, auth=(self.auth, self.password), bssid=bssid)
+    else:
+      self.wlan.connect(self.ssid, auth=(self.auth, self.password))
+    attemptStart = self.ticks_ms()
+    while not self.wlan.isconnected():
+      if self.elapsed(attemptStart) >= self.attemptTimeout:
+        return False
+      if self.deadline is not None and self.elapsed(start) >= self.deadline:
+        return False
+      self.sleep_ms(int(1000*self.pollInterval))
+    return True
+
+  def connect(self):
+    # Returns True when connected, False if the deadline is reached
+    start = self.ticks_ms()
+    self.attempts = 0
+    self.connectTime = None
+    self.usedCache = False
+    if self.wlan.isconnected():
+      self.connectTime = 0.0
+      return True
+
+    cache = self.loadCache()
+    while True:
+      bssid = None
+      if cache is not None and self.attempts == 0:
+        bssid = bytes(cache['bssid'])
+      self.attempts = self.attempts + 1
+      if self.attempt(start, bssid):
+        self.connectTime = self.elapsed(start)
+        self.usedCache = bssid is not None
+        self.saveCache()
+        return True
+      try:
+        self.wlan.disconnect()
+      except Exception:
+        pass
+      if bssid is not None:
+        # The cached access point is not available: normal connection without waiting
+        continue
+      backoff = self.random()*min(self.backoffMax, self.backoffMin*(2**min(self.attempts - 1, MAX_BACKOFF_EXPONENT)))
+      if self.deadline is not None and self.elapsed(start) + backoff >= self.deadline:
+        return False
+      self.sleep_ms(int(1000*backoff))
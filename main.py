@@ -3,21 +3,70 @@ from network import WLAN
 import utime
 from network import LoRa
 import socket
+import select
 import time
 import ubinascii
 import crypto
 from LoRaAirTimeCalc import *
 import sys
+import gc
+import _thread
 from pycoproc import Pycoproc
 from microWebCli import MicroWebCli
+from caraParameters import fetchCARAParameters, CARAParameters
+from joinReqPolicy import JoinReqPolicy
+import joinWait as joinWaitModule
+from joinWait import waitForJoinAccept
+import radioState as radioStateModule
+from radioState import RadioState
+from caraClock import CARAClock, usToRtc, rtcToUs
+from sleepState import loadSleepState, saveSleepState, EnergyEstimate
+from bootCache import loadBootCache, saveBootCache
+from wifiManager import WiFiManager, loadWiFiCredentials
+from timeSync import TimeSync, widenedGuardTime
+from payloadBuilder import createPayloadBuilder
+from joinAccept import parseJoinAccept
+from txQueue import TxQueue, DutyCycleLedger
+from downlinkDispatcher import DownlinkDispatcher, CONFIG_KEYS
+from txTiming import TimingLog, LatenessHistogram, autoGuardTime
+from tracer import Tracer, STAGE_SCHEDULE, STAGE_BORDER_EFFECT, STAGE_RADIO_CONFIG, STAGE_DUTY_CYCLE, STAGE_SEND, STAGE_CLOCK, STAGE_WAKE_TO_AIR, STAGE_CLOCK_CORRECT
+import caraScheduler
+from caraScheduler import *
 
 ## PARAMETERS
 # Debug messages
 debug = 0
 # Fixed channel and spreading factor from CARA initial resource block, for testing...
 bFixedChannelAndDR=True
-# Time to reconnect to Wi-Fi
+# Wi-Fi network (if there is no /flash/wifi.json file with "ssid" and "password")
+wifiSSID = 'ARTEMIS'
+wifiPassword = 'wimunet!'
+# Maximum time to reconnect to Wi-Fi (exponential backoff)
 wifiRetryTime = 20.0
+# Interval to check the Wi-Fi connection, maximum time of each attempt and of all
+# the attempts (seconds)
+wifiPollInterval = 0.1
+wifiAttemptTimeout = 10.0
+wifiConnectDeadline = 120.0
+# NTP server, maximum time to wait for the synchronization at boot (then the RTC
+# keeps its time and the synchronization goes on in the background, see
+# timeSync.py) and time between synchronizations (seconds)
+ntpServer = 'pool.ntp.org'
+ntpDeadline = 30.0
+ntpResyncPeriod = 3600.0
+# The border effect guard time is widened to the uncertainty of the time (time
+# since the last NTP synchronization x drift of the RTC) when it is larger, up to
+# maxBorderEffectGuardTime (seconds, also used while the time is unknown)
+maxBorderEffectGuardTime = 1.0
+# Timing of every frame sent (see txTiming.py): scheduled time, wake-up, start and
+# end of s.send, and histogram of the lateness (start of s.send - scheduled time).
+# With bAutoGuardTime, the border effect guard time is the p99 of the lateness plus
+# autoGuardTimeMargin (seconds) instead of borderEffectGuardTime
+bAutoGuardTime = False
+autoGuardTimeMargin = 0.005
+# Frames between lateness summaries, and file for the timing records (None = not saved)
+timingReportEvery = 100
+timingLogFile = None
 # OTAA or ABP
 # VERY IMPORTANT!!! If ABP is used, make sure that RX2 data rate is set to 5
 # and RX2 frequency is set to 869.525 MHz (chirpstack -> device profile ->
@@ -34,9 +83,85 @@ NwkSKey = '00000000000000000000000000000001'
 AppSKey = '00000000000000000000000000000001'
 # Retransmission time for JOINREQ
 joinReqRtxTime = 5.0
+# Exponential backoff with full jitter for JOINREQ retransmissions (otherwise
+# fixed joinReqRtxTime): wait joinReqRtxMinTime + rand(0, min(joinReqRtxMaxTime, joinReqRtxTime*2^n))
+bJoinReqBackoff = True
+joinReqRtxMinTime = 1.0
+joinReqRtxMaxTime = 60.0
+# Increase the SF (decrease the DR, down to joinReqMinDR) every joinReqEscalateEvery JOINREQ
+# attempts (0 = always DR5)
+joinReqEscalateEvery = 0
+joinReqMinDR = 3
+# Uplink payload (see payloadBuilder.py): 'text' ("Testing data....1", 18 bytes)
+# or 'binary' (message counter and time of the payload, 4 bytes each)
+payloadEncoding = 'text'
+# Uplinks are sent from a transmit queue (see txQueue.py). Frames are held in the
+# queue while the EU868 duty cycle of the sub-band does not allow them
+bDutyCycleLimit = True
+# Small queued payloads are merged in one frame (sent on mergedFPort, each payload
+# after its length)
+bMergePayloads = False
+mergedFPort = 3
+# Asynchronous runtime (see caraRuntime.py, needs uasyncio in /flash/lib): after the
+# boot, the main loop runs as uasyncio tasks (scheduler, radio RX, refresh of the
+# CARA parameters and telemetry) instead of the blocking loop. Not used in the low
+# power mode
+bAsyncRuntime = False
+# Time between test data payloads (telemetry task) and between refreshes of the
+# CARA parameters (seconds, 0 = no refresh)
+telemetryPeriod = 60.0
+parametersRefreshPeriod = 3600.0
 # First transmission starting on a CARA period (only for debugging)
 bFirstTransmissionStartingOnACARAPeriod = False
 
+# Assignment algorithm of the resource blocks if #JOINACC# does not include it
+# (see ASSIGNMENT_ALGORITHMS in caraScheduler.py)
+assignmentAlgorithm = 'sequential'
+
+# Transmissions that would cross the end of their CARA period (border effect) are
+# deferred to the next period where they fit (guard time after its start) and end
+# before the next transmission can start (fixedTime after the scheduled time),
+# instead of being held in the queue
+bDeferBorderTransmissions = False
+
+# Class C downlinks are read between uplinks (see downlinkDispatcher.py): a #JOINACC#
+# received after the join reconfigures the CARA assignment from a period boundary,
+# without joining again
+bDownlinkCommands = False
+
+# Latency tracing of the uplink pipeline (see tracer.py): spans of every stage
+# (ticks_us), printed every traceReportEvery uplinks and sent (JSON) to the CARA
+# web server endpoint traceEndpoint (None = only printed)
+bTrace = False
+traceReportEvery = 100
+traceEndpoint = 'trace'
+
+# Low power mode: deep sleep between uplinks (the LoRaWAN session and the state
+# are saved in the flash and restored after waking up, see sleepState.py).
+# Class C downlinks are not received while sleeping
+bLowPower = False
+# 'deepsleep' (machine.deepsleep) or 'pycoproc' (Pysense/Pytrack, Pycoproc sleep)
+lowPowerSleepMode = 'deepsleep'
+# Time to wake up, restore the state and the socket before the uplink (seconds)
+lowPowerWakeUpTime = 3.0
+# Shorter times between uplinks are waited awake (seconds)
+lowPowerMinSleepTime = 10.0
+
+# Boot cache: the CARA parameters and the #JOINACC# assignment of the last cold
+# boot are saved in the flash (see bootCache.py), so a reboot goes straight to the
+# main loop while the parameters are revalidated in the background
+bBootCache = False
+# Maximum age of the boot cache (seconds)
+bootCacheMaxAge = 86400
+# CARA web server (experiment parameters)
+caraServerURL = 'http://192.168.1.205/CARA/'
+# Obtain all the CARA parameters in a single HTTP request (if the server
+# does not provide the bundle endpoint, one request per parameter is used)
+bCARAParametersBundle = True
+caraParametersBundle = 'parameters'
+# Reuse the same TCP connection (HTTP/1.1 keep-alive) for the CARA web server requests
+bHTTPKeepAlive = True
+
 # Global variables
 selectedFreq = 0
 selectedDR = 0
@@ -50,9 +175,6 @@ def Random():
 def RandomRange(rfrom, rto):
   return Random()*(rto-rfrom)+rfrom
 
-def zfill(s, width):
-  return '{:0>{w}}'.format(s, w=width)
-
 # Functions related to board
 def showBoard(lora):
   print("[INFO] Detected board:", sys.platform)
@@ -75,33 +197,32 @@ def showBoard(lora):
   print("[INFO] LORAWAN DevEUI:", ubinascii.hexlify(lora.mac()).upper().decode('utf-8'))
 
 # Functions related to Wi-Fi
-def connectWiFi():
+def connectWiFi(bRetryForever=True):
   # Connect to Wi-Fi for synchronizing using NTP
   #print("Trying to connect to Wi-Fi network...")
+  ssid, password = loadWiFiCredentials(wifiSSID, wifiPassword)
   wlan = WLAN(mode=WLAN.STA)
-  #wlan.connect('ARTEMIS', auth=(WLAN.WPA2, 'wimunet!'))
-  wifi_count=1
-  while not wlan.isconnected():
-  #  machine.idle()
-    print('[INFO] Connecting to Wi-Fi, attempt {}...'.format(wifi_count))
-    wlan.connect('ARTEMIS', auth=(WLAN.WPA2, 'wimunet!')) #, timeout=5000)
-    time.sleep(wifiRetryTime)
-    wifi_count = wifi_count + 1
-
-  print('[INFO] WiFi connected')
+  wifiManager = WiFiManager(wlan, ssid, password, WLAN.WPA2, wifiPollInterval, wifiAttemptTimeout, wifiConnectDeadline, 1.0, wifiRetryTime, Random)
+  print('[INFO] Connecting to Wi-Fi {}...'.format(ssid))
+  while not wifiManager.connect():
+    if not bRetryForever:
+      raise Exception('Wi-Fi not connected after {:d} attempts'.format(wifiManager.attempts))
+    print('[INFO] Wi-Fi not connected after {:d} attempts, trying again...'.format(wifiManager.attempts))
+
+  print('[INFO] WiFi connected in {:.1f} s ({:d} attempts{})'.format(wifiManager.connectTime, wifiManager.attempts, ', cached access point' if wifiManager.usedCache else ''))
   print(wlan.ifconfig())
 
 # Functions related to synchronization
 def synchronizeTime():
 
-  # Synchronization
-  rtc = machine.RTC()
-  rtc.ntp_sync('pool.ntp.org', update_period=3600)
-
-  while not rtc.synced():
-    machine.idle()
-
-  print("[INFO] RTC NTP sync complete")
+  # Synchronization (waiting at most ntpDeadline seconds)
+  rtc = timeSync.rtc
+  if timeSync.synchronize():
+    print("[INFO] RTC NTP sync complete")
+  elif timeSync.uncertainty() is None:
+    print("[INFO] RTC NTP sync not complete after {:.0f} s, time unknown (sync continues in the background, uplinks held until then)".format(ntpDeadline))
+  else:
+    print("[INFO] RTC NTP sync not complete after {:.0f} s, using the RTC (uncertainty {:.3f} s)".format(ntpDeadline, timeSync.uncertainty()))
   print(rtc.now())
 
   utime.timezone(7200)
@@ -142,6 +263,9 @@ def initializeLoRaWAN(randomTimeForJoining):
 
   print('[INFO] --- Joined Sucessfully --- ')
 
+  return createLoRaSocket()
+
+def createLoRaSocket():
   # Create a LoRa socket
   s = socket.socket(socket.AF_LORA, socket.SOCK_RAW)
   # Set the LoRaWAN data rate (DR0...DR5 - the lower DR, the higher SF)
@@ -151,335 +275,613 @@ def initializeLoRaWAN(randomTimeForJoining):
 
   return s
 
-def frequencyForChannel(value):
-  return (867100000 + value*200000)
-
-def convertDRtoSF(value):
-  return (12 - value)
-
-def convertSFtoDR(value):
-  return (12 - value)
-
-def setTransmissionParameters(s, selectedFreq, selectedDR):
-  if (debug > 0):
-    print("[DEBUG] Changing frequency to {:d}".format(selectedFreq))
-  # Add all channels with the selected frequency
-  for channel in range(0, 15):
-    lora.add_channel(channel, frequency=selectedFreq, dr_min=0, dr_max=5)
-
-  # Set spreading factor
-  s.setsockopt(socket.SOL_LORA, socket.SO_DR, selectedDR)
-  if (debug > 0):
-    print("[DEBUG] Changing DR to {:d} (SF={:d})".format(selectedDR, convertDRtoSF(selectedDR)))
-
-def createResourceBlocksLists(sfMask):
-  channelsList = []
-  sfList = []
-
-  sfMaskStr = bin(sfMask)[2:]
-  sfMaskStr = zfill(sfMaskStr, 6)
-  #print("sfMask = {}".format(bin(sfMask)))
-  if (debug > 0):
-    print("[DEBUG] SF mask = {}".format(sfMaskStr))
-
-  i = 0
-  for sfIndex in reversed(range(0, len(sfMaskStr))):
-    for channel in range(0, 8):
-      if (sfMaskStr[sfIndex] == "1"):
-        sfList.append(12-sfIndex)
-        channelsList.append(frequencyForChannel(channel))
-        if (debug > 0):
-          print("[DEBUG] Resource block {:d} with channel {:d} and SF {:d}".format(i, channel, 12-sfIndex))
-        i = i + 1
+# Functions related to the low power mode
+def restoreRTC(rtc, wakeUpUs):
+  # With the Pycoproc sleep the module is powered off and the RTC is lost, so it is
+  # set to the expected wake up time (without NTP)
+  if rtc.now()[0] < 2020:
+    rtc.init(usToRtc(wakeUpUs))
+    print("[INFO] RTC restored from the sleep state")
+
+# Functions related to the boot cache
+def saveCARABootCache():
+  saveBootCache({'randomTimeForJoining': randomTimeForJoining, 'fixedTime': fixedTime, 'randomTime': randomTime,
+                 'durationOfPeriod': durationOfPeriod, 'durationOfPeriodFromJoinAccept': durationOfPeriodFromJoinAccept, 'borderEffectGuardTime': borderEffectGuardTime,
+                 'avoidBorderEffect': avoidBorderEffect, 'caraEnabled': caraEnabled, 'initialResourceBlock': initialResourceBlock,
+                 'sfMask': sfMask, 'selectedDR': selectedDR, 'algorithm': algorithm, 'loadHints': loadHints},
+                rtcToUs(rtc.now())//1000000, bootCacheMaxAge)
+
+def revalidateBootCache():
+  # Background thread: Wi-Fi, NTP and CARA parameters (applied by the main loop)
+  global revalidatedParameters
+  try:
+    connectWiFi(False)
+    # NTP synchronization in the background (finished by timeSync.poll() in the main loop)
+    timeSync.start()
+    revalidatedParameters = getCARAParameters()
+  except Exception as e:
+    print("[INFO] Boot cache not revalidated:", e)
+
+# Functions related to the asynchronous runtime
+def sampleTestData():
+  # Telemetry: "Testing data.....0", ... (or binary, see payloadBuilder.py)
+  global messageCounter
+  messageCounter = messageCounter + 1
+  return payload.build(messageCounter - 1, (clock.epochDayUs + clock.nowUs())//1000000)
+
+def uplinkGuardTime(borderEffectGuardTime):
+  # Background NTP resync, and guard time widened to the uncertainty of the time
+  timeSync.poll(WLAN().isconnected())
+  return widenedGuardTime(baseGuardTime(borderEffectGuardTime), timeSync.uncertainty(), maxBorderEffectGuardTime)
+
+def fetchParameters():
+  return fetchCARAParameters(caraServerURL, caraParametersBundle if bCARAParametersBundle else None, bHTTPKeepAlive)
+
+def printDownlink(data, port):
+  print("[INFO] Downlink received on port {}: {}".format(port, ubinascii.hexlify(data).upper()))
+
+def runAsyncRuntime():
+  # Main loop as uasyncio tasks (never returns). Imported here, so uasyncio is only
+  # needed with bAsyncRuntime
+  from caraRuntime import CARARuntime, AsyncLoRaSocket, asyncio
+  params = CARAParameters()
+  params.randomTimeForJoining, params.fixedTime, params.randomTime = randomTimeForJoining, fixedTime, randomTime
+  params.durationOfPeriod, params.avoidBorderEffect, params.borderEffectGuardTime = durationOfPeriod, avoidBorderEffect, borderEffectGuardTime
+  runtime = CARARuntime(AsyncLoRaSocket(s), radioState, schedule, params, txQueue, dutyCycle, clock.nowUs, lambda: Random(),
+                        lambda period: CARASchedule(sfMask, initialResourceBlock, period, algorithm, lora.mac(), loadHints, clock.epochDayUs),
+                        uplinkGuardTime, fetchParameters, parametersRefreshPeriod, sampleTestData, telemetryPeriod, printDownlink,
+                        bMergePayloads, bDeferBorderTransmissions, mergedFPort, initialResourceBlock if bFixedChannelAndDR else None,
+                        downlinks if bDownlinkCommands else None, latenessHistogram, durationOfPeriodFromJoinAccept)
+  print("[INFO] Starting the asynchronous runtime")
+  asyncio.run(runtime.run())
+
+# Functions related to the downlinks
+def caraConfig():
+  # CARA assignment of the schedule (see downlinkDispatcher.py)
+  return {'sfMask': sfMask, 'initialResourceBlock': initialResourceBlock, 'algorithm': algorithm,
+          'durationOfPeriod': durationOfPeriod, 'loadHints': loadHints}
+
+def newSchedule(config):
+  return CARASchedule(config['sfMask'], config['initialResourceBlock'], config['durationOfPeriod'], config['algorithm'], lora.mac(), config['loadHints'], clock.epochDayUs)
+
+def applyReconfiguration(us):
+  # Schedule of a transmission at us (a reconfiguration downlink replaces it from
+  # its period boundary)
+  global schedule, sfMask, initialResourceBlock, algorithm, durationOfPeriod, durationOfPeriodFromJoinAccept, loadHints
+  if downlinks.scheduleAt(us) is schedule:
+    return
+  schedule = downlinks.schedule
+  sfMask, initialResourceBlock, algorithm, durationOfPeriod, loadHints = [downlinks.config[key] for key in CONFIG_KEYS]
+  durationOfPeriodFromJoinAccept = durationOfPeriodFromJoinAccept or downlinks.periodFromCommand
+  print("[INFO] New CARA schedule from t={:.3f} ({:d} reconfigurations)".format(downlinks.activationUs/1000000, downlinks.swaps))
+  if bBootCache:
+    saveCARABootCache()
+
+def waitForTransmission(us):
+  # Sleep until us. With bDownlinkCommands, the socket wakes up the device for the
+  # downlinks received meanwhile (see downlinkDispatcher.py)
+  if not (bDownlinkCommands and caraEnabled == 1):
+    clock.sleepUntilUs(us)
+    return
+  downlinks.waitUntil(s, downlinkPoller, clock, us)
+
+# Functions related to the transmit timing
+def baseGuardTime(borderEffectGuardTime):
+  # Guard time from the p99 of the lateness (bAutoGuardTime) or static
+  if bAutoGuardTime:
+    return autoGuardTime(latenessHistogram, borderEffectGuardTime, autoGuardTimeMargin, maxGuardTime=maxBorderEffectGuardTime)
+  return borderEffectGuardTime
+
+def reportTiming():
+  print("[INFO] Lateness of the last frames: mean {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms (guard time {:.3f} s)".format(
+    latenessHistogram.mean()/1000, latenessHistogram.quantile(0.99)/1000, latenessHistogram.maxUs/1000, guardTime))
+  if timingLogFile is not None:
+    timingLog.save(timingLogFile)
+
+# Functions related to the tracing
+def reportTrace():
+  # Printed, and sent to the CARA web server in a thread (not in the uplink pipeline)
+  tracer.dump()
+  if traceEndpoint is not None:
+    _thread.start_new_thread(pushTrace, (tracer.report(),))
+
+def pushTrace(report):
+  try:
+    MicroWebCli.JSONRequest(caraServerURL + traceEndpoint, report, keepAlive=bHTTPKeepAlive)
+  except Exception as e:
+    print("[INFO] Trace not sent:", e)
+
+def goToSleep(timeToSleep):
+  print("[INFO] Sleeping {:.1f} s ({})...".format(timeToSleep, lowPowerSleepMode))
+  if lowPowerSleepMode == 'pycoproc':
+    py = Pycoproc()
+    py.setup_sleep(int(timeToSleep))
+    py.go_to_sleep(gps=False)
+  else:
+    machine.deepsleep(int(1000*timeToSleep))
 
-  return [channelsList, sfList]
+def setTransmissionParameters(selectedFreq, selectedDR):
+  # Only the frequency and/or DR that changed are programmed (see radioState.py,
+  # which holds the socket)
+  radioState.setTransmissionParameters(selectedFreq, selectedDR)
 
-def setDataRate(s, selectedDR):
+def setDataRate(selectedDR):
   # Set spreading factor
-  s.setsockopt(socket.SOL_LORA, socket.SO_DR, selectedDR)
-  if (debug > 0):
-    print("[DEBUG] Changing DR to {:d} (SF={:d})".format(selectedDR, convertDRtoSF(selectedDR)))
-
-def generateMessage(messageCounter):
-  if (messageCounter < 10):
-    message = "Testing data....." + str(messageCounter)
-  elif (messageCounter < 100):
-    message = "Testing data...." + str(messageCounter)
-  elif (messageCounter < 1000):
-    message = "Testing data..." + str(messageCounter)
-  elif (messageCounter < 10000):
-    message = "Testing data.." + str(messageCounter)
-  else:
-    message = "Testing data." + str(messageCounter)
-
-  return message
+  radioState.setDataRate(selectedDR)
 
 # Functions related to resource blocks
 def getCARAParameters():
-  contentBytes = MicroWebCli.GETRequest('http://192.168.1.205/CARA/joinTime')
-  randomTimeForJoining = float(contentBytes)
-  print("[INFO] Random time for joining = {:f}".format(randomTimeForJoining))
+  # All the parameters in one request (bundle endpoint) if the server supports it,
+  # otherwise one request per parameter
+  params = fetchCARAParameters(caraServerURL, caraParametersBundle if bCARAParametersBundle else None, bHTTPKeepAlive)
+  if params.bundled:
+    print("[INFO] CARA parameters obtained with {:d} HTTP request(s) (bundle)".format(params.requests))
+  else:
+    print("[INFO] CARA parameters obtained with {:d} HTTP request(s)".format(params.requests))
+  print("[INFO] TCP connections opened = {:d}, reused = {:d}".format(MicroWebCli.ConnOpenedCount, MicroWebCli.ConnReusedCount))
+
+  print("[INFO] Random time for joining = {:f}".format(params.randomTimeForJoining))
 
   # Time between transmissions = fixedTime + rand(randomTime)
-  contentBytes = MicroWebCli.GETRequest('http://192.168.1.205/CARA/fixedTime')
-  fixedTime = float(contentBytes)
-  print("[INFO] Fixed time between LoRaWAN frames = {:f}".format(fixedTime))
-  contentBytes = MicroWebCli.GETRequest('http://192.168.1.205/CARA/randomTime')
-  randomTime = float(contentBytes)
-  print("[INFO] Ramdom time between LoRaWAN frames = {:f}".format(randomTime))
+  print("[INFO] Fixed time between LoRaWAN frames = {:f}".format(params.fixedTime))
+  print("[INFO] Ramdom time between LoRaWAN frames = {:f}".format(params.randomTime))
 
   # Duration of each period with same transmission parameters (freq and SF)
   # We assume that 48*durationOfPeriod is a divisor of 24h*3600s
-  contentBytes = MicroWebCli.GETRequest('http://192.168.1.205/CARA/durationOfPeriod')
-  durationOfPeriod = float(contentBytes)
-  print("[INFO] Duration of CARA period = {:f}".format(durationOfPeriod))
+  print("[INFO] Duration of CARA period = {:f}".format(params.durationOfPeriod))
 
   # Avoid (or not) border effect (transmissions that spread over two periods)
-  contentBytes = MicroWebCli.GETRequest('http://192.168.1.205/CARA/avoidBorderEffect')
-  avoidBorderEffect = int(contentBytes)
-  print("[INFO] Avoid border effect = {:d}".format(avoidBorderEffect))
-  contentBytes = MicroWebCli.GETRequest('http://192.168.1.205/CARA/borderEffectGuardTime')
-  borderEffectGuardTime = float(contentBytes)
-  print("[INFO] Border effect guard time = {:f}".format(borderEffectGuardTime))
+  print("[INFO] Avoid border effect = {:d}".format(params.avoidBorderEffect))
+  print("[INFO] Border effect guard time = {:f}".format(params.borderEffectGuardTime))
 
-  contentBytes = MicroWebCli.GETRequest('http://192.168.1.205/CARA/count_v2.php')
-  countNodes = int(contentBytes)
-  print("[INFO] Nodes with version 2 counted = {:d}".format(countNodes))
+  print("[INFO] Nodes with version 2 counted = {:d}".format(params.countNodes))
 
-  return [randomTimeForJoining, fixedTime, randomTime, durationOfPeriod, avoidBorderEffect, borderEffectGuardTime]
+  return params.asList()
 
 def receiveJoinAccept():
-  # Waiting for JoinAccept message
-  JoinAcceptReceived = False
-  # JoinRequest has to be transmitted
-  timeToRetransmitJoinReq = True
-  while not JoinAcceptReceived:
-
-    if (timeToRetransmitJoinReq):
-      s.setblocking(True)
-      s.send("#JOINREQ#")
-      print("[INFO] #JOINREQ# sent!")
-      s.setblocking(False)
-      timeToRetransmitJoinReq = False
-      timeJoinReq1 = utime.ticks_ms()
-
-    #if (bOTAA):
-    if (True):
-      data, port = s.recvfrom(64)
-    else:
-      data = s.recv(64)
-
-    lg = len (data)
-    if lg > 0:
-      if (debug > 0):
-        print("[DEBUG] Downlink Port={:d} Size={:d} Payload={}".format(port, lg, ubinascii.hexlify(data).upper()) )
-      strDecodedData = ubinascii.a2b_base64(ubinascii.b2a_base64(data)).decode('utf-8')
-      if (debug > 0):
-        print("[DEBUG] Downlink Port={:d} Size={:d} Payload={}".format(port, lg, strDecodedData) )
-
-      if strDecodedData.find("#JOINACC#") == 0:
-        print ("[INFO] #JOINACC# received")
-        JoinAcceptReceived = True
-        strDecodedDataSplit = strDecodedData.split()
-        caraEnabled = int(strDecodedDataSplit[1])
-
-        if caraEnabled == 1:
-          print("[INFO] CARA enabled")
-          initialResourceBlock = int(strDecodedDataSplit[2])
-          sfMask = int(strDecodedDataSplit[3])
-
-          print("[INFO] Initial resource block = {:d}".format(initialResourceBlock))
-          print("[INFO] SF mask = {:d}".format(sfMask))
-          #print("SF mask={:d}".format(sfMask))
-          channelsList, sfList = createResourceBlocksLists(sfMask)
-
-          selectedSF = sfList[initialResourceBlock]
-          selectedDR = convertSFtoDR(selectedSF)
-
-          # Remove all the channels (first three are default channels and cannot be removed)
-          for channel in range(0, 15):
-            lora.remove_channel(channel)
-
-        else:
-          print("[INFO] CARA disabled, using standard LoRaWAN...")
-          # If CARA is disabled, the server will use 0...5 as the initial resource block,
-          # which will be used to define the DR (i.e. the spreading factor) for each node
-          selectedDR = int(strDecodedDataSplit[2]) #[4])
-          setDataRate(s, selectedDR)
-          print("[INFO] Selected DataRate = {:d}".format(selectedDR))
-
-    time.sleep(0.1)
-    timeJoinReq2 = utime.ticks_ms()
-    timeFromLastJoinReq = utime.ticks_diff(timeJoinReq2,timeJoinReq1)
-    #print("Time (ms) from last transmission of Join Request = {:.3f}".format(timeFromLastJoinReq))
-    if (timeFromLastJoinReq > (1000*joinReqRtxTime)):
-      timeToRetransmitJoinReq = True
-
-  return [caraEnabled, initialResourceBlock, sfMask, selectedDR, channelsList, sfList]
-
-def assignmentAlgorithm1(timeNextTransmission, channelsList, sfList, initialResourceBlock):
-  # THIS ALGORITHM SELECT THE CHANNEL AND SF FOLLOWING A SEQUENTIAL ORDER
-
-  if (debug > 0):
-    print("[DEBUG] Time for next transmission (sec) = {:.3f}".format(timeNextTransmission))
-  #print("durationOfPeriod = {:.2f}".format(durationOfPeriod))
-  indexCurrentPeriod = int(timeNextTransmission / durationOfPeriod)
-  if (debug > 0):
-    print("[DEBUG] Current period = {:d}".format(indexCurrentPeriod))
-
-  noResourceBlocks = len(channelsList)
-  currentResourceBlock = (indexCurrentPeriod+initialResourceBlock) % noResourceBlocks
-  selectedFreq = channelsList[currentResourceBlock]
-  selectedSF = sfList[currentResourceBlock]
-  selectedDR = convertSFtoDR(selectedSF)
-  #nextResourceBlock = (indexCurrentPeriod+initialResourceBlock+1) % noResourceBlocks
-  #selectedFreqForNextPeriod = channelsList[nextResourceBlock]
-  #selectedSFForNextPeriod = sfList[nextResourceBlock]
-  #selectedDRForNextPeriod = convertSFtoDR(selectedSFForNextPeriod)
+  global durationOfPeriod, durationOfPeriodFromJoinAccept
+  # Wake up only when a downlink is received or when the JoinRequest has to be
+  # retransmitted (deadline), instead of polling the socket (see joinWait.py)
+  poller = select.poll()
+  poller.register(s, select.POLLIN)
+  joinReqPolicy = JoinReqPolicy(Random, joinReqRtxTime, bJoinReqBackoff, joinReqRtxMaxTime, joinReqRtxMinTime, 5, joinReqMinDR, joinReqEscalateEvery)
+  # Default assignment algorithm, without load hints
+  algorithm = assignmentAlgorithm
+  loadHints = None
+
+  def beforeJoinReq():
+    if (joinReqEscalateEvery > 0):
+      setDataRate(joinReqPolicy.dataRate())
+
+  def onDownlink(data, port):
+    if (debug > 0):
+      print("[DEBUG] Downlink Port={:d} Size={:d} Payload={}".format(port, len(data), ubinascii.hexlify(data).upper()) )
+
+  joinAccept, lg, wakeups = waitForJoinAccept(s, poller, joinReqPolicy, utime.ticks_ms, utime.ticks_add, utime.ticks_diff, beforeJoinReq, onDownlink)
+  print ("[INFO] #JOINACC# received ({:d} bytes)".format(lg))
+  if (joinReqEscalateEvery > 0):
+    setDataRate(5)
+  caraEnabled = joinAccept['caraEnabled']
+  if joinAccept['durationOfPeriod'] is not None:
+    durationOfPeriod = joinAccept['durationOfPeriod']
+    durationOfPeriodFromJoinAccept = True
+    print("[INFO] Duration of period = {:.3f} s (#JOINACC#)".format(durationOfPeriod))
+
+  if caraEnabled == 1:
+    print("[INFO] CARA enabled")
+    initialResourceBlock = joinAccept['initialResourceBlock']
+    sfMask = joinAccept['sfMask']
+    # Optional fields: assignment algorithm and load of each SF (SF7,SF8,...)
+    if joinAccept['algorithm'] is not None:
+      algorithm = joinAccept['algorithm']
+    if joinAccept['loadHints'] is not None:
+      loadHints = joinAccept['loadHints']
+
+    print("[INFO] Initial resource block = {:d}".format(initialResourceBlock))
+    print("[INFO] SF mask = {:d}".format(sfMask))
+    print("[INFO] Assignment algorithm = {}".format(algorithm))
+    #print("SF mask={:d}".format(sfMask))
+    channelsList, sfList = createResourceBlocksLists(sfMask)
+
+    selectedSF = sfList[initialResourceBlock]
+    selectedDR = convertSFtoDR(selectedSF)
+
+    # Remove all the channels (first three are default channels and cannot be removed)
+    for channel in range(0, 15):
+      lora.remove_channel(channel)
+    radioState.invalidate()
 
-  if (debug > 0):
-    print("[DEBUG] Current resource block = {:d}".format(currentResourceBlock))
-    print("[DEBUG] Selected frequency = {:d}".format(selectedFreq))
-    print("[DEBUG] Selected DR = {:d}".format(selectedDR))
-
-  #print("Next resource block = {:d}".format(nextResourceBlock))
-  #print("Selected frequency for next period = {:d}".format(selectedFreqForNextPeriod))
-  #print("Selected DR for next period = {:d}".format(selectedDRForNextPeriod))
-
-  #return [selectedFreq, selectedDR, selectedFreqForNextPeriod, selectedDRForNextPeriod]
-  return [selectedFreq, selectedDR]
-
-#def checkBorderEffect(timeNextTransmission, selectedFreq, selectedDR, selectedFreqForNextPeriod, selectedDRForNextPeriod, borderEffectGuardTime, payloadsize):
-def checkBorderEffect(timeNextTransmission, selectedFreq, selectedDR, borderEffectGuardTime, payloadsize):
-  # CHECK TIME OVER AIR TO AVOID BORDER EFFECTS (WAIT FOR NEXT PERIOD IF NECESSARY)
+  else:
+    print("[INFO] CARA disabled, using standard LoRaWAN...")
+    # If CARA is disabled, the server will use 0...5 as the initial resource block,
+    # which will be used to define the DR (i.e. the spreading factor) for each node
+    selectedDR = joinAccept['initialResourceBlock']
+    setDataRate(selectedDR)
+    print("[INFO] Selected DataRate = {:d}".format(selectedDR))
 
-  airTime = airtimetheoretical(payloadsize, convertDRtoSF(selectedDR), LoRa.BW_125KHZ, LoRa.CODING_4_5)[0]
-  limitForThisPeriod = (int(timeNextTransmission / durationOfPeriod)+1) * durationOfPeriod
   if (debug > 0):
-    print("checkBorderEffect: timeNextTransmission={:.2f}, airTime={:.2f}, limitForThisPeriod={:.2f}".format(timeNextTransmission, airTime, limitForThisPeriod))
-
-  if ( (timeNextTransmission + airTime + borderEffectGuardTime) > limitForThisPeriod ):
-    # The transmission has to wait for next period
-    #timeNextTransmission = limitForThisPeriod + 0.1
-#    timeNextTransmission = timeNextTransmission + airTime + borderEffectGuardTime + 0.1
-#    if (debug > 0):
-#    print("AVOIDING BORDER EFFECT: timeNextTransmission = {:.3f}".format(timeNextTransmission))
-    borderTransmission = True
-  else:
-    # The transmission can be fitted in the current period
-#    print("The transmission can be fitted in the current period")
-    borderTransmission = False
+    print("[DEBUG] Wake ups waiting for #JOINACC# = {:d}".format(wakeups))
 
-#  return timeNextTransmission
-  return borderTransmission
+  return [caraEnabled, initialResourceBlock, sfMask, selectedDR, channelsList, sfList, algorithm, loadHints]
 
 
 ###################
 ## MAIN FUNCTION ##
 ###################
 
-# INITIALIZE LORA (LORAWAN mode. Europe = LoRa.EU868)
-lora = LoRa(mode=LoRa.LORAWAN, region=LoRa.EU868, public=True, tx_retries=3, device_class=LoRa.CLASS_C, adr=False)
+# Debug messages also for the CARA scheduler functions and the radio configuration
+caraScheduler.debug = debug
+radioStateModule.debug = debug
+joinWaitModule.debug = debug
 
-# BOARD INFORMATION
-showBoard(lora)
+bootTicks = utime.ticks_ms()
 
-# CONNECT TO WIFI
-timeToWaitForWiFi = RandomRange(0,10)
-time.sleep(timeToWaitForWiFi)
+# State saved before the last deep sleep (low power mode)
+sleepState = None
+if bLowPower:
+  sleepState = loadSleepState()
 
-connectWiFi()
-
-## TIME SYNCHRONIZATION
-rtc = synchronizeTime()
-
-# OBTAIN EXPERIMENT PARAMETERS
-randomTimeForJoining, fixedTime, randomTime, durationOfPeriod, avoidBorderEffect, borderEffectGuardTime = getCARAParameters()
-
-## LORAWAN (initialize and return a socket)
-s = initializeLoRaWAN(randomTimeForJoining)
+# INITIALIZE LORA (LORAWAN mode. Europe = LoRa.EU868)
+lora = LoRa(mode=LoRa.LORAWAN, region=LoRa.EU868, public=True, tx_retries=3, device_class=LoRa.CLASS_C, adr=False)
 
-# Waiting for Join Accept message (from CARA server)
-caraEnabled, initialResourceBlock, sfMask, selectedDR, channelsList, sfList = receiveJoinAccept()
+messageCounter = 0
+# Uplink payload (preallocated buffer) and its air time for every DR
+payload = createPayloadBuilder(payloadEncoding)
+payloadAirTimes = [airtime(payload.size, convertDRtoSF(dr), LoRa.BW_125KHZ, LoRa.CODING_4_5) for dr in range(6)]
+# Transmissions deferred and held in the queue due to the border effect
+framesDeferred = 0
+framesBorderHeld = 0
+# The last frame was held at the border effect (sent in the next transmission time)
+frameHeldAtBorder = False
+# Transmit queue (application payloads) and air time used per sub-band
+txQueue = TxQueue()
+dutyCycle = DutyCycleLedger()
+framesHeld = 0
+# Spans of the stages of the uplink pipeline (only measured with bTrace)
+tracer = Tracer(bTrace)
+# Timing records of the last frames and histogram of their lateness
+timingLog = TimingLog()
+latenessHistogram = LatenessHistogram()
+# Time between the last and the next transmissions, if already obtained
+nextRandNo = None
+# Air time, awake time and sleep time (low power mode)
+energy = EnergyEstimate()
+# CARA parameters obtained by the background revalidation (warm boot)
+revalidatedParameters = None
+# The duration of period was assigned by the #JOINACC# (or a reconfiguration
+# downlink), so it is kept when the HTTP parameters are revalidated
+durationOfPeriodFromJoinAccept = False
+
+# NTP synchronization service (last synchronization and drift of the RTC from the flash)
+timeSync = TimeSync(machine.RTC(), ntpServer, ntpDeadline, ntpResyncPeriod)
+
+# Boot cache (only valid if the RTC still has the time)
+bootCache = None
+if bBootCache and sleepState is None:
+  rtc = machine.RTC()
+  if rtc.now()[0] >= 2020:
+    bootCache = loadBootCache(rtcToUs(rtc.now())//1000000)
+  if bootCache is not None:
+    lora.nvram_restore()
+    if not lora.has_joined():
+      bootCache = None
+
+if sleepState is not None:
+  # WAKE UP FROM DEEP SLEEP (LoRaWAN session and state from the flash, without
+  # Wi-Fi, NTP, HTTP parameters or join)
+  lora.nvram_restore()
+  rtc = machine.RTC()
+  restoreRTC(rtc, sleepState['wakeUpUs'])
+  clock = CARAClock(rtc, epochDayUs=sleepState['epochDayUs'])
+  randomTimeForJoining, fixedTime, randomTime, durationOfPeriod, avoidBorderEffect, borderEffectGuardTime = [sleepState[key] for key in ('randomTimeForJoining', 'fixedTime', 'randomTime', 'durationOfPeriod', 'avoidBorderEffect', 'borderEffectGuardTime')]
+  caraEnabled, initialResourceBlock, sfMask, selectedDR, algorithm, loadHints = [sleepState[key] for key in ('caraEnabled', 'initialResourceBlock', 'sfMask', 'selectedDR', 'algorithm', 'loadHints')]
+  messageCounter, timeLastTransmissionUs, nextRandNo, framesDeferred, framesBorderHeld, frameHeldAtBorder = [sleepState[key] for key in ('messageCounter', 'timeLastTransmissionUs', 'nextRandNo', 'framesDeferred', 'framesBorderHeld', 'frameHeldAtBorder')]
+  durationOfPeriodFromJoinAccept = sleepState['durationOfPeriodFromJoinAccept']
+  energy = EnergyEstimate(*sleepState['energy'])
+  dutyCycle.load(sleepState['dutyCycle'])
+  txQueue.load(sleepState['txQueue'])
+  s = createLoRaSocket()
+  radioState = RadioState(lora, s, 5)
+  print("[INFO] Woke up from deep sleep (message counter = {:d})".format(messageCounter))
+  bootType = 'resume'
+
+elif bootCache is not None:
+  # WARM BOOT (parameters and #JOINACC# assignment from the boot cache, LoRaWAN
+  # session from the NVRAM); Wi-Fi, NTP and HTTP parameters in the background
+  clock = CARAClock(rtc)
+  randomTimeForJoining, fixedTime, randomTime, durationOfPeriod, avoidBorderEffect, borderEffectGuardTime = [bootCache[key] for key in ('randomTimeForJoining', 'fixedTime', 'randomTime', 'durationOfPeriod', 'avoidBorderEffect', 'borderEffectGuardTime')]
+  caraEnabled, initialResourceBlock, sfMask, selectedDR, algorithm, loadHints = [bootCache[key] for key in ('caraEnabled', 'initialResourceBlock', 'sfMask', 'selectedDR', 'algorithm', 'loadHints')]
+  durationOfPeriodFromJoinAccept = bootCache['durationOfPeriodFromJoinAccept']
+  s = createLoRaSocket()
+  radioState = RadioState(lora, s, 5)
+  print("[INFO] Warm boot from the boot cache (saved {:d} s ago)".format(rtcToUs(rtc.now())//1000000 - bootCache['savedAt']))
+  _thread.start_new_thread(revalidateBootCache, ())
+  bootType = 'warm'
+
+else:
+  # BOARD INFORMATION
+  showBoard(lora)
+
+  # CONNECT TO WIFI
+  timeToWaitForWiFi = RandomRange(0,10)
+  time.sleep(timeToWaitForWiFi)
+
+  connectWiFi()
+
+  ## TIME SYNCHRONIZATION
+  rtc = synchronizeTime()
+  # Monotonic time base (seconds since the midnight of today, without wrapping)
+  clock = CARAClock(rtc)
+
+  # OBTAIN EXPERIMENT PARAMETERS
+  randomTimeForJoining, fixedTime, randomTime, durationOfPeriod, avoidBorderEffect, borderEffectGuardTime = getCARAParameters()
+
+  ## LORAWAN (initialize and return a socket)
+  s = initializeLoRaWAN(randomTimeForJoining)
+  # Radio configuration (the socket is created with DR5)
+  radioState = RadioState(lora, s, 5)
+
+  # Waiting for Join Accept message (from CARA server)
+  caraEnabled, initialResourceBlock, sfMask, selectedDR, channelsList, sfList, algorithm, loadHints = receiveJoinAccept()
+
+  if bBootCache:
+    saveCARABootCache()
+    lora.nvram_save()
+
+  bootType = 'cold'
+
+# Unknown assignment algorithm (boot cache or sleep state of another firmware,
+# configuration): the default one instead of a ValueError of CARASchedule
+if not knownAssignmentAlgorithm(algorithm):
+  print("[INFO] Unknown assignment algorithm {}, using {}".format(algorithm, assignmentAlgorithm))
+  algorithm = assignmentAlgorithm if knownAssignmentAlgorithm(assignmentAlgorithm) else 'sequential'
+
+# Channel and DR of every period, from the #JOINACC# parameters
+schedule = CARASchedule(sfMask, initialResourceBlock, durationOfPeriod, algorithm, lora.mac(), loadHints, clock.epochDayUs)
+# Reconfiguration downlinks (Class C) received between uplinks
+downlinks = DownlinkDispatcher(schedule, caraConfig(), newSchedule, printDownlink)
+downlinkPoller = select.poll()
+downlinkPoller.register(s, select.POLLIN)
+
+if caraEnabled == 1 and not timeSync.timeKnown():
+  # RTC without time (power loss) and no NTP: uplinks held until the synchronization
+  # (the CARA periods of a wrong time would collide with the other devices), then
+  # the time base and the schedule start from the synchronized time
+  print("[INFO] Time unknown, uplinks held until the NTP synchronization")
+  waited = timeSync.waitUntilKnown(lambda: WLAN().isconnected())
+  clock.sync()
+  schedule = CARASchedule(sfMask, initialResourceBlock, durationOfPeriod, algorithm, lora.mac(), loadHints, clock.epochDayUs)
+  downlinks.setSchedule(schedule, caraConfig())
+  print("[INFO] Time synchronized after {:.0f} s, uplinks started".format(waited))
+
+if bAsyncRuntime and not bLowPower and caraEnabled == 1:
+  runAsyncRuntime()
+
+firstUplink = True
 
 # Infinite loop
-messageCounter = 0
 while True:
 
-  message = generateMessage (messageCounter) # Testing data.....01, ...
-  payloadsize = len(message)
-  messageCounter = messageCounter + 1
-
-  # Time between transmissions
-  randNo = fixedTime + RandomRange(0,randomTime)
+  if revalidatedParameters is not None:
+    # New CARA parameters from the server (the #JOINACC# assignment is kept, also
+    # its duration of period)
+    newRandomTimeForJoining, newFixedTime, newRandomTime, newDurationOfPeriod, newAvoidBorderEffect, newBorderEffectGuardTime = revalidatedParameters
+    if durationOfPeriodFromJoinAccept:
+      newDurationOfPeriod = durationOfPeriod
+    # (the cached values are single precision)
+    if any(abs(a - b) > 1e-6*max(1, abs(a)) for a, b in zip([newRandomTimeForJoining, newFixedTime, newRandomTime, newAvoidBorderEffect, newBorderEffectGuardTime], [randomTimeForJoining, fixedTime, randomTime, avoidBorderEffect, borderEffectGuardTime])):
+      print("[INFO] CARA parameters changed, using the new ones")
+      randomTimeForJoining, fixedTime, randomTime, avoidBorderEffect, borderEffectGuardTime = newRandomTimeForJoining, newFixedTime, newRandomTime, newAvoidBorderEffect, newBorderEffectGuardTime
+    if abs(newDurationOfPeriod - durationOfPeriod) > 1e-6*max(1, newDurationOfPeriod):
+      print("[INFO] Duration of period changed, using the new one ({:.3f} s)".format(newDurationOfPeriod))
+      durationOfPeriod = newDurationOfPeriod
+      schedule = CARASchedule(sfMask, initialResourceBlock, durationOfPeriod, algorithm, lora.mac(), loadHints, clock.epochDayUs)
+      downlinks.setSchedule(schedule, caraConfig())
+    saveCARABootCache()
+    revalidatedParameters = None
+
+  # Background NTP resync, and guard time widened to the uncertainty of the time
+  timeSync.poll(WLAN().isconnected())
+  guardTime = widenedGuardTime(baseGuardTime(borderEffectGuardTime), timeSync.uncertainty(), maxBorderEffectGuardTime)
+
+  # Test data (application producer): one payload per transmission time into the
+  # transmit queue, "Testing data.....0", ... (or binary, see payloadBuilder.py).
+  # Not after a frame held at the border effect: that frame is sent in this
+  # transmission time instead, so the queue does not grow with the held frames
+  if frameHeldAtBorder:
+    frameHeldAtBorder = False
+  else:
+    messageCounter = messageCounter + 1
+    if not txQueue.push(payload.build(messageCounter - 1, (clock.epochDayUs + clock.nowUs())//1000000)):
+      print("[INFO] Transmit queue full, payload dropped ({:d} dropped)".format(txQueue.dropped))
+  # Next frame of the queue (with the next payloads if they are merged)
+  payloadsize, framePayloads = txQueue.frameSize(bMergePayloads)
+
+  # Time between transmissions (already obtained before sleeping in low power mode)
+  if nextRandNo is not None:
+    randNo = nextRandNo
+    nextRandNo = None
+  else:
+    randNo = fixedTime + RandomRange(0,randomTime)
   if (debug > 0):
     print("[DEBUG] Random number = {:.1f}".format(randNo))
 
   # Initially we assume that there is no border effect (checked later)
   borderTransmission = False
 
+  # (the transmission times are integer microseconds of the time base, see
+  # CARASchedule.periodAtUs: the float seconds are not precise enough after days)
   if (messageCounter == 1):
-    year, month, day, hour, minute, second, usecond, nothing = rtc.now()
-    currentTime = hour*3600 + minute*60 + second + usecond/1000000
+    currentUs = clock.nowUs()
 
     if (bFirstTransmissionStartingOnACARAPeriod):
       # In order to start (first message) at the beginning of one period... just for testing
-      limitForThisPeriod = (int(currentTime / durationOfPeriod)+1) * durationOfPeriod
-      timeNextTransmission = limitForThisPeriod + 1.0
+      limitForThisPeriodUs = schedule.nextBoundaryUs(currentUs)
+      timeNextTransmissionUs = limitForThisPeriodUs + 1000000
     else:
       # First packet sent at random time
-      timeNextTransmission = currentTime + randNo
+      timeNextTransmissionUs = currentUs + int(1000000*randNo)
 
-    selectedFreq, selectedDR = assignmentAlgorithm1(timeNextTransmission, channelsList, sfList, initialResourceBlock)
+    timeScheduledTransmissionUs = timeNextTransmissionUs
+    selectedFreq, selectedDR = schedule.parametersAtUs(timeNextTransmissionUs)
 
   else:
     # Not the first packet
 
     if caraEnabled == 1:
       # Our algorithm for assigning a frequency and a spreading factor for this transmission
-      timeNextTransmission = timeLastTransmission + randNo
-      selectedFreq, selectedDR = assignmentAlgorithm1(timeNextTransmission, channelsList, sfList, initialResourceBlock)
+      timeNextTransmissionUs = timeLastTransmissionUs + int(1000000*randNo)
+      timeScheduledTransmissionUs = timeNextTransmissionUs
+      traceStart = tracer.start()
+      if bDownlinkCommands:
+        applyReconfiguration(timeNextTransmissionUs)
+      selectedFreq, selectedDR = schedule.parametersAtUs(timeNextTransmissionUs)
+      # FOR TESTING, FIXED CHANNEL AND DR (OBTAINED FROM CARA - #JOINACC# PARAMETERS)...
+      # (before the border effect check, so it is done with the DR actually used)
+      if bFixedChannelAndDR:
+        selectedFreq, selectedDR = schedule.parametersOfBlock(initialResourceBlock)
+      tracer.end(STAGE_SCHEDULE, traceStart)
 
       # If border effect has to be avoided
       if avoidBorderEffect == 1:
-#        timeNextTransmission = checkBorderEffect(timeNextTransmission, selectedFreq, selectedDR, borderEffectGuardTime, payloadsize)
-#        selectedFreq, selectedDR = assignmentAlgorithm1(timeNextTransmission, channelsList, sfList, initialResourceBlock)
-        borderTransmission = checkBorderEffect(timeNextTransmission, selectedFreq, selectedDR, borderEffectGuardTime, payloadsize)
-
-      # FOR TESTING, FIXED CHANNEL AND DR (OBTAINED FROM CARA - #JOINACC# PARAMETERS)...
-      if bFixedChannelAndDR:
-        selectedFreq = channelsList[initialResourceBlock]
-        selectedSF = sfList[initialResourceBlock]
-        selectedDR = convertSFtoDR(selectedSF)
+        traceStart = tracer.start()
+#        timeNextTransmission = checkBorderEffect(timeNextTransmission, selectedFreq, selectedDR, borderEffectGuardTime, payloadsize, durationOfPeriod)
+#        selectedFreq, selectedDR = assignmentAlgorithm1(timeNextTransmission, channelsList, sfList, initialResourceBlock, durationOfPeriod)
+        borderTransmission = checkBorderEffectUs(timeNextTransmissionUs, selectedFreq, selectedDR, guardTime, payloadsize, schedule.periodUs, schedule.epochOffsetUs)
+        if borderTransmission and bDeferBorderTransmissions:
+          # (before the earliest next transmission, fixedTime after the scheduled one)
+          deferred = deferTransmissionUs(schedule, timeNextTransmissionUs, guardTime, payloadsize, initialResourceBlock if bFixedChannelAndDR else None, timeScheduledTransmissionUs + int(1000000*fixedTime))
+          # (not deferred beyond a pending reconfiguration)
+          if deferred is not None and not downlinks.pendingBefore(deferred[0]):
+            timeNextTransmissionUs, selectedFreq, selectedDR = deferred
+            borderTransmission = False
+            framesDeferred = framesDeferred + 1
+            print("[INFO] Message deferred to t={:.3f} due to border effect ({:d} deferred, {:d} held)".format(timeNextTransmissionUs/1000000, framesDeferred, framesBorderHeld))
+        tracer.end(STAGE_BORDER_EFFECT, traceStart)
 
       # Set transmission parameters (frequency and spreading factor)
-      setTransmissionParameters(s, selectedFreq, selectedDR)
+      traceStart = tracer.start()
+      setTransmissionParameters(selectedFreq, selectedDR)
+      tracer.end(STAGE_RADIO_CONFIG, traceStart)
     # end if (caraEnabled == 1)
 
-  airTime = airtimetheoretical(payloadsize, convertDRtoSF(selectedDR), LoRa.BW_125KHZ, LoRa.CODING_4_5)[0]
-  year, month, day, hour, minute, second, usecond, nothing = rtc.now()
-  currentTime = hour*3600 + minute*60 + second + usecond/1000000
+  if (debug > 0):
+    print("[DEBUG] Current period = {:d}, resource block = {:d}".format(schedule.periodAtUs(timeNextTransmissionUs), schedule.blockAtUs(timeNextTransmissionUs)))
+  if payloadsize == payload.size:
+    airTime = payloadAirTimes[selectedDR]
+  else:
+    airTime = airtime(payloadsize, convertDRtoSF(selectedDR), LoRa.BW_125KHZ, LoRa.CODING_4_5)
+  currentUs = clock.nowUs()
   #timeToWait = randNo - (currentTime - lastTime) - airTime
-  timeToWait = timeNextTransmission - currentTime
+  timeToWait = (timeNextTransmissionUs - currentUs)/1000000
   if (debug > 0):
-    print("[DEBUG] currentTime = {:.3f}".format(currentTime))
-    print("[DEBUG] timeNextTransmission = {:.3f}".format(timeNextTransmission))
+    print("[DEBUG] currentTime = {:.3f}".format(currentUs/1000000))
+    print("[DEBUG] timeNextTransmission = {:.3f}".format(timeNextTransmissionUs/1000000))
     print("[DEBUG] timeToWait = {:.3f}".format(timeToWait))
     print("[DEBUG] airTime = {:.3f}".format(airTime))
-  timeLastTransmission = timeNextTransmission
+    print("[DEBUG] guardTime = {:.3f}".format(guardTime))
+  # The next transmission is computed from the scheduled time (not from the deferred
+  # one), so deferring does not change the time between transmissions
+  timeLastTransmissionUs = timeScheduledTransmissionUs
 
   if (timeToWait > 0):
-    print("[INFO] Waiting for next transmission (t={:.3f})...".format(timeNextTransmission))
-    time.sleep(timeToWait)
+    print("[INFO] Waiting for next transmission (t={:.3f})...".format(timeNextTransmissionUs/1000000))
+    # Garbage collection while waiting (not just before the transmission)
+    gc.collect()
+    waitForTransmission(timeNextTransmissionUs)
   else:
     print("[INFO] Next transmission starts immediately (time between transmissions too short)!")
-
-  if (borderTransmission == False):
+  traceWakeUp = tracer.start()
+  wakeUs = clock.nowUs()
+
+  if bDownlinkCommands and caraEnabled == 1 and downlinks.pendingBefore(timeNextTransmissionUs):
+    # Reconfiguration received while waiting, in effect for this transmission:
+    # channel and DR of the new schedule (without deferring it)
+    applyReconfiguration(timeNextTransmissionUs)
+    selectedFreq, selectedDR = schedule.parametersAtUs(timeNextTransmissionUs)
+    if bFixedChannelAndDR:
+      selectedFreq, selectedDR = schedule.parametersOfBlock(initialResourceBlock)
+    if avoidBorderEffect == 1:
+      borderTransmission = checkBorderEffectUs(timeNextTransmissionUs, selectedFreq, selectedDR, guardTime, payloadsize, schedule.periodUs, schedule.epochOffsetUs)
+    setTransmissionParameters(selectedFreq, selectedDR)
+    airTime = airtime(payloadsize, convertDRtoSF(selectedDR), LoRa.BW_125KHZ, LoRa.CODING_4_5)
+
+  # Sub-band of the transmission (if CARA is disabled, the LoRaWAN stack uses the
+  # default channels, 868.1...868.5 MHz)
+  txFreq = selectedFreq if caraEnabled == 1 else 868100000
+  traceStart = tracer.start()
+  bDutyCycleAllowed = (not bDutyCycleLimit) or dutyCycle.allowed(txFreq, airTime, clock.now())
+  tracer.end(STAGE_DUTY_CYCLE, traceStart)
+
+  if (borderTransmission == False) and bDutyCycleAllowed:
+    message = txQueue.pop(framePayloads)
+    if framePayloads > 1:
+      s.bind(mergedFPort)
+    sendUs = clock.nowUs()
+    traceStart = tracer.start()
     s.setblocking(True)
     s.send(message)
     s.setblocking(False)
-    year, month, day, hour, minute, second, usecond, nothing = rtc.now()
-    print("[INFO] Message sent at {:02d}:{:02d}:{:02d}.{:.06d} on {:d} Hz with DR {:d} (air time {:.3f} s)".format(hour, minute, second, usecond, selectedFreq, selectedDR, airTime))
+    tracer.end(STAGE_SEND, traceStart)
+    tracer.end(STAGE_WAKE_TO_AIR, traceWakeUp)
+    traceStart = tracer.start()
+    sentUs = clock.nowUs()
+    tracer.end(STAGE_CLOCK, traceStart)
+    if framePayloads > 1:
+      s.bind(2)
+    # Timing record of the frame, and lateness of the start of s.send
+    timingLog.add(timeNextTransmissionUs, wakeUs, sendUs, sentUs)
+    latenessHistogram.add(sendUs - timeNextTransmissionUs)
+    dutyCycle.record(txFreq, sentUs/1000000 - airTime, airTime)
+    hour, minute, second, usecond = clock.timeOfDay()
+    print("[INFO] Message sent at {:02d}:{:02d}:{:02d}.{:.06d} on {:d} Hz with DR {:d} (air time {:.3f} s, {:d} payloads)".format(hour, minute, second, usecond, selectedFreq, selectedDR, airTime, framePayloads))
+    if (debug > 0):
+      print("[DEBUG] Duty cycle: {:.1f} s used of {:.1f} s, {:d} payloads queued".format(dutyCycle.usedAirTime(txFreq, clock.now()), dutyCycle.budget(txFreq), txQueue.count))
+    if (debug > 0):
+      print("[DEBUG] Radio configuration calls: {:d} issued, {:d} saved".format(radioState.callsIssued, radioState.callsSaved))
+    energy.add(airTime=airTime)
+    if firstUplink:
+      print("[INFO] Time to first uplink = {:.1f} s ({} boot)".format(utime.ticks_diff(utime.ticks_ms(), bootTicks)/1000, bootType))
+      firstUplink = False
+    # Drift correction of the time base with the RTC (synchronized with NTP)
+    traceStart = tracer.start()
+    clockError = clock.correct()
+    tracer.end(STAGE_CLOCK_CORRECT, traceStart)
+    if bTrace and tracer.counts[STAGE_SEND] % traceReportEvery == 0:
+      reportTrace()
+    if timingLog.count % timingReportEvery == 0:
+      reportTiming()
+    if (debug > 0):
+      print("[DEBUG] Time base error = {:d} us, drift = {:d} ppm".format(clockError, clock.driftPpm))
+  elif borderTransmission:
+    # The frame stays in the queue for the next transmission time
+    framesBorderHeld = framesBorderHeld + 1
+    frameHeldAtBorder = True
+    hour, minute, second, usecond = clock.timeOfDay()
+    print("[INFO] Message held in the queue at {:02d}:{:02d}:{:02d}.{:.06d} due to border effect ({:d} deferred, {:d} held)".format(hour, minute, second, usecond, framesDeferred, framesBorderHeld))
   else:
-    year, month, day, hour, minute, second, usecond, nothing = rtc.now()
-    print("[INFO] Message not sent at {:02d}:{:02d}:{:02d}.{:.06d} due to border effect".format(hour, minute, second, usecond))
+    framesHeld = framesHeld + 1
+    print("[INFO] Message held in the queue: duty cycle of the sub-band used ({:.1f} s of {:.1f} s, next at t={:.1f}, {:d} held)".format(
+      dutyCycle.usedAirTime(txFreq, clock.now()), dutyCycle.budget(txFreq), dutyCycle.nextAllowedTime(txFreq, airTime, clock.now()), framesHeld))
+
+  # Low power mode: deep sleep until the next transmission (the next time between
+  # transmissions is obtained now, so the device wakes up just before it)
+  if bLowPower:
+    nextRandNo = fixedTime + RandomRange(0,randomTime)
+    timeToSleep = (timeLastTransmissionUs - clock.nowUs())/1000000 + nextRandNo - lowPowerWakeUpTime
+    if (timeToSleep >= lowPowerMinSleepTime):
+      energy.add(awakeTime=utime.ticks_diff(utime.ticks_ms(), bootTicks)/1000, sleepTime=timeToSleep)
+      print("[INFO] Energy estimate: {:.3f} mAh, average current {:.3f} mA (air time {:.1f} s, awake {:.1f} s, sleeping {:.1f} s)".format(energy.charge(), energy.averageCurrent(), energy.airTime, energy.awakeTime, energy.sleepTime))
+      saveSleepState({
+        'messageCounter': messageCounter, 'timeLastTransmissionUs': timeLastTransmissionUs, 'nextRandNo': nextRandNo,
+        'randomTimeForJoining': randomTimeForJoining, 'fixedTime': fixedTime, 'randomTime': randomTime, 'durationOfPeriod': durationOfPeriod,
+        'durationOfPeriodFromJoinAccept': durationOfPeriodFromJoinAccept,
+        'avoidBorderEffect': avoidBorderEffect, 'borderEffectGuardTime': borderEffectGuardTime,
+        'caraEnabled': caraEnabled, 'initialResourceBlock': initialResourceBlock, 'sfMask': sfMask, 'selectedDR': selectedDR,
+        'algorithm': algorithm, 'loadHints': loadHints, 'framesDeferred': framesDeferred, 'framesBorderHeld': framesBorderHeld,
+        'frameHeldAtBorder': frameHeldAtBorder,
+        'epochDayUs': clock.epochDayUs, 'wakeUpUs': clock.epochDayUs + clock.nowUs() + int(1000000*timeToSleep), 'energy': energy.asList(),
+        'dutyCycle': dutyCycle.asList(), 'txQueue': txQueue.asList(),
+      })
+      lora.nvram_save()
+      goToSleep(timeToSleep)
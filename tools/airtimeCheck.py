@@ -0,0 +1,143 @@
+# Exactness and speed of the air time model (lib/LoRaAirTimeCalc.py), host side,
+# Python 3
+#
+#   reference:  table of air times of the Semtech formula (SX1276 datasheet,
+#               section 4.1.1.7) for some PHY settings (preamble length, implicit
+#               header, CRC off, low data rate optimization of SF11/SF12 at
+#               125 kHz and SF12 at 250 kHz), and unknown bandwidths
+#   full grid:  airtimetheoretical(), airtime() (lookup tables) and airtimegrid()
+#               against the formula in exact (rational) arithmetic, for every SF,
+#               EU868 bandwidth, coding rate and payload size (0...255), and the
+#               preamble, header and CRC variants
+#   benchmark:  time per call of airtimetheoretical()[0], airtime() and
+#               airtimegrid() (per air time)
+#
+# Example:
+#   python3 tools/airtimeCheck.py --calls 200000
+
+import os
+import sys
+import time
+import random
+import argparse
+from fractions import Fraction
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from LoRaAirTimeCalc import LoRa, airtimetheoretical, airtime, airtimegrid, dataratetheoretical, lowdatarateoptimization, MAX_PAYLOAD_SIZE
+
+BANDWIDTHS = {LoRa.BW_125KHZ: 125, LoRa.BW_250KHZ: 250, LoRa.BW_500KHZ: 500}
+CODING_RATES = (LoRa.CODING_4_5, LoRa.CODING_4_6, LoRa.CODING_4_7, LoRa.CODING_4_8)
+# (preamble length, implicit header, CRC)
+VARIANTS = ((8, False, True), (8, True, True), (8, False, False), (16, False, True), (6, True, False))
+
+# (payload size, SF, bandwidth (kHz), coding rate 4/(4+cr), preamble length,
+#  implicit header, CRC, air time (ms))
+REFERENCE = (
+  (0, 7, 125, 1, 8, False, True, 25.856),
+  (10, 7, 125, 1, 8, False, True, 41.216),
+  (13, 7, 125, 1, 8, False, True, 46.336),
+  (64, 7, 125, 1, 8, False, True, 118.016),
+  (51, 9, 125, 1, 8, False, True, 328.704),
+  (18, 10, 125, 1, 8, False, True, 329.728),
+  (13, 12, 125, 1, 8, False, True, 1155.072),
+  (59, 12, 125, 1, 8, False, True, 2629.632),
+  (64, 12, 125, 1, 8, False, True, 2793.472),
+  (255, 12, 125, 4, 8, False, True, 14032.896),
+  (20, 11, 250, 1, 8, False, True, 329.728),
+  (20, 12, 250, 2, 8, False, True, 724.992),
+  (20, 11, 500, 1, 8, False, True, 164.864),
+  (10, 7, 125, 1, 8, True, True, 36.096),
+  (10, 7, 125, 1, 8, False, False, 36.096),
+  (10, 8, 125, 1, 16, False, True, 88.576),
+)
+
+def exactAirtime(payloadsize, sf, bwkhz, cr, preamblelength, implicitheader, crc):
+  # Semtech formula in rational arithmetic (s); LDRO if the symbol time exceeds 16 ms
+  lowDRopt = 1 if Fraction(2**sf, bwkhz) > 16 else 0
+  tsym = Fraction(2**sf, 1000*bwkhz)
+  numerator = 8*payloadsize - 4*sf + 28 + (16 if crc else 0) - (20 if implicitheader else 0)
+  denominator = 4*(sf - 2*lowDRopt)
+  symbols = 8 + max(-(-numerator//denominator)*(4 + cr), 0)
+  return (Fraction(4*preamblelength + 17, 4) + symbols)*tsym
+
+def bandwidthOf(bwkhz):
+  for bw, khz in BANDWIDTHS.items():
+    if khz == bwkhz:
+      return bw
+
+def checkReference():
+  for payloadsize, sf, bwkhz, cr, preamblelength, implicitheader, crc, ms in REFERENCE:
+    exact = exactAirtime(payloadsize, sf, bwkhz, cr, preamblelength, implicitheader, crc)
+    assert exact == Fraction(ms).limit_denominator(1000)/1000, (payloadsize, sf, bwkhz, float(exact))
+    value = airtime(payloadsize, sf, bandwidthOf(bwkhz), cr, preamblelength, implicitheader, crc)
+    assert abs(value - ms/1000) <= 1e-12, (payloadsize, sf, bwkhz, value)
+  # Unknown bandwidths
+  for function in (lambda: dataratetheoretical(7, 3, LoRa.CODING_4_5), lambda: airtimetheoretical(10, 7, 3, LoRa.CODING_4_5)):
+    try:
+      function()
+      assert False, 'unknown bandwidth accepted'
+    except ValueError:
+      pass
+  print("[INFO] Reference air times: OK ({:d} values)".format(len(REFERENCE)))
+
+def checkGrid():
+  values = 0
+  maxError = 0.0
+  payloadsizes = list(range(MAX_PAYLOAD_SIZE + 1))
+  for bw, bwkhz in BANDWIDTHS.items():
+    for cr in CODING_RATES:
+      for preamblelength, implicitheader, crc in VARIANTS:
+        grid = airtimegrid(payloadsizes, range(7, 13), bw, cr, preamblelength, implicitheader, crc)
+        for sf in range(7, 13):
+          # LDRO from the symbol time (> 16 ms)
+          assert lowdatarateoptimization(sf, bw) == (1 if 2**sf/bwkhz > 16 else 0), (sf, bwkhz)
+          for payloadsize in payloadsizes:
+            exact = exactAirtime(payloadsize, sf, bwkhz, cr, preamblelength, implicitheader, crc)
+            theoretical = airtimetheoretical(payloadsize, sf, bw, cr, preamblelength, implicitheader, crc)[0]
+            value = airtime(payloadsize, sf, bw, cr, preamblelength, implicitheader, crc)
+            # The lookup tables give the same value as airtimetheoretical()
+            assert value == theoretical == grid[sf - 7][payloadsize], (payloadsize, sf, bwkhz, cr)
+            error = abs(value - float(exact))/float(exact)
+            assert error < 1e-12, (payloadsize, sf, bwkhz, cr, value, float(exact))
+            maxError = max(maxError, error)
+            values = values + 1
+  print("[INFO] Full grid: OK ({:d} air times, maximum relative error {:.1e} with the exact formula)".format(values, maxError))
+
+def timePerCall(function, calls):
+  start = time.perf_counter()
+  function(calls)
+  return (time.perf_counter() - start)/calls
+
+def benchmark(rnd, calls):
+  payloadsizes = [rnd.randrange(MAX_PAYLOAD_SIZE + 1) for i in range(1024)]
+  sfs = [rnd.randrange(7, 13) for i in range(1024)]
+  def theoretical(calls):
+    for i in range(calls):
+      airtimetheoretical(payloadsizes[i & 1023], sfs[i & 1023], LoRa.BW_125KHZ, LoRa.CODING_4_5)[0]
+  def lookup(calls):
+    for i in range(calls):
+      airtime(payloadsizes[i & 1023], sfs[i & 1023])
+  def grid(calls):
+    for i in range(max(1, calls//(6*(MAX_PAYLOAD_SIZE + 1)))):
+      airtimegrid(range(MAX_PAYLOAD_SIZE + 1), range(7, 13))
+  # Tables built before the measures
+  airtimegrid(range(MAX_PAYLOAD_SIZE + 1), range(7, 13))
+  results = [(name, min(timePerCall(function, calls) for i in range(3))) for name, function in
+             (('airtimetheoretical()[0]', theoretical), ('airtime()', lookup))]
+  gridCalls = max(1, calls//(6*(MAX_PAYLOAD_SIZE + 1)))*6*(MAX_PAYLOAD_SIZE + 1)
+  results.append(('airtimegrid() per air time', min(timePerCall(grid, calls)*calls/gridCalls for i in range(3))))
+  for name, t in results:
+    print("[INFO] {:27s}: {:7.3f} us per air time ({:.1f}x airtimetheoretical)".format(name, 1e6*t, results[0][1]/t))
+
+def main():
+  parser = argparse.ArgumentParser(description='Exactness and speed of the air time model')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--calls', type=int, default=200000)
+  config = parser.parse_args()
+  checkReference()
+  checkGrid()
+  benchmark(random.Random(config.seed), config.calls)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,99 @@
+# Checks of the exponential backoffs of the JOINREQ retransmissions
+# (lib/joinReqPolicy.py) and of the Wi-Fi connection attempts (lib/wifiManager.py)
+# for long outages (thousands of attempts, no deadline), host side, Python 3
+#
+#   JoinReqPolicy:  `attempts` timeouts (past 2^10 attempts, where rtxTime*2^n
+#                   no longer fits in a float), each within minTime + maxTime,
+#                   the window staying at maxTime once reached
+#   WiFiManager:    a WLAN that only connects at the `attempts`-th attempt,
+#                   without deadline, each backoff within backoffMax
+#
+# Example:
+#   python3 tools/backoffCheck.py --attempts 5000
+
+import os
+import sys
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from joinReqPolicy import JoinReqPolicy, MAX_BACKOFF_EXPONENT
+from wifiManager import WiFiManager
+
+class VirtualTime:
+  """ utime.ticks_ms, ticks_diff and sleep_ms in virtual time, with the sleeps recorded """
+
+  def __init__(self):
+    self.ms = 0
+    self.sleeps = []
+
+  def ticks_ms(self):
+    return self.ms
+
+  def ticks_diff(self, end, start):
+    return end - start
+
+  def sleep_ms(self, ms):
+    self.sleeps.append(ms)
+    self.ms = self.ms + ms
+
+class UnreachableWLAN:
+  """ network.WLAN that only connects at the connectAt-th attempt """
+
+  WPA2 = 3
+
+  def __init__(self, connectAt):
+    self.connectAt = connectAt
+    self.connects = 0
+
+  def connect(self, ssid, auth=None, bssid=None, timeout=None):
+    self.connects = self.connects + 1
+
+  def disconnect(self):
+    pass
+
+  def isconnected(self):
+    return self.connects >= self.connectAt
+
+  def joined_ap_info(self):
+    raise OSError('not available')
+
+def checkJoinReqPolicy(rnd, attempts):
+  for backoff in (True, False):
+    policy = JoinReqPolicy(lambda: 1.0, 5.0, backoff, 60.0, 1.0)
+    timeouts = [policy.nextTimeout() for i in range(attempts)]
+    assert policy.attempt == attempts
+    # Upper bound of the full jitter: minTime + maxTime once the window is saturated
+    expected = 1.0 + 60.0 if backoff else 5.0
+    assert max(timeouts) == expected and timeouts[-1] == expected, (backoff, max(timeouts), timeouts[-1])
+    # Random jitter: within [minTime, minTime + maxTime]
+    policy = JoinReqPolicy(rnd.random, 5.0, backoff, 60.0, 1.0)
+    for i in range(attempts):
+      timeout = policy.nextTimeout()
+      assert (1.0 <= timeout <= 61.0) if backoff else timeout == 5.0, (i, timeout)
+  print("[INFO] JoinReqPolicy: OK ({:d} attempts, exponent capped at {:d})".format(attempts, MAX_BACKOFF_EXPONENT))
+
+def checkWiFiManager(attempts, directory):
+  clock = VirtualTime()
+  wlan = UnreachableWLAN(attempts)
+  manager = WiFiManager(wlan, 'CARA', 'password', None, 0.1, 0.5, None, 1.0, 20.0, lambda: 1.0,
+                        os.path.join(directory, 'wifiCache.json'), clock.ticks_ms, clock.ticks_diff, clock.sleep_ms)
+  assert manager.connect()
+  assert manager.attempts == attempts, manager.attempts
+  assert max(clock.sleeps) == 20000, max(clock.sleeps)
+  print("[INFO] WiFiManager: OK (connected at attempt {:d} after {:.1f} h, backoff at most {:.1f} s)".format(
+    manager.attempts, manager.connectTime/3600, max(clock.sleeps)/1000))
+
+def main():
+  parser = argparse.ArgumentParser(description='Exponential backoffs for long outages')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--attempts', type=int, default=5000)
+  config = parser.parse_args()
+  checkJoinReqPolicy(random.Random(config.seed), config.attempts)
+  with tempfile.TemporaryDirectory() as directory:
+    checkWiFiManager(config.attempts, directory)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,135 @@
+# Time to first uplink of a cold boot and of a warm boot (boot cache) of main.py
+# (host side, Python 3)
+#
+# The network is stubbed in virtual time: Wi-Fi connection, NTP, HTTP requests
+# (MicroWebCli.GETRequest, used by fetchCARAParameters of the device), LoRaWAN
+# join and the #JOINREQ# / #JOINACC# exchange (with lib/joinReqPolicy.py) take
+# the configured times, and the waits of main.py (random time before Wi-Fi and
+# before joining, join polling) are followed. The warm boot reads a real boot
+# cache file (lib/bootCache.py). The first uplink is sent fixedTime + rand(randomTime)
+# after entering the main loop in both cases.
+#
+# Example:
+#   python3 tools/bootBenchmark.py --boots 1000
+
+import os
+import sys
+import time
+import math
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from microWebCli import MicroWebCli
+from caraParameters import fetchCARAParameters
+from joinReqPolicy import JoinReqPolicy
+from bootCache import saveBootCache, loadBootCache
+
+DEFAULT_CONFIG = {
+  'boots': 1000,
+  'seed': 1,
+  'wifiConnectTime': 3.0,
+  'ntpTime': 1.5,
+  'httpRequestTime': 0.15,
+  'bundle': 1,
+  'joinTime': 6.0,
+  'joinAccRtt': 1.5,
+  'joinAccLoss': 0.1,
+  'nvramRestoreTime': 0.05,
+  'randomTimeForJoining': 60.0,
+  'fixedTime': 60.0,
+  'randomTime': 60.0,
+}
+
+# Values of the stubbed CARA server
+SERVER_PARAMETERS = {'joinTime': '60', 'fixedTime': '60', 'randomTime': '60', 'durationOfPeriod': '5', 'avoidBorderEffect': '1', 'borderEffectGuardTime': '0.1', 'count_v2.php': '10'}
+
+class VirtualTime:
+  """ virtual time (s), advanced by the stubbed network and the waits """
+
+  def __init__(self):
+    self.t = 0.0
+
+  def sleep(self, seconds):
+    self.t = self.t + max(0.0, seconds)
+
+def stubHTTP(clock, config):
+  # MicroWebCli.GETRequest of the stubbed CARA server
+  def GETRequest(url, queryParams=None, auth=None, connTimeoutSec=10, socks5Addr=None, keepAlive=False):
+    clock.sleep(config['httpRequestTime'])
+    key = url.rsplit('/', 1)[1]
+    if key == 'parameters':
+      if not config['bundle']:
+        return None
+      return '&'.join('{}={}'.format(k, v) for k, v in SERVER_PARAMETERS.items()).encode()
+    return SERVER_PARAMETERS[key].encode()
+  MicroWebCli.GETRequest = staticmethod(GETRequest)
+  MicroWebCli.ClosePool = staticmethod(lambda key=None: None)
+
+def coldBoot(clock, rnd, config):
+  # Same steps as main.py: random wait, Wi-Fi, NTP, HTTP parameters, join, #JOINACC#
+  clock.sleep(rnd.uniform(0, 10))
+  clock.sleep(config['wifiConnectTime'])
+  clock.sleep(config['ntpTime'])
+  params = fetchCARAParameters('http://server/CARA/', 'parameters', True)
+  clock.sleep(rnd.uniform(0, params.randomTimeForJoining))
+  # lora.has_joined() polled every 2.5 s
+  clock.sleep(math.ceil(config['joinTime']/2.5)*2.5)
+  policy = JoinReqPolicy(rnd.random, 5.0, True, 60.0, 1.0)
+  while True:
+    timeout = policy.nextTimeout()
+    if rnd.random() >= config['joinAccLoss'] and config['joinAccRtt'] < timeout:
+      clock.sleep(config['joinAccRtt'])
+      break
+    clock.sleep(timeout)
+  return params
+
+def warmBoot(clock, rnd, config, path):
+  wallClock = time.perf_counter()
+  values = loadBootCache(None, path)
+  clock.sleep(time.perf_counter() - wallClock)
+  assert values is not None and values['durationOfPeriodFromJoinAccept']
+  clock.sleep(config['nvramRestoreTime'])
+  return values
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(p*len(values)))]
+
+def main():
+  parser = argparse.ArgumentParser(description='Time to first uplink of cold and warm boots')
+  for name in sorted(DEFAULT_CONFIG):
+    parser.add_argument('--' + name, type=type(DEFAULT_CONFIG[name]), default=DEFAULT_CONFIG[name])
+  config = vars(parser.parse_args())
+  SERVER_PARAMETERS['joinTime'] = str(config['randomTimeForJoining'])
+
+  rnd = random.Random(config['seed'])
+  clock = VirtualTime()
+  stubHTTP(clock, config)
+  results = {'cold': ([], []), 'warm': ([], [])}
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'caraBoot.bin')
+    saveBootCache({'randomTimeForJoining': 60.0, 'fixedTime': config['fixedTime'], 'randomTime': config['randomTime'], 'durationOfPeriod': 5.0,
+                   'borderEffectGuardTime': 0.1, 'avoidBorderEffect': 1, 'caraEnabled': 1, 'initialResourceBlock': 7, 'sfMask': 63,
+                   'selectedDR': 5, 'algorithm': 'sequential', 'loadHints': None, 'durationOfPeriodFromJoinAccept': True}, 0, 86400, path)
+    for i in range(config['boots']):
+      for bootType in ('cold', 'warm'):
+        clock.t = 0.0
+        if bootType == 'cold':
+          coldBoot(clock, rnd, config)
+        else:
+          warmBoot(clock, rnd, config, path)
+        results[bootType][0].append(clock.t)
+        # First uplink at fixedTime + rand(randomTime) after entering the main loop
+        results[bootType][1].append(clock.t + config['fixedTime'] + rnd.uniform(0, config['randomTime']))
+
+  for bootType in ('cold', 'warm'):
+    ready, firstUplink = results[bootType]
+    print("[INFO] {:s} boot: main loop after {:.3f} s (p50 {:.3f}, p90 {:.3f}), first uplink after {:.1f} s (p50 {:.1f}, p90 {:.1f})".format(
+      bootType.capitalize(), sum(ready)/len(ready), percentile(ready, 0.5), percentile(ready, 0.9),
+      sum(firstUplink)/len(firstUplink), percentile(firstUplink, 0.5), percentile(firstUplink, 0.9)))
+
+if __name__ == '__main__':
+  main()
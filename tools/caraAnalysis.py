@@ -0,0 +1,166 @@
+# Offline collision analysis of a whole CARA schedule (host side, Python 3 + NumPy)
+#
+# For N devices x M uplinks, the transmission times, resource blocks (same
+# sequential assignment as assignmentAlgorithm1), air times and border effect
+# drops are computed with NumPy arrays, and the overlapping transmissions are
+# counted per resource block (channel and SF) with a sorted sweep instead of
+# comparing every pair of transmissions.
+#
+# Example (fixed seed, reports the time of each step):
+#   python3 tools/caraAnalysis.py --devices 10000 --uplinks 100 --seed 1
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from caraScheduler import createResourceBlocksLists, frequencyForChannel, convertSFtoDR
+from LoRaAirTimeCalc import airtime
+
+# Default analysis parameters (same names as the CARA parameters in main.py)
+DEFAULT_CONFIG = {
+  'devices': 10000,
+  'uplinks': 100,
+  'seed': 1,
+  'sfMask': 63,
+  'randomTimeForJoining': 60.0,
+  'fixedTime': 60.0,
+  'randomTime': 60.0,
+  'durationOfPeriod': 5.0,
+  'avoidBorderEffect': 1,
+  'borderEffectGuardTime': 0.1,
+  'bFixedChannelAndDR': False,
+  'payloadsize': 18,
+}
+
+def generateTransmissionTimes(devices, uplinks, randomTimeForJoining, fixedTime, randomTime, rng):
+  # Same process as the main loop: first packet after joining, then fixedTime + rand(randomTime)
+  gaps = fixedTime + rng.random((devices, uplinks))*randomTime
+  gaps[:, 0] += rng.random(devices)*randomTimeForJoining
+  return np.cumsum(gaps, axis=1)
+
+def assignResourceBlocks(times, initialResourceBlocks, durationOfPeriod, noResourceBlocks):
+  # Vectorised assignmentAlgorithm1
+  indexCurrentPeriod = np.floor(times/durationOfPeriod).astype(np.int64)
+  return (indexCurrentPeriod + initialResourceBlocks[:, None]) % noResourceBlocks
+
+def borderEffect(times, airTimes, borderEffectGuardTime, durationOfPeriod):
+  # Vectorised checkBorderEffect
+  limitForThisPeriod = (np.floor(times/durationOfPeriod) + 1)*durationOfPeriod
+  return (times + airTimes + borderEffectGuardTime) > limitForThisPeriod
+
+def countOverlaps(blocks, starts, ends, noResourceBlocks):
+  # Returns, per resource block, the number of collided transmissions and the
+  # number of overlapping pairs of transmissions
+  span = float(max(ends.max(), 0.0)) + 1.0
+  # Sort by (block, start) and shift every block to its own time interval, so a
+  # single sweep over the sorted arrays never mixes different blocks
+  order = np.lexsort((starts, blocks))
+  blocks = blocks[order]
+  starts = starts[order] + blocks*span
+  ends = ends[order] + blocks*span
+
+  # Overlap with a previous transmission: start before the maximum previous end
+  previousMaxEnd = np.empty_like(ends)
+  previousMaxEnd[0] = -np.inf
+  np.maximum.accumulate(ends[:-1], out=previousMaxEnd[1:])
+  collided = starts < previousMaxEnd
+  # Overlap with a later transmission: the next one starts before this one ends
+  collided[:-1] |= ends[:-1] > starts[1:]
+
+  # Pairs: for each transmission, the previous ones that have not ended yet
+  endedBefore = np.searchsorted(np.sort(ends), starts, side='right')
+  overlapping = np.arange(len(starts)) - endedBefore
+
+  collidedPerBlock = np.bincount(blocks, weights=collided, minlength=noResourceBlocks).astype(np.int64)
+  pairsPerBlock = np.bincount(blocks, weights=overlapping, minlength=noResourceBlocks).astype(np.int64)
+  return collidedPerBlock, pairsPerBlock
+
+def analyseSchedule(config):
+  config = dict(DEFAULT_CONFIG, **config)
+  rng = np.random.default_rng(config['seed'])
+  timing = []
+  def step(name, t=[time.perf_counter()]):
+    now = time.perf_counter()
+    timing.append((name, now - t[0]))
+    t[0] = now
+
+  channelsList, sfList = createResourceBlocksLists(config['sfMask'])
+  noResourceBlocks = len(channelsList)
+  channelsArray = np.array([(freq - frequencyForChannel(0))//(frequencyForChannel(1) - frequencyForChannel(0)) for freq in channelsList])
+  sfArray = np.array(sfList)
+  drArray = np.array([convertSFtoDR(sf) for sf in sfList])
+  airTimeArray = np.array([airtime(config['payloadsize'], sf) for sf in sfList])
+
+  # The CARA server assigns the initial resource blocks in order of arrival
+  initialResourceBlocks = np.arange(config['devices']) % noResourceBlocks
+  times = generateTransmissionTimes(config['devices'], config['uplinks'], config['randomTimeForJoining'], config['fixedTime'], config['randomTime'], rng)
+  step('transmission times')
+
+  blocks = assignResourceBlocks(times, initialResourceBlocks, config['durationOfPeriod'], noResourceBlocks)
+  airTimes = airTimeArray[blocks]
+  # As in the main loop, the first packet is never dropped by the border effect
+  # and the fixed channel and DR are only used from the second packet
+  dropped = np.zeros(times.shape, dtype=bool)
+  if config['avoidBorderEffect'] == 1:
+    dropped[:, 1:] = borderEffect(times[:, 1:], airTimes[:, 1:], config['borderEffectGuardTime'], config['durationOfPeriod'])
+  if config['bFixedChannelAndDR']:
+    blocks[:, 1:] = initialResourceBlocks[:, None]
+    airTimes = airTimeArray[blocks]
+  step('resource blocks')
+
+  sent = ~dropped
+  sentBlocks = blocks[sent]
+  starts = times[sent]
+  ends = starts + airTimes[sent]
+  collidedPerBlock, pairsPerBlock = countOverlaps(sentBlocks, starts, ends, noResourceBlocks)
+  step('overlaps')
+
+  framesPerBlock = np.bincount(sentBlocks, minlength=noResourceBlocks)
+  duration = float(ends.max()) if len(ends) else 0.0
+  frames = int(framesPerBlock.sum())
+  collided = int(collidedPerBlock.sum())
+  return {
+    'config': config,
+    'uplinks': int(times.size),
+    'frames': frames,
+    'collided': collided,
+    'collisionRate': collided/frames if frames else 0.0,
+    'pairs': int(pairsPerBlock.sum()),
+    'borderDrops': int(dropped.sum()),
+    'channelsPerBlock': channelsArray,
+    'sfPerBlock': sfArray,
+    'drPerBlock': drArray,
+    'framesPerBlock': framesPerBlock,
+    'collidedPerBlock': collidedPerBlock,
+    'pairsPerBlock': pairsPerBlock,
+    'utilisationPerBlock': np.bincount(sentBlocks, weights=airTimes[sent], minlength=noResourceBlocks)/duration if duration else np.zeros(noResourceBlocks),
+    'timing': timing,
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description='Vectorised collision analysis of a CARA schedule')
+  for name in sorted(DEFAULT_CONFIG):
+    value = DEFAULT_CONFIG[name]
+    if isinstance(value, bool):
+      parser.add_argument('--' + name, type=lambda v: v in ('1', 'True', 'true'), default=value)
+    else:
+      parser.add_argument('--' + name, type=type(value), default=value)
+  parser.add_argument('--perBlock', action='store_true', help='show results per resource block')
+  args = vars(parser.parse_args())
+  perBlock = args.pop('perBlock')
+
+  result = analyseSchedule(args)
+  print("[INFO] uplinks = {:d}, frames sent = {:d}, collided = {:d} ({:.3%}), overlapping pairs = {:d}, border effect drops = {:d}".format(result['uplinks'], result['frames'], result['collided'], result['collisionRate'], result['pairs'], result['borderDrops']))
+  for step, elapsed in result['timing']:
+    print("[INFO]   {:s}: {:.3f} s".format(step, elapsed))
+  if perBlock:
+    for block in range(len(result['framesPerBlock'])):
+      print("[INFO]   block {:2d} (channel {:d}, SF{:d}): frames = {:d}, collided = {:d}, pairs = {:d}, utilisation = {:.4%}".format(block, result['channelsPerBlock'][block], result['sfPerBlock'][block], result['framesPerBlock'][block], result['collidedPerBlock'][block], result['pairsPerBlock'][block], result['utilisationPerBlock'][block]))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,215 @@
+# Checks of lib/caraClock.py with a virtual RTC and a virtual tick counter
+# (host side, Python 3)
+#
+# The virtual tick counter wraps around like utime.ticks_us (TICKS_PERIOD) and can
+# run faster or slower than the RTC (ppm), and the virtual sleep only advances the
+# virtual time, so days can be checked in a few seconds. The CARA schedules built
+# on different days (cold and warm boots) must give the same period boundaries
+# and resource blocks at the same absolute time, also after a month of uptime
+# (integer microseconds, the float seconds of the device are single precision).
+#
+# Example:
+#   python3 tools/caraClockCheck.py
+
+import os
+import sys
+import random
+import struct
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from caraClock import CARAClock, daysFromCivil, civilFromDays, rtcToUs, usToRtc, US_PER_DAY
+from caraScheduler import CARASchedule, ASSIGNMENT_ALGORITHM_NAMES
+
+# Period of utime.ticks_us in MicroPython
+TICKS_PERIOD = 1 << 30
+
+class VirtualTime:
+  """ virtual RTC (true time) and tick counter (with drift and wrap around) """
+
+  def __init__(self, startUs, ticksStart=0, driftPpm=0):
+    self.trueUs = startUs
+    self.startUs = startUs
+    self.ticksStart = ticksStart
+    self.driftPpm = driftPpm
+
+  def now(self):
+    # machine.RTC().now()
+    return usToRtc(self.trueUs)
+
+  def ticks_us(self):
+    elapsed = self.trueUs - self.startUs
+    return (self.ticksStart + elapsed + elapsed*self.driftPpm//1000000) % TICKS_PERIOD
+
+  def ticks_diff(self, end, start):
+    return ((end - start + TICKS_PERIOD//2) % TICKS_PERIOD) - TICKS_PERIOD//2
+
+  def sleep_us(self, us):
+    # Sleeping for us ticks takes us/(1 + drift) of true time
+    self.trueUs = self.trueUs + -(-us*1000000//(1000000 + self.driftPpm))
+
+def newClock(virtual):
+  return CARAClock(virtual, virtual.ticks_us, virtual.ticks_diff, virtual.sleep_us)
+
+def checkCalendar():
+  for days in range(-1000, 30000, 7):
+    assert daysFromCivil(*civilFromDays(days)) == days
+  assert daysFromCivil(1970, 1, 1) == 0
+  assert daysFromCivil(2000, 3, 1) == 11017
+  for us in (0, 1, 86399999999, 1640995199999999, 1709164800123456):
+    assert rtcToUs(usToRtc(us)) == us
+  print("[INFO] Calendar: OK")
+
+def checkMidnight():
+  # Start at 23:58:00 and transmit every 30 s for 10 minutes (crossing midnight)
+  virtual = VirtualTime(rtcToUs((2021, 12, 31, 23, 58, 0, 0, None)))
+  clock = newClock(virtual)
+  schedule = CARASchedule(63, 0, 5.0)
+  t = clock.now()
+  assert abs(t - (23*3600 + 58*60)) < 1e-6
+  lastPeriod = schedule.periodAt(t)
+  for i in range(20):
+    timeNextTransmission = t + 30.0
+    clock.sleepUntil(timeNextTransmission)
+    now = clock.now()
+    assert now >= timeNextTransmission, (now, timeNextTransmission)
+    assert now - timeNextTransmission < 1e-3
+    assert schedule.periodAt(now) > lastPeriod
+    lastPeriod = schedule.periodAt(now)
+    t = timeNextTransmission
+  assert clock.now() > 86400
+  assert clock.timeOfDay()[0:2] == [0, 8]
+  print("[INFO] Midnight: OK (t = {:.3f} s, time of day {:02d}:{:02d}:{:02d})".format(clock.now(), *clock.timeOfDay()[0:3]))
+
+def checkTicksWrap():
+  # Tick counter close to its wrap around, 1 day with sleeps of random lengths
+  virtual = VirtualTime(rtcToUs((2021, 6, 1, 12, 0, 0, 0, None)), TICKS_PERIOD - 1000)
+  clock = newClock(virtual)
+  rnd = random.Random(1)
+  wraps = 0
+  lastTicks = virtual.ticks_us()
+  last = clock.now()
+  while virtual.trueUs - virtual.startUs < US_PER_DAY:
+    clock.sleepUntil(last + rnd.uniform(0.0, 200.0))
+    now = clock.now()
+    assert now >= last
+    ticks = virtual.ticks_us()
+    if ticks < lastTicks:
+      wraps = wraps + 1
+    lastTicks = ticks
+    last = now
+    assert abs(clock.nowUs() - (virtual.trueUs - clock.epochDayUs)) < 10
+  assert wraps > 0
+  print("[INFO] Tick counter wrap around: OK ({:d} wraps)".format(wraps))
+
+def checkDrift(driftPpm):
+  # Tick counter with drift, corrected with the RTC every uplink (about 90 s)
+  virtual = VirtualTime(rtcToUs((2021, 6, 1, 23, 0, 0, 0, None)), 12345, driftPpm)
+  clock = newClock(virtual)
+  last = clock.now()
+  maxError = 0
+  for i in range(2000):
+    clock.sleepUntil(last + 90.0)
+    now = clock.now()
+    assert now >= last
+    last = now
+    clock.correct()
+    if i > 100:
+      maxError = max(maxError, abs(clock.nowUs() - (virtual.trueUs - clock.epochDayUs)))
+  assert maxError < 1000, maxError
+  print("[INFO] Drift {:+d} ppm: OK (estimated {:+d} ppm, max error {:d} us)".format(driftPpm, clock.driftPpm, maxError))
+
+def checkStep():
+  # RTC updated by NTP 10 s ahead: applied at once; 1 s behind: applied gradually
+  virtual = VirtualTime(rtcToUs((2021, 6, 1, 10, 0, 0, 0, None)))
+  clock = newClock(virtual)
+  virtual.trueUs = virtual.trueUs + 10000000
+  virtual.startUs = virtual.startUs + 10000000
+  clock.correct()
+  assert abs(clock.nowUs() - (virtual.trueUs - clock.epochDayUs)) < 10
+  virtual.trueUs = virtual.trueUs - 1000000
+  virtual.startUs = virtual.startUs - 1000000
+  before = clock.now()
+  clock.correct()
+  last = clock.now()
+  assert last >= before
+  for i in range(30):
+    clock.sleepUntil(last + 1.0)
+    assert clock.now() >= last
+    last = clock.now()
+  assert abs(clock.nowUs() - (virtual.trueUs - clock.epochDayUs)) < 1000
+  print("[INFO] RTC steps: OK")
+
+def checkAbsoluteEpoch(rnd, boots=20, instants=2000):
+  # Boots on different days, durations of period that do not divide a day and
+  # sequences of any length: same boundaries and resource blocks as the absolute
+  # period index (us since 1970 // duration of period)
+  for durationOfPeriod in (5.0, 7.0, 0.3, 13.37, 86.4):
+    periodUs = int(round(durationOfPeriod*1000000))
+    algorithm = rnd.choice(ASSIGNMENT_ALGORITHM_NAMES)
+    sfMask = rnd.randrange(1, 64)
+    initialResourceBlock = rnd.randrange(8*bin(sfMask).count('1'))
+    devEUI = bytes(rnd.getrandbits(8) for i in range(8))
+    startUs = rtcToUs((2021, 6, 1, 0, 0, 0, 0, None))
+    for boot in range(boots):
+      syncUs = startUs + rnd.randrange(0, 400*US_PER_DAY)
+      clock = newClock(VirtualTime(syncUs))
+      schedule = CARASchedule(sfMask, initialResourceBlock, durationOfPeriod, algorithm, devEUI, None, clock.epochDayUs)
+      for i in range(instants//boots):
+        absoluteUs = syncUs + rnd.randrange(0, 2*US_PER_DAY)
+        # (not within 1 ms of a boundary, the time of the schedule is a float)
+        if min(absoluteUs % periodUs, periodUs - absoluteUs % periodUs) < 1000:
+          continue
+        t = (absoluteUs - clock.epochDayUs)/1000000
+        absolutePeriod = absoluteUs // periodUs
+        assert schedule.blockAt(t) == schedule.sequence[absolutePeriod % schedule.sequenceLength], (durationOfPeriod, boot, t)
+        assert schedule.parametersAt(t) == schedule.parametersOfPeriod(schedule.periodAt(t))
+        assert abs(clock.epochDayUs + 1000000*schedule.nextBoundary(t) - (absolutePeriod + 1)*periodUs) < 10, (durationOfPeriod, boot, t)
+  print("[INFO] Absolute epoch: OK ({:d} boots on different days per duration of period)".format(boots))
+
+def float32(x):
+  # Single precision float (MicroPython on the device)
+  return struct.unpack('f', struct.pack('f', x))[0]
+
+def checkLongUptime(rnd, days=31, instants=20000):
+  # Period lookups after a month of uptime (sleepUntilUs), at the boundaries too:
+  # exact in integer us, while the single precision seconds are a quarter second apart
+  durationOfPeriod = 7.0
+  periodUs = int(round(durationOfPeriod*1000000))
+  virtual = VirtualTime(rtcToUs((2021, 6, 1, 13, 20, 0, 0, None)), driftPpm=40)
+  clock = newClock(virtual)
+  schedule = CARASchedule(63, 5, durationOfPeriod, 'hashed', b'\x01'*8, None, clock.epochDayUs)
+  clock.sleepUntilUs(days*US_PER_DAY)
+  startUs = clock.nowUs()
+  assert startUs >= days*US_PER_DAY
+  wrong = 0
+  maxError = 0.0
+  for i in range(instants):
+    absoluteUs = clock.epochDayUs + startUs + rnd.randrange(0, US_PER_DAY)
+    if i % 2 == 0:
+      # Within 1 us of a boundary
+      absoluteUs = (absoluteUs // periodUs)*periodUs + rnd.choice((-1, 0, 1))
+    us = absoluteUs - clock.epochDayUs
+    absolutePeriod = absoluteUs // periodUs
+    assert schedule.blockAtUs(us) == schedule.sequence[absolutePeriod % schedule.sequenceLength], us
+    assert clock.epochDayUs + schedule.nextBoundaryUs(us) == (absolutePeriod + 1)*periodUs, us
+    assert schedule.parametersAtUs(us) == schedule.parametersOfPeriod(schedule.periodAtUs(us))
+    t = float32(us/1000000)
+    maxError = max(maxError, abs(t - us/1000000))
+    if schedule.blockAt(t) != schedule.blockAtUs(us):
+      wrong = wrong + 1
+  assert maxError > 0.05
+  print("[INFO] Long uptime: OK ({:d} days, single precision seconds {:.0f} ms off, {:d} of {:d} periods wrong)".format(days, 1000*maxError, wrong, instants))
+
+def main():
+  checkCalendar()
+  checkMidnight()
+  checkTicksWrap()
+  for driftPpm in (-100, 0, 40, 300):
+    checkDrift(driftPpm)
+  checkStep()
+  checkAbsoluteEpoch(random.Random(1))
+  checkLongUptime(random.Random(2))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,78 @@
+# Checks of the CARA parameters of lib/caraParameters.py (fetchCARAParameters of
+# main.py) against a local stand-in of the CARA web server (tools/httpStandIn.py),
+# with the TCP connections and the HTTP requests counted by the server (host
+# side, Python 3)
+#
+# Scenarios:
+#   bundle (JSON), bundle (key=value):  all the parameters in one request
+#   partial bundle:                     missing parameters from their endpoints
+#   no bundle endpoint:                 404, then one request per parameter
+#   per-key endpoints:                  previous behaviour (no bundle requested)
+# each one with new connections (HTTP/1.0) and with keep-alive connections.
+# A fleet of `devices` booting after a power cut opens `devices` times the
+# connections of a device.
+#
+# Example:
+#   python3 tools/caraParametersCheck.py --devices 500
+
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from httpStandIn import StandInServer, useHostSockets
+from caraParameters import fetchCARAParameters, CARA_PARAMETERS
+
+# Values of the stand-in server
+SERVER_PARAMETERS = {'joinTime': '60', 'fixedTime': '60', 'randomTime': '30', 'durationOfPeriod': '5', 'avoidBorderEffect': '1',
+                     'borderEffectGuardTime': '0.1', 'count_v2.php': '10'}
+
+def routes(bundle):
+  # Per-key endpoints and the bundle endpoint (None: not provided)
+  routes = {'/CARA/' + key: {'body': value.encode()} for key, value in SERVER_PARAMETERS.items()}
+  if bundle is not None:
+    routes['/CARA/parameters'] = {'body': bundle}
+  return routes
+
+SCENARIOS = (
+  # (name, bundle content, bundle requested, requests expected)
+  ('bundle (JSON)', json.dumps({key: float(value) for key, value in SERVER_PARAMETERS.items()}).encode(), True, 1),
+  ('bundle (key=value)', '\n'.join('{}={}'.format(key, value) for key, value in SERVER_PARAMETERS.items()).encode(), True, 1),
+  ('partial bundle', '&'.join('{}={}'.format(key, value) for key, value in SERVER_PARAMETERS.items() if key != 'count_v2.php').encode(), True, 2),
+  ('no bundle endpoint', None, True, 1 + len(SERVER_PARAMETERS)),
+  ('per-key endpoints', None, False, len(SERVER_PARAMETERS)),
+)
+
+def checkValues(params):
+  for key, name, valueType in CARA_PARAMETERS:
+    assert getattr(params, name) == valueType(float(SERVER_PARAMETERS[key])), (key, getattr(params, name))
+
+def main():
+  parser = argparse.ArgumentParser(description='Connections and requests of the CARA parameters')
+  parser.add_argument('--devices', type=int, default=500)
+  config = parser.parse_args()
+  useHostSockets()
+
+  for name, bundle, bBundle, expectedRequests in SCENARIOS:
+    server = StandInServer(routes(bundle))
+    try:
+      connections = {}
+      for keepAlive in (False, True):
+        server.resetCounters()
+        params = fetchCARAParameters(server.url + 'CARA/', 'parameters' if bBundle else None, keepAlive)
+        checkValues(params)
+        # Requests counted by the device and by the server
+        assert params.requests == server.requests() == expectedRequests, (name, params.requests, server.requests())
+        assert params.bundled == (bundle is not None)
+        connections[keepAlive] = server.connections()
+      # One connection per request, or a single one with keep-alive
+      assert connections[False] == expectedRequests and connections[True] == 1, (name, connections)
+    finally:
+      server.stop()
+    print("[INFO] {:18s}: OK ({:d} requests, {:d} connections, {:d} with keep-alive; {:d} connections for {:d} devices)".format(
+      name, expectedRequests, connections[False], connections[True], config.devices*connections[False], config.devices))
+
+if __name__ == '__main__':
+  main()
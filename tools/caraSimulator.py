@@ -0,0 +1,288 @@
+# Discrete-event simulator of a fleet of CARA devices (host side, Python 3)
+#
+# It uses the scheduling functions of the device (lib/caraScheduler.py) and the
+# air time model (lib/LoRaAirTimeCalc.py). LoRa, socket, machine.RTC and crypto
+# are replaced by virtual-time stand-ins (VirtualRadio, VirtualClock and a
+# seeded random.Random), and all the devices share a single event queue (heapq).
+#
+# Examples:
+#   python3 tools/caraSimulator.py --devices 10000 --days 1
+#   python3 tools/caraSimulator.py --devices 1000 --sweep durationOfPeriod=5,10,20 --processes 4
+#   python3 tools/caraSimulator.py --devices 1000 --sweep algorithm=sequential,hashed,weighted,loadAware
+
+import os
+import sys
+import heapq
+import random
+import argparse
+import itertools
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from caraScheduler import createResourceBlocksLists, CARASchedule, parseLoadHints, checkBorderEffect, deferTransmission, convertDRtoSF, convertSFtoDR
+from LoRaAirTimeCalc import airtime
+
+# Default simulation parameters (same names as the CARA parameters in main.py)
+DEFAULT_CONFIG = {
+  'devices': 1000,
+  'days': 1.0,
+  'seed': 1,
+  'sfMask': 63,
+  'randomTimeForJoining': 60.0,
+  'fixedTime': 60.0,
+  'randomTime': 60.0,
+  'durationOfPeriod': 5.0,
+  'avoidBorderEffect': 1,
+  'borderEffectGuardTime': 0.1,
+  'caraEnabled': 1,
+  'bFixedChannelAndDR': False,
+  'payloadsize': 18,
+  'algorithm': 'sequential',
+  'loadHints': '',
+  'bDeferBorderTransmissions': False,
+}
+
+class VirtualClock:
+  """ stand-in for machine.RTC, in virtual time (seconds) """
+
+  def __init__(self):
+    self.time = 0.0
+
+  def now(self):
+    return self.time
+
+class VirtualMedium:
+  """ shared radio medium, detects overlapping transmissions per resource block """
+
+  def __init__(self, noResourceBlocks):
+    self.active = [[] for block in range(noResourceBlocks)]
+    self.frames = [0]*noResourceBlocks
+    self.collided = [0]*noResourceBlocks
+    self.airTime = [0.0]*noResourceBlocks
+
+  def transmit(self, block, start, airTime):
+    # Transmissions are received in time order, so every frame still on air
+    # in this resource block overlaps the new one
+    active = self.active[block]
+    if active:
+      stillActive = []
+      for frame in active:
+        if frame[0] > start:
+          stillActive.append(frame)
+        elif frame[1]:
+          self.collided[block] += 1
+      active = stillActive
+      self.active[block] = active
+    frame = [start + airTime, False]
+    for other in active:
+      other[1] = True
+      frame[1] = True
+    active.append(frame)
+    self.frames[block] += 1
+    self.airTime[block] += airTime
+
+  def flush(self):
+    for block in range(len(self.active)):
+      for frame in self.active[block]:
+        if frame[1]:
+          self.collided[block] += 1
+      self.active[block] = []
+
+class VirtualRadio:
+  """ stand-in for LoRa and the LoRa socket of one device """
+
+  def __init__(self, medium, blockIndex, clock):
+    self.medium = medium
+    self.blockIndex = blockIndex
+    self.clock = clock
+    self.selectedFreq = None
+    self.selectedDR = None
+
+  def setTransmissionParameters(self, selectedFreq, selectedDR):
+    self.selectedFreq = selectedFreq
+    self.selectedDR = selectedDR
+
+  def send(self, payloadsize):
+    sf = convertDRtoSF(self.selectedDR)
+    self.medium.transmit(self.blockIndex[(self.selectedFreq, sf)], self.clock.now(), airtime(payloadsize, sf))
+
+class VirtualDevice:
+  """ state of the main loop of one device """
+
+  def __init__(self, radio, schedule):
+    self.radio = radio
+    self.schedule = schedule
+    self.initialResourceBlock = schedule.initialResourceBlock
+    self.messageCounter = 0
+    self.timeLastTransmission = 0.0
+
+def simulate(config):
+  config = dict(DEFAULT_CONFIG, **config)
+  rnd = random.Random(config['seed'])
+  def RandomRange(rfrom, rto):
+    return rnd.random()*(rto-rfrom)+rfrom
+
+  durationOfPeriod = config['durationOfPeriod']
+  borderEffectGuardTime = config['borderEffectGuardTime']
+  payloadsize = config['payloadsize']
+  endTime = config['days']*86400.0
+
+  channelsList, sfList = createResourceBlocksLists(config['sfMask'])
+  noResourceBlocks = len(channelsList)
+  blockIndex = {}
+  for block in range(noResourceBlocks):
+    blockIndex[(channelsList[block], sfList[block])] = block
+
+  loadHints = parseLoadHints(config['loadHints'])
+  clock = VirtualClock()
+  medium = VirtualMedium(noResourceBlocks)
+  devices = []
+  events = []
+  for i in range(config['devices']):
+    # The CARA server assigns the initial resource blocks in order of arrival
+    # DevEUI for the hashed hopping: device number (8 bytes)
+    schedule = CARASchedule(config['sfMask'], i % noResourceBlocks, durationOfPeriod, config['algorithm'], i.to_bytes(8, 'big'), loadHints)
+    device = VirtualDevice(VirtualRadio(medium, blockIndex, clock), schedule)
+    devices.append(device)
+    # Join at random time, first packet sent at random time
+    timeNextTransmission = RandomRange(0, config['randomTimeForJoining']) + config['fixedTime'] + RandomRange(0, config['randomTime'])
+    device.timeLastTransmission = timeNextTransmission
+    # (time, device, frequency and DR of a deferred transmission or 0)
+    events.append((timeNextTransmission, i, 0, 0))
+  heapq.heapify(events)
+
+  borderDrops = 0
+  deferred = 0
+  deferredTime = 0.0
+  borderCrossings = 0
+  decisions = 0
+  wallClock = time.time()
+  while events:
+    timeNextTransmission, i, deferredFreq, deferredDR = heapq.heappop(events)
+    if timeNextTransmission >= endTime:
+      break
+    clock.time = timeNextTransmission
+    device = devices[i]
+
+    if deferredFreq:
+      # Deferred transmission (already decided and counted)
+      device.radio.setTransmissionParameters(deferredFreq, deferredDR)
+      device.radio.send(payloadsize)
+      if device.schedule.periodAt(timeNextTransmission + 1e-9) != device.schedule.periodAt(timeNextTransmission + airtime(payloadsize, convertDRtoSF(deferredDR)) + borderEffectGuardTime):
+        borderCrossings += 1
+      continue
+
+    device.messageCounter += 1
+
+    # Same decisions as the main loop of main.py
+    borderTransmission = False
+    if config['caraEnabled'] == 1:
+      selectedFreq, selectedDR = device.schedule.parametersAt(timeNextTransmission)
+      fixedBlock = device.initialResourceBlock if config['bFixedChannelAndDR'] else None
+      if device.messageCounter > 1:
+        if fixedBlock is not None:
+          selectedFreq, selectedDR = device.schedule.parametersOfBlock(fixedBlock)
+        if config['avoidBorderEffect'] == 1:
+          borderTransmission = checkBorderEffect(timeNextTransmission, selectedFreq, selectedDR, borderEffectGuardTime, payloadsize, durationOfPeriod)
+          if borderTransmission and config['bDeferBorderTransmissions']:
+            deferredTransmission = deferTransmission(device.schedule, timeNextTransmission, borderEffectGuardTime, payloadsize, fixedBlock, timeNextTransmission + config['fixedTime'])
+            if deferredTransmission is not None:
+              deferred += 1
+              deferredTime += deferredTransmission[0] - timeNextTransmission
+              heapq.heappush(events, (deferredTransmission[0], i, deferredTransmission[1], deferredTransmission[2]))
+              borderTransmission = None
+    else:
+      # Standard LoRaWAN: DR given by the server, random channel
+      selectedFreq = channelsList[int(RandomRange(0, 8))]
+      selectedDR = convertSFtoDR(sfList[device.initialResourceBlock])
+    decisions += 1
+    device.radio.setTransmissionParameters(selectedFreq, selectedDR)
+
+    if borderTransmission:
+      borderDrops += 1
+    elif borderTransmission is not None:
+      device.radio.send(payloadsize)
+      if config['avoidBorderEffect'] == 1 and config['caraEnabled'] == 1 and device.messageCounter > 1:
+        if device.schedule.periodAt(timeNextTransmission) != device.schedule.periodAt(timeNextTransmission + airtime(payloadsize, convertDRtoSF(selectedDR)) + borderEffectGuardTime):
+          borderCrossings += 1
+
+    # The next transmission is computed from the scheduled time (also if deferred)
+    device.timeLastTransmission = timeNextTransmission
+    heapq.heappush(events, (timeNextTransmission + config['fixedTime'] + RandomRange(0, config['randomTime']), i, 0, 0))
+  medium.flush()
+
+  frames = sum(medium.frames)
+  collided = sum(medium.collided)
+  return {
+    'config': config,
+    'frames': frames,
+    'collided': collided,
+    'collisionRate': collided/frames if frames else 0.0,
+    'borderDrops': borderDrops,
+    'deferred': deferred,
+    'meanDeferral': deferredTime/deferred if deferred else 0.0,
+    'borderCrossings': borderCrossings,
+    'decisions': decisions,
+    'framesPerBlock': medium.frames,
+    'collidedPerBlock': medium.collided,
+    'utilisationPerBlock': [a/endTime for a in medium.airTime],
+    'blocks': list(zip(channelsList, sfList)),
+    'wallClock': time.time() - wallClock,
+  }
+
+def runSweep(configs, processes=None):
+  # Each configuration is simulated in a different process
+  if processes == 1:
+    return [simulate(config) for config in configs]
+  with Pool(processes) as pool:
+    return pool.map(simulate, configs)
+
+def parseSweep(sweeps):
+  # ['durationOfPeriod=5,10', 'seed=1,2'] -> list of configurations (cartesian product)
+  names = []
+  values = []
+  for sweep in sweeps:
+    name, valuesStr = sweep.split('=', 1)
+    valueType = type(DEFAULT_CONFIG[name])
+    names.append(name)
+    values.append([valueType(v) if valueType != bool else v in ('1', 'True', 'true') for v in valuesStr.split(',')])
+  return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def printResult(result, perBlock=False):
+  config = result['config']
+  changed = ['{}={}'.format(k, config[k]) for k in sorted(config) if config[k] != DEFAULT_CONFIG[k]]
+  print("[INFO] {}".format(', '.join(changed) if changed else 'default configuration'))
+  print("[INFO]   frames sent = {:d}, collided = {:d} ({:.3%}), border effect drops = {:d}".format(result['frames'], result['collided'], result['collisionRate'], result['borderDrops']))
+  print("[INFO]   border effect deferred = {:d} (mean delay {:.3f} s), frames crossing a period boundary = {:d}".format(result['deferred'], result['meanDeferral'], result['borderCrossings']))
+  utilisation = result['utilisationPerBlock']
+  print("[INFO]   air time utilisation per block: mean {:.4%}, max {:.4%}".format(sum(utilisation)/len(utilisation), max(utilisation)))
+  print("[INFO]   simulated in {:.1f} s ({:.2f} us per decision)".format(result['wallClock'], 1e6*result['wallClock']/max(result['decisions'], 1)))
+  if perBlock:
+    for block in range(len(result['blocks'])):
+      freq, sf = result['blocks'][block]
+      print("[INFO]   block {:2d} ({:d} Hz, SF{:d}): frames = {:d}, collided = {:d}, utilisation = {:.4%}".format(block, freq, sf, result['framesPerBlock'][block], result['collidedPerBlock'][block], utilisation[block]))
+
+def main():
+  parser = argparse.ArgumentParser(description='Discrete-event simulator of CARA devices')
+  for name in sorted(DEFAULT_CONFIG):
+    value = DEFAULT_CONFIG[name]
+    if isinstance(value, bool):
+      parser.add_argument('--' + name, type=lambda v: v in ('1', 'True', 'true'), default=value)
+    else:
+      parser.add_argument('--' + name, type=type(value), default=value)
+  parser.add_argument('--sweep', action='append', default=[], help='parameter=value1,value2,... (can be repeated)')
+  parser.add_argument('--processes', type=int, default=None, help='processes for sweeps (default: number of CPUs)')
+  parser.add_argument('--perBlock', action='store_true', help='show results per resource block')
+  args = vars(parser.parse_args())
+
+  sweeps = args.pop('sweep')
+  processes = args.pop('processes')
+  perBlock = args.pop('perBlock')
+  configs = [dict(args, **sweepConfig) for sweepConfig in parseSweep(sweeps)]
+  for result in runSweep(configs, processes if len(configs) > 1 else 1):
+    printResult(result, perBlock)
+
+if __name__ == '__main__':
+  main()
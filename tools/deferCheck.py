@@ -0,0 +1,131 @@
+# Checks of the deferral of the border transmissions (deferTransmission of
+# lib/caraScheduler.py, and the plan of an uplink of lib/caraRuntime.py as the
+# main loop of main.py), host side, Python 3
+#
+# For random CARA assignments (SF mask, initial resource block, algorithm),
+# durations of period, guard times and payload sizes, with the schedule and with
+# a fixed resource block (main.py bFixedChannelAndDR), and schedules aligned with
+# 1970 from the midnight of random days (epochUs), a transmission that would
+# cross the end of its period must be deferred:
+#   - borderEffectGuardTime after the start of a following period,
+#   - to the first period where it fits with the DR actually used (the one of the
+#     period, or of the fixed resource block), so it does not cross its end,
+#   - ending with its guard time before latestTime (the earliest next transmission,
+#     fixedTime after the scheduled one), if given,
+#   - or not at all (None, the frame is held) if it fits in no period.
+#
+# Example:
+#   python3 tools/deferCheck.py --trials 20000
+
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from caraScheduler import CARASchedule, ASSIGNMENT_ALGORITHM_NAMES, checkBorderEffect, checkBorderEffectUs, deferTransmission, convertDRtoSF
+from caraRuntime import CARARuntime
+from caraParameters import CARAParameters
+from LoRaAirTimeCalc import LoRa, airtime
+
+DURATIONS_OF_PERIOD = (1.0, 2.0, 2.5, 5.0, 7.0, 10.0, 13.37)
+
+def randomSchedule(rnd, durationOfPeriod):
+  sfMask = rnd.randrange(1, 64)
+  blocks = 8*bin(sfMask).count('1')
+  epochUs = rnd.randrange(18000, 22000)*86400*1000000
+  return CARASchedule(sfMask, rnd.randrange(blocks), durationOfPeriod, rnd.choice(ASSIGNMENT_ALGORITHM_NAMES), bytes(rnd.getrandbits(8) for i in range(8)), None, epochUs)
+
+def fits(schedule, indexPeriod, guardTime, payloadsize, fixedBlock, latestTime=None):
+  if fixedBlock is None:
+    selectedFreq, selectedDR = schedule.parametersOfPeriod(indexPeriod)
+  else:
+    selectedFreq, selectedDR = schedule.parametersOfBlock(fixedBlock)
+  airTime = airtime(payloadsize, convertDRtoSF(selectedDR), LoRa.BW_125KHZ, LoRa.CODING_4_5)
+  if latestTime is not None and schedule.periodStart(indexPeriod) + airTime + 2*guardTime > latestTime:
+    return False
+  return airTime + 2*guardTime <= schedule.durationOfPeriod
+
+def checkDeferral(rnd, trials):
+  counts = {'deferred': 0, 'none': 0}
+  borders = 0
+  while borders < trials:
+    durationOfPeriod = rnd.choice(DURATIONS_OF_PERIOD)
+    schedule = randomSchedule(rnd, durationOfPeriod)
+    fixedBlock = rnd.randrange(schedule.noResourceBlocks) if rnd.random() < 0.5 else None
+    guardTime = rnd.uniform(0.01, 0.3)
+    payloadsize = rnd.randrange(0, 64)
+    t = rnd.uniform(0, 86400)
+    latestTime = t + rnd.uniform(1.0, 60.0) if rnd.random() < 0.5 else None
+    if fixedBlock is None:
+      selectedFreq, selectedDR = schedule.parametersAt(t)
+    else:
+      selectedFreq, selectedDR = schedule.parametersOfBlock(fixedBlock)
+    if not checkBorderEffect(t, selectedFreq, selectedDR, guardTime, payloadsize, durationOfPeriod, schedule.epochOffset):
+      continue
+    borders = borders + 1
+    indexPeriod = schedule.periodAt(t)
+    deferred = deferTransmission(schedule, t, guardTime, payloadsize, fixedBlock, latestTime)
+    periods = schedule.sequenceLength if fixedBlock is None else 1
+    candidates = [i for i in range(1, periods + 1) if fits(schedule, indexPeriod + i, guardTime, payloadsize, fixedBlock, latestTime)]
+    if deferred is None:
+      assert len(candidates) == 0, (t, fixedBlock, candidates)
+      counts['none'] = counts['none'] + 1
+      continue
+    counts['deferred'] = counts['deferred'] + 1
+    time, freq, dr = deferred
+    newPeriod = schedule.periodAt(time)
+    # First period where it fits, guard time after its start
+    assert newPeriod == indexPeriod + candidates[0], (t, newPeriod, indexPeriod, candidates[0])
+    assert abs(time - schedule.periodStart(newPeriod) - guardTime) < 1e-6, (t, time, guardTime)
+    # Channel and DR actually used, and no border effect with them
+    expected = schedule.parametersAt(time) if fixedBlock is None else schedule.parametersOfBlock(fixedBlock)
+    assert [freq, dr] == list(expected), (t, fixedBlock, freq, dr, expected)
+    assert not checkBorderEffect(time, freq, dr, guardTime, payloadsize, durationOfPeriod, schedule.epochOffset), (t, time, dr)
+    # Ends (with its guard time) before the next transmission
+    if latestTime is not None:
+      assert time + airtime(payloadsize, convertDRtoSF(dr)) + guardTime <= latestTime + 1e-9, (t, time, latestTime)
+  print("[INFO] deferTransmission: OK ({:d} border transmissions, {:d} deferred, {:d} not deferrable)".format(borders, counts['deferred'], counts['none']))
+
+def checkRuntimePlan(rnd, trials):
+  # plan() of the runtime: the border effect is checked with the DR actually used
+  deferred = 0
+  for trial in range(trials):
+    durationOfPeriod = rnd.choice(DURATIONS_OF_PERIOD)
+    schedule = randomSchedule(rnd, durationOfPeriod)
+    fixedBlock = rnd.randrange(schedule.noResourceBlocks)
+    params = CARAParameters()
+    params.durationOfPeriod, params.avoidBorderEffect, params.borderEffectGuardTime = durationOfPeriod, 1, rnd.uniform(0.01, 0.3)
+    params.fixedTime = rnd.uniform(1.0, 60.0)
+    runtime = CARARuntime(None, None, schedule, params, None, None, lambda: 0, rnd.random, fixedBlock=fixedBlock)
+    payloadsize = rnd.randrange(0, 64)
+    # (times of the runtime in integer us, up to a month of uptime)
+    t = rnd.randrange(0, 31*86400000000)
+    fixedFreq, fixedDR = schedule.parametersOfBlock(fixedBlock)
+    border = checkBorderEffectUs(t, fixedFreq, fixedDR, params.borderEffectGuardTime, payloadsize, schedule.periodUs, schedule.epochOffsetUs)
+    for bDefer in (False, True):
+      time, freq, dr, borderTransmission, airTime = runtime.plan(t, payloadsize, bDefer)
+      assert [freq, dr] == [fixedFreq, fixedDR] and airTime == airtime(payloadsize, convertDRtoSF(fixedDR))
+      if bDefer and border and time != t:
+        deferred = deferred + 1
+        assert not borderTransmission and not checkBorderEffectUs(time, freq, dr, params.borderEffectGuardTime, payloadsize, schedule.periodUs, schedule.epochOffsetUs)
+        # Exactly borderEffectGuardTime after a period boundary
+        assert (time - int(round(1000000*params.borderEffectGuardTime)) + schedule.epochOffsetUs) % schedule.periodUs == 0, (t, time)
+        # (before the earliest next transmission of the runtime)
+        assert time + airTime*1000000 + params.borderEffectGuardTime*1000000 <= t + int(1000000*params.fixedTime) + 1, (t, time, params.fixedTime)
+      else:
+        assert time == t and borderTransmission == border, (t, bDefer, border, borderTransmission)
+  print("[INFO] Runtime plan with a fixed resource block: OK ({:d} plans, {:d} deferred)".format(2*trials, deferred))
+
+def main():
+  parser = argparse.ArgumentParser(description='Deferral of the border transmissions')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--trials', type=int, default=20000)
+  config = parser.parse_args()
+  rnd = random.Random(config.seed)
+  checkDeferral(rnd, config.trials)
+  checkRuntimePlan(rnd, config.trials)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,302 @@
+# Checks of lib/downlinkDispatcher.py with a fake LoRa socket: reconfiguration
+# downlinks (#JOINACC# after the join) received between uplinks swap the CARA
+# schedule at the next period boundary of the current schedule, within one period
+# (also with a new duration of period), host side, Python 3. The times are integer
+# microseconds of the time base, as on the device
+#
+#   blocking loop: the main.py loop in virtual time (downlinks dispatched by
+#                  DownlinkDispatcher.waitUntil, with a fake select.poll, while
+#                  waiting for the next transmission, and the transmission planned
+#                  again if the swap is before it)
+#   async runtime: lib/caraRuntime.py in real time, with the periods, the times
+#                  between uplinks and the air time shortened TIME_SCALE times
+#
+# Example:
+#   python3 tools/downlinkCheck.py --trials 2000
+
+import os
+import sys
+import random
+import asyncio
+import argparse
+import time
+import io
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from downlinkDispatcher import DownlinkDispatcher, SLEEP_MARGIN_US
+from joinAccept import packJoinAccept, formatJoinAccept
+from caraScheduler import CARASchedule
+from caraRuntime import CARARuntime, AsyncLoRaSocket
+from caraParameters import CARAParameters
+from txQueue import TxQueue, DutyCycleLedger
+
+# Shortened time of the async runtime (0.5 s periods for the 5 s periods of the
+# CARA web server)
+TIME_SCALE = 10
+
+class FakeLoRaSocket:
+  """ non-blocking LoRa socket with downlinks at given times (now() of the test, us) """
+
+  def __init__(self, now, downlinks):
+    self.now = now
+    # [(time, data, port), ...] in time order
+    self.downlinks = list(downlinks)
+    self.sent = []
+    # [(arrival, time read), ...]
+    self.received = []
+    self.port = 2
+
+  def setblocking(self, flag):
+    pass
+
+  def bind(self, port):
+    self.port = port
+
+  def send(self, data):
+    self.sent.append((self.now(), bytes(data), self.port))
+
+  def recvfrom(self, size):
+    if len(self.downlinks) > 0 and self.downlinks[0][0] <= self.now():
+      t, data, port = self.downlinks.pop(0)
+      self.received.append((t, self.now()))
+      return (data[0:size], port)
+    return (b'', 2)
+
+class VirtualClock:
+  """ CARAClock in virtual time (us) """
+
+  def __init__(self, us):
+    self.us = us
+
+  def nowUs(self):
+    return self.us
+
+  def sleepUntilUs(self, us):
+    self.us = max(self.us, us)
+
+class FakePoll:
+  """ select.poll with the fake LoRa socket registered: returns at the arrival of
+  the next downlink or at the timeout (ms), advancing the virtual clock """
+
+  def __init__(self, socket, clock):
+    self.socket = socket
+    self.clock = clock
+    self.timeouts = []
+
+  def poll(self, timeout):
+    self.timeouts.append(timeout)
+    deadline = self.clock.us + 1000*timeout
+    if len(self.socket.downlinks) > 0 and self.socket.downlinks[0][0] <= deadline:
+      self.clock.us = max(self.clock.us, self.socket.downlinks[0][0])
+      return [(self.socket, 1)]
+    self.clock.us = deadline
+    return []
+
+class FakeRadioState:
+  """ radioState.RadioState without the radio: last frequency and DR """
+
+  def __init__(self):
+    self.parameters = None
+
+  def setTransmissionParameters(self, freq, dr):
+    self.parameters = [freq, dr]
+
+class RecordingLoRaSocket(FakeLoRaSocket):
+  """ also the radio parameters of every uplink """
+
+  def __init__(self, now, downlinks, radioState):
+    FakeLoRaSocket.__init__(self, now, downlinks)
+    self.radioState = radioState
+    self.parameters = []
+
+  def send(self, data):
+    FakeLoRaSocket.send(self, data)
+    self.parameters.append(self.radioState.parameters)
+
+class ScaledAsyncLoRaSocket(AsyncLoRaSocket):
+  """ air time shortened as the periods (CARA periods are longer than the air time) """
+
+  async def send(self, data, airTime, port=2):
+    await AsyncLoRaSocket.send(self, data, airTime/TIME_SCALE, port)
+
+def newSchedule(config):
+  return CARASchedule(config['sfMask'], config['initialResourceBlock'], config['durationOfPeriod'], config['algorithm'], b'\x70\xb3\xd5\x49\x00\x00\x00\x01', config['loadHints'])
+
+def randomConfig(rnd, durationOfPeriod):
+  sfMask = rnd.randrange(1, 64)
+  return {'sfMask': sfMask, 'initialResourceBlock': rnd.randrange(8*bin(sfMask).count('1')), 'algorithm': rnd.randrange(4),
+          'durationOfPeriod': durationOfPeriod, 'loadHints': None}
+
+def command(rnd, config, bBinary):
+  if bBinary:
+    return packJoinAccept(1, config['initialResourceBlock'], config['sfMask'], config['algorithm'], config['durationOfPeriod'])
+  return formatJoinAccept(1, config['initialResourceBlock'], config['sfMask'], config['algorithm'])
+
+def blockingLoop(rnd, dispatcher, socket, clock, fixedTime, randomTime, end):
+  # main.py loop (CARA enabled, without border effect): [(t, freq, dr)] of the uplinks
+  uplinks = []
+  poller = FakePoll(socket, clock)
+  timeLastTransmissionUs = clock.nowUs()
+  while timeLastTransmissionUs < end:
+    timeNextTransmissionUs = timeLastTransmissionUs + int(1000000*(fixedTime + rnd.uniform(0, randomTime)))
+    timeLastTransmissionUs = timeNextTransmissionUs
+    schedule = dispatcher.scheduleAt(timeNextTransmissionUs)
+    selectedFreq, selectedDR = schedule.parametersAtUs(timeNextTransmissionUs)
+    # waitForTransmission() of main.py: woken up by every downlink before the transmission
+    dispatcher.waitUntil(socket, poller, clock, timeNextTransmissionUs)
+    assert clock.nowUs() == timeNextTransmissionUs
+    # (the tick counter is read at least every minute)
+    assert max(poller.timeouts) <= 60000
+    if dispatcher.pendingBefore(timeNextTransmissionUs):
+      schedule = dispatcher.scheduleAt(timeNextTransmissionUs)
+      selectedFreq, selectedDR = schedule.parametersAtUs(timeNextTransmissionUs)
+    socket.send(b'Testing data')
+    uplinks.append((timeNextTransmissionUs, selectedFreq, selectedDR))
+  return uplinks
+
+def checkBlockingLoop(rnd, trials):
+  maxDelay = {True: 0.0, False: 0.0}
+  for trial in range(trials):
+    durationOfPeriod = rnd.choice((5.0, 10.0, 30.0))
+    bSamePeriod = rnd.random() < 0.7
+    newPeriod = durationOfPeriod if bSamePeriod else rnd.choice((5.0, 10.0, 15.0, 20.0, 30.0, 60.0))
+    old = randomConfig(rnd, durationOfPeriod)
+    new = randomConfig(rnd, newPeriod)
+    bBinary = (not bSamePeriod) or rnd.random() < 0.5
+    receivedAt = rnd.randrange(100000000, 400000000)
+    other = []
+    clock = VirtualClock(rnd.randrange(0, 50000000))
+    socket = FakeLoRaSocket(clock.nowUs, [(receivedAt - 3000000, b'application data', 10), (receivedAt, command(rnd, new, bBinary), 2)])
+    dispatcher = DownlinkDispatcher(newSchedule(old), old, newSchedule, lambda data, port: other.append((data, port)))
+    oldSchedule = dispatcher.schedule
+    with contextlib.redirect_stdout(io.StringIO()):
+      uplinks = blockingLoop(rnd, dispatcher, socket, clock, 2.0, 8.0, receivedAt + 300000000)
+
+    # Same LoRaWAN session (socket), application data not taken as a command
+    assert other == [(b'application data', 10)], other
+    assert dispatcher.commands == 1 and dispatcher.swaps == 1, (dispatcher.commands, dispatcher.swaps)
+    activation = dispatcher.activationUs
+    newSchedule_ = dispatcher.schedule
+    # Read when it arrives, except in the last SLEEP_MARGIN_US before an uplink
+    # (then just after the uplink)
+    (arrival, readAt), = [received for received in socket.received if received[0] == receivedAt]
+    assert readAt == arrival or (readAt - arrival <= SLEEP_MARGIN_US and readAt in [t for t, freq, dr in uplinks]), (arrival, readAt)
+    # Swap at the next boundary of the current schedule (within one period)
+    assert activation > readAt
+    assert activation == oldSchedule.periodStartUs(oldSchedule.periodAtUs(readAt) + 1), (activation, readAt)
+    delay = activation - readAt
+    assert delay <= oldSchedule.periodUs, (delay, durationOfPeriod)
+    maxDelay[bSamePeriod] = max(maxDelay[bSamePeriod], delay/oldSchedule.periodUs)
+    # Every uplink uses the schedule of its period
+    for t, freq, dr in uplinks:
+      expected = newSchedule_ if t >= activation else oldSchedule
+      assert [freq, dr] == expected.parametersAtUs(t), (t, activation)
+    assert dispatcher.config['sfMask'] == new['sfMask'] and dispatcher.config['initialResourceBlock'] == new['initialResourceBlock']
+  print("[INFO] Blocking loop: OK ({:d} reconfigurations, swap after at most {:.2f} periods with the same duration of period, {:.2f} current periods with a new one)".format(
+    trials, maxDelay[True], maxDelay[False]))
+
+def checkRejected(rnd):
+  # Invalid reconfigurations (and CARA disabled) keep the schedule
+  old = randomConfig(rnd, 10.0)
+  dispatcher = DownlinkDispatcher(newSchedule(old), old, newSchedule)
+  schedule = dispatcher.schedule
+  with contextlib.redirect_stdout(io.StringIO()):
+    for data in (packJoinAccept(0, 3), packJoinAccept(1, 8, 1), b'#JOINACC# 1 x 63', packJoinAccept(1, 0, 1)[0:4]):
+      assert not dispatcher.handle(data, 2, 50000000)
+  assert dispatcher.scheduleAt(1000000000) is schedule and dispatcher.swaps == 0
+  rejected = dispatcher.rejected
+  # Schedule that cannot be built (any exception of the factory)
+  def failingSchedule(config):
+    raise ZeroDivisionError('float division by zero')
+  dispatcher = DownlinkDispatcher(schedule, old, failingSchedule)
+  with contextlib.redirect_stdout(io.StringIO()):
+    assert not dispatcher.handle(packJoinAccept(1, 0, 1, 0, 5.0), 2, 50000000)
+  assert dispatcher.rejected == 1 and dispatcher.scheduleAt(1000000000) is schedule and dispatcher.swaps == 0
+  print("[INFO] Rejected commands: OK ({:d} rejected, {:d} not commands)".format(rejected + dispatcher.rejected, 4 - rejected))
+
+def checkRefreshedPeriod(rnd):
+  # The refreshed CARA parameters keep the duration of period of the #JOINACC# or
+  # of a reconfiguration downlink, and change the one of the HTTP parameters
+  def refreshed(durationOfPeriod):
+    params = CARAParameters()
+    params.fixedTime, params.randomTime, params.durationOfPeriod = 60.0, 60.0, durationOfPeriod
+    return params
+  # (commandPeriod: None = no reconfiguration, 0 = reconfiguration without duration of period)
+  for joinAcceptPeriod, commandPeriod in ((False, None), (True, None), (False, 7.0), (False, 0)):
+    old = randomConfig(rnd, 5.0)
+    dispatcher = DownlinkDispatcher(newSchedule(old), old, newSchedule)
+    if commandPeriod is not None:
+      new = randomConfig(rnd, commandPeriod or 5.0)
+      with contextlib.redirect_stdout(io.StringIO()):
+        # (the text #JOINACC# has no duration of period)
+        assert dispatcher.handle(command(rnd, new, commandPeriod != 0), 2, 1000000)
+      dispatcher.scheduleAt(100000000)
+    periodBefore = dispatcher.schedule.durationOfPeriod
+    runtime = CARARuntime(None, None, dispatcher.schedule, refreshed(periodBefore), None, None, lambda: 0, rnd.random,
+                          downlinks=dispatcher, joinAcceptPeriod=joinAcceptPeriod)
+    runtime.pendingParameters = refreshed(10.0)
+    runtime.applyParameters()
+    expected = periodBefore if joinAcceptPeriod or commandPeriod else 10.0
+    assert runtime.schedule.durationOfPeriod == expected and runtime.params.durationOfPeriod == expected, (joinAcceptPeriod, commandPeriod)
+    assert dispatcher.schedule is runtime.schedule and runtime.params.fixedTime == 60.0
+  print("[INFO] Refreshed duration of period: OK (kept from the #JOINACC# and the reconfiguration downlinks)")
+
+async def asyncScenario(rnd, durationOfPeriod, receivedAt, duration):
+  start = time.monotonic()
+  now = lambda: int(1000000*(time.monotonic() - start))
+  old = randomConfig(rnd, durationOfPeriod)
+  new = randomConfig(rnd, durationOfPeriod)
+  radioState = FakeRadioState()
+  socket = RecordingLoRaSocket(now, [(int(1000000*receivedAt), command(rnd, new, True), 2)], radioState)
+  dispatcher = DownlinkDispatcher(newSchedule(old), old, newSchedule)
+  params = CARAParameters()
+  params.fixedTime, params.randomTime, params.durationOfPeriod = 0.1, 0.1, durationOfPeriod
+  params.avoidBorderEffect = 0
+  counter = [0]
+  def sample():
+    counter[0] = counter[0] + 1
+    return counter[0].to_bytes(4, 'big')
+  runtime = CARARuntime(ScaledAsyncLoRaSocket(socket), radioState, dispatcher.schedule, params, TxQueue(), DutyCycleLedger(), now, rnd.random,
+                        sample=sample, telemetryPeriod=0.15, downlinks=dispatcher)
+  oldSchedule = dispatcher.schedule
+  try:
+    await asyncio.wait_for(runtime.run(), duration)
+  except asyncio.TimeoutError:
+    pass
+  return oldSchedule, dispatcher, runtime, socket
+
+def checkAsyncRuntime(rnd, durationOfPeriod=0.5, receivedAt=1.2, duration=3.0):
+  oldSchedule, dispatcher, runtime, socket = asyncio.run(asyncScenario(rnd, durationOfPeriod, receivedAt, duration))
+  assert dispatcher.swaps == 1, dispatcher.swaps
+  activation = dispatcher.activationUs/1000000
+  assert receivedAt < activation <= receivedAt + durationOfPeriod + 0.05, activation
+  # Every uplink uses the schedule of its period (the uplinks sent close to a
+  # boundary are not checked, their scheduled time is not known)
+  assert runtime.framesSent > 0 and runtime.maxLateness < 0.05, runtime.maxLateness
+  checked = 0
+  for (us, data, port), parameters in zip(socket.sent, socket.parameters):
+    t = us/1000000
+    if abs(t - round(t/durationOfPeriod)*durationOfPeriod) < 0.05:
+      continue
+    expected = dispatcher.schedule if t >= activation else oldSchedule
+    assert parameters == expected.parametersAtUs(us), (t, activation, parameters)
+    checked = checked + 1
+  assert checked > 0
+  print("[INFO] Async runtime: OK (reconfiguration at t={:.2f} s, swap at t={:.2f} s, {:d} uplinks, max lateness {:.1f} ms)".format(
+    receivedAt, activation, runtime.framesSent, 1000*runtime.maxLateness))
+
+def main():
+  parser = argparse.ArgumentParser(description='Checks of the reconfiguration downlinks')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--trials', type=int, default=2000)
+  config = parser.parse_args()
+  rnd = random.Random(config.seed)
+  checkBlockingLoop(rnd, config.trials)
+  checkRejected(rnd)
+  checkRefreshedPeriod(rnd)
+  checkAsyncRuntime(rnd)
+
+if __name__ == '__main__':
+  main()
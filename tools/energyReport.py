@@ -0,0 +1,82 @@
+# Energy estimation of a CARA device, awake between uplinks or in the low power
+# mode of main.py (deep sleep between uplinks), from the air time and the sleep
+# time (host side, Python 3)
+#
+# The air time is the mean over the resource blocks used by the assignment
+# algorithm, and the currents are the nominal ones of lib/sleepState.py.
+#
+# Example:
+#   python3 tools/energyReport.py --fixedTime 600 --randomTime 300 --batteryCapacity 2000
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from sleepState import EnergyEstimate, CURRENT_TX_MA, CURRENT_AWAKE_MA, CURRENT_SLEEP_MA
+from caraScheduler import CARASchedule, convertDRtoSF
+from LoRaAirTimeCalc import airtime
+
+DEFAULT_CONFIG = {
+  'fixedTime': 60.0,
+  'randomTime': 60.0,
+  'payloadsize': 20,
+  'sfMask': 63,
+  'algorithm': 'sequential',
+  # Awake time per uplink in the low power mode: wake up and restore the state
+  # (lowPowerWakeUpTime) plus the receive windows after the uplink
+  'lowPowerWakeUpTime': 3.0,
+  'receiveWindowsTime': 2.0,
+  'lowPowerMinSleepTime': 10.0,
+  'days': 1.0,
+  'batteryCapacity': 2000.0,
+}
+
+def meanAirTime(config):
+  schedule = CARASchedule(config['sfMask'], 0, 1.0, config['algorithm'], bytes(8))
+  airTimes = [airtime(config['payloadsize'], convertDRtoSF(schedule.parametersOfPeriod(i)[1])) for i in range(schedule.sequenceLength)]
+  return sum(airTimes)/len(airTimes)
+
+def estimateEnergy(config):
+  config = dict(DEFAULT_CONFIG, **config)
+  duration = config['days']*86400.0
+  timeBetweenUplinks = config['fixedTime'] + config['randomTime']/2
+  uplinks = duration/timeBetweenUplinks
+  airTime = uplinks*meanAirTime(config)
+
+  awake = EnergyEstimate(airTime, duration, 0.0)
+  lowPower = EnergyEstimate()
+  awakePerUplink = config['lowPowerWakeUpTime'] + config['receiveWindowsTime']
+  if timeBetweenUplinks - awakePerUplink >= config['lowPowerMinSleepTime']:
+    lowPower.add(airTime, uplinks*awakePerUplink, duration - uplinks*awakePerUplink)
+  else:
+    lowPower.add(airTime, duration, 0.0)
+
+  results = {}
+  for name, energy in (('awake', awake), ('lowPower', lowPower)):
+    results[name] = {
+      'airTime': energy.airTime,
+      'awakeTime': energy.awakeTime,
+      'sleepTime': energy.sleepTime,
+      'charge': energy.charge(),
+      'averageCurrent': energy.averageCurrent(),
+      'batteryDays': config['batteryCapacity']/(24*energy.averageCurrent()) if energy.averageCurrent() > 0 else float('inf'),
+    }
+  results['uplinks'] = uplinks
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(description='Energy estimation of a CARA device')
+  for name in sorted(DEFAULT_CONFIG):
+    parser.add_argument('--' + name, type=type(DEFAULT_CONFIG[name]), default=DEFAULT_CONFIG[name])
+  config = vars(parser.parse_args())
+
+  results = estimateEnergy(config)
+  print("[INFO] {:.0f} uplinks in {:.1f} days (currents: TX {:.1f} mA, awake {:.1f} mA, sleeping {:.3f} mA)".format(results['uplinks'], config['days'], CURRENT_TX_MA, CURRENT_AWAKE_MA, CURRENT_SLEEP_MA))
+  for name, title in (('awake', 'Awake between uplinks'), ('lowPower', 'Low power mode')):
+    r = results[name]
+    print("[INFO] {:s}: {:.1f} mAh, average current {:.3f} mA, battery life {:.1f} days (air time {:.1f} s, awake {:.0f} s, sleeping {:.0f} s)".format(title, r['charge'], r['averageCurrent'], r['batteryDays'], r['airTime'], r['awakeTime'], r['sleepTime']))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,76 @@
+# Connections opened and latency per request of MicroWebCli (lib/microWebCli.py)
+# with new connections (HTTP/1.0) and with the keep-alive connection pool
+# (HTTP/1.1), against a local stand-in of the CARA web server
+# (tools/httpStandIn.py), host side, Python 3
+#
+# A provisioning is the sequence of sequential GETRequest of the per-key endpoints
+# of the CARA parameters (7 requests to the same host), repeated `provisionings`
+# times. The server answers with Content-Length, chunked or read-until-close
+# (Connection: close, not reusable) content, and delays every new connection by
+# connectDelay seconds (round trip time of the TCP handshake over Wi-Fi).
+#
+# Example:
+#   python3 tools/httpKeepAliveBenchmark.py --provisionings 50 --connectDelay 0.02
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from httpStandIn import StandInServer, useHostSockets
+from microWebCli import MicroWebCli
+
+# Per-key endpoints of the CARA parameters
+SERVER_PARAMETERS = {'joinTime': '60', 'fixedTime': '60', 'randomTime': '30', 'durationOfPeriod': '5', 'avoidBorderEffect': '1',
+                     'borderEffectGuardTime': '0.1', 'count_v2.php': '10'}
+
+def routes(framing):
+  return {'/CARA/' + key: {'body': value.encode(), 'framing': framing, 'chunk': 1} for key, value in SERVER_PARAMETERS.items()}
+
+def provision(url, keepAlive, latencies):
+  # Sequential requests of a provisioning, latency of each one (s)
+  for key, value in SERVER_PARAMETERS.items():
+    start = time.perf_counter()
+    content = MicroWebCli.GETRequest(url + 'CARA/' + key, keepAlive=keepAlive)
+    latencies.append(time.perf_counter() - start)
+    assert content == value.encode(), (key, content)
+  if keepAlive:
+    MicroWebCli.ClosePool()
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(p*len(values)))]
+
+def main():
+  parser = argparse.ArgumentParser(description='Connections and latency of the MicroWebCli keep-alive pool')
+  parser.add_argument('--provisionings', type=int, default=50)
+  parser.add_argument('--connectDelay', type=float, default=0.02)
+  config = parser.parse_args()
+  useHostSockets()
+  requests = len(SERVER_PARAMETERS)
+
+  for framing in ('length', 'chunked', 'close'):
+    server = StandInServer(routes(framing), config.connectDelay)
+    try:
+      for keepAlive in (False, True):
+        server.resetCounters()
+        MicroWebCli.ConnOpenedCount = 0
+        MicroWebCli.ConnReusedCount = 0
+        latencies = []
+        for i in range(config.provisionings):
+          provision(server.url, keepAlive, latencies)
+        connections = server.connections()/config.provisionings
+        # One connection per provisioning with keep-alive (reusable content)
+        expected = 1 if keepAlive and framing != 'close' else requests
+        assert connections == expected and MicroWebCli.ConnOpenedCount == server.connections(), (framing, keepAlive, connections)
+        assert server.requests() == config.provisionings*requests
+        print("[INFO] {:7s} content, {:10s}: {:4.1f} connections per provisioning ({:d} requests, {:4.1f} reused), latency per request mean {:6.2f} ms, p50 {:6.2f} ms, p99 {:6.2f} ms".format(
+          framing, 'keep-alive' if keepAlive else 'HTTP/1.0', connections, requests, MicroWebCli.ConnReusedCount/config.provisionings,
+          1000*sum(latencies)/len(latencies), 1000*percentile(latencies, 0.5), 1000*percentile(latencies, 0.99)))
+    finally:
+      server.stop()
+
+if __name__ == '__main__':
+  main()
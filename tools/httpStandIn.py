@@ -0,0 +1,177 @@
+# Stand-in of the CARA web server for the host tools (Python 3): a local HTTP
+# server in its own process (so it does not count in the memory measures of the
+# client), with routes of fixed content and counters of the TCP connections and
+# requests received, and host sockets with the stream methods of the MicroPython
+# sockets used by lib/microWebCli.py (read, readline, readinto, write, and the
+# memoryview of a str).
+#
+# Routes: {path: {'body': bytes, 'framing': 'length' | 'chunked' | 'close',
+#                 'chunk': chunk size (chunked), 'status': HTTP status}}
+# (other paths are answered with 404). The connections of HTTP/1.1 requests are
+# kept open (persistent connections), the others are closed after the response.
+#
+# Example:
+#   server = StandInServer({'/CARA/parameters': {'body': b'{"joinTime": 10}'}})
+#   useHostSockets()
+#   MicroWebCli.GETRequest(server.url + 'CARA/parameters')
+#   server.connections(), server.requests()
+#   server.stop()
+
+import time
+import socket
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class StandInHandler(BaseHTTPRequestHandler):
+  """ answers the routes of the server """
+
+  protocol_version = 'HTTP/1.1'
+  # TCP_NODELAY, as web servers (the headers and the content are written apart)
+  disable_nagle_algorithm = True
+
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    with self.server.connectionCount.get_lock():
+      self.server.connectionCount.value = self.server.connectionCount.value + 1
+    # Round trip time of the TCP handshake (Wi-Fi)
+    if self.server.connectDelay > 0:
+      time.sleep(self.server.connectDelay)
+
+  def log_message(self, format, *args):
+    pass
+
+  def do_GET(self):
+    with self.server.requestCount.get_lock():
+      self.server.requestCount.value = self.server.requestCount.value + 1
+    if self.server.requestDelay > 0:
+      time.sleep(self.server.requestDelay)
+    route = self.server.routes.get(self.path.split('?', 1)[0])
+    if route is None:
+      route = {'body': b'Not found', 'status': 404}
+    body = route['body']
+    framing = route.get('framing', 'length')
+    if framing == 'chunked' and self.request_version != 'HTTP/1.1':
+      framing = 'close'
+    self.send_response(route.get('status', 200))
+    self.send_header('Content-Type', route.get('contentType', 'text/plain'))
+    if framing == 'length':
+      self.send_header('Content-Length', str(len(body)))
+    elif framing == 'chunked':
+      self.send_header('Transfer-Encoding', 'chunked')
+    else:
+      self.send_header('Connection', 'close')
+      self.close_connection = True
+    self.end_headers()
+    data = memoryview(body)
+    if framing == 'chunked':
+      chunk = route.get('chunk', 1024)
+      for offset in range(0, len(data), chunk):
+        part = data[offset:offset + chunk]
+        self.wfile.write(b'%x\r\n' % len(part))
+        self.wfile.write(part)
+        self.wfile.write(b'\r\n')
+      self.wfile.write(b'0\r\n\r\n')
+    else:
+      self.wfile.write(data)
+
+  def do_POST(self):
+    length = int(self.headers.get('Content-Length', 0))
+    if length > 0:
+      self.rfile.read(length)
+    self.do_GET()
+
+class StandInServer:
+  """ HTTP server of the routes in its own process """
+
+  def __init__(self, routes, connectDelay=0.0, requestDelay=0.0):
+    context = multiprocessing.get_context('fork')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server.routes = routes
+    server.connectDelay = connectDelay
+    server.requestDelay = requestDelay
+    server.connectionCount = context.Value('i', 0)
+    server.requestCount = context.Value('i', 0)
+    self.server = server
+    self.url = 'http://127.0.0.1:{:d}/'.format(server.server_address[1])
+    self.process = context.Process(target=server.serve_forever, daemon=True)
+    self.process.start()
+    # The listening socket is only used by the server process
+    server.socket.close()
+
+  def connections(self):
+    return self.server.connectionCount.value
+
+  def requests(self):
+    return self.server.requestCount.value
+
+  def resetCounters(self):
+    self.server.connectionCount.value = 0
+    self.server.requestCount.value = 0
+
+  def stop(self):
+    self.process.terminate()
+    self.process.join()
+
+class HostSocket:
+  """ TCP socket with the stream methods of the MicroPython sockets """
+
+  # Largest size of a read() (None: read until the connection is closed)
+  maxReadSize = 0
+
+  def __init__(self, family=socket.AF_INET, type=socket.SOCK_STREAM, proto=0):
+    self.s = socket.socket(family, type, proto)
+    self.f = None
+
+  def settimeout(self, value):
+    self.s.settimeout(value)
+
+  def connect(self, address):
+    self.s.connect(address)
+    self.f = self.s.makefile('rb')
+
+  def write(self, data):
+    return self.s.send(data)
+
+  def send(self, data):
+    return self.s.send(data)
+
+  def readline(self):
+    return self.f.readline()
+
+  def read(self, size=None):
+    if size is None:
+      HostSocket.maxReadSize = None
+      return self.f.read()
+    if HostSocket.maxReadSize is not None and size > HostSocket.maxReadSize:
+      HostSocket.maxReadSize = size
+    return self.f.read(size)
+
+  def readinto(self, buf):
+    return self.f.readinto(buf)
+
+  def close(self):
+    if self.f is not None:
+      self.f.close()
+    self.s.close()
+
+class hostSocketModule:
+  """ socket module of lib/microWebCli.py on the host """
+
+  AF_INET = socket.AF_INET
+  SOCK_STREAM = socket.SOCK_STREAM
+  IPPROTO_TCP = socket.IPPROTO_TCP
+  getaddrinfo = staticmethod(socket.getaddrinfo)
+  socket = HostSocket
+
+def micropythonMemoryview(data):
+  # MicroPython also takes the buffer of a str
+  if isinstance(data, str):
+    data = data.encode()
+  return memoryview(data)
+
+def useHostSockets():
+  # MicroWebCli connections through HostSocket
+  import microWebCli
+  microWebCli.socket = hostSocketModule
+  microWebCli.memoryview = micropythonMemoryview
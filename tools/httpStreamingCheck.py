@@ -0,0 +1,115 @@
+# Memory of the response content of MicroWebCli (lib/microWebCli.py) against a
+# local stand-in of the CARA web server (tools/httpStandIn.py), host side,
+# Python 3
+#
+# For Content-Length, chunked and read-until-close content of `sizes` bytes:
+#   IterContent(chunkSize), WriteContentToFile: peak of the memory allocated
+#     while the content is read (tracemalloc), bounded by the chunk size and the
+#     same for every size of content; the content read is checked (CRC-32)
+#   ReadContent(): the whole content is returned, but read from the socket in
+#     parts of at most ContentPartMaxSize bytes (never a single read of unknown
+#     size)
+#
+# Example:
+#   python3 tools/httpStreamingCheck.py --sizes 65536,1048576 --chunkSize 1024
+
+import os
+import sys
+import zlib
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from httpStandIn import StandInServer, HostSocket, useHostSockets
+from microWebCli import MicroWebCli
+
+# Memory allocated besides the chunk buffer (generator, memoryview slices, chunk
+# size lines, file object) (bytes)
+MEMORY_SLACK = 16*1024
+
+def openResponse(url, keepAlive):
+  c = MicroWebCli(url, keepAlive=keepAlive)
+  c.OpenRequest()
+  return c.GetResponse()
+
+def iterContent(url, keepAlive, chunkSize):
+  # (peak bytes, CRC-32, length) of the content read with IterContent
+  r = openResponse(url, keepAlive)
+  tracemalloc.start()
+  crc = 0
+  length = 0
+  for part in r.IterContent(chunkSize):
+    crc = zlib.crc32(part, crc)
+    length = length + len(part)
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return peak, crc, length
+
+def writeContentToFile(url, keepAlive, path):
+  r = openResponse(url, keepAlive)
+  tracemalloc.start()
+  r.WriteContentToFile(path)
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  with open(path, 'rb') as f:
+    data = f.read()
+  return peak, zlib.crc32(data), len(data)
+
+def readContent(url, keepAlive):
+  r = openResponse(url, keepAlive)
+  HostSocket.maxReadSize = 0
+  tracemalloc.start()
+  data = r.ReadContent()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return peak, zlib.crc32(data), len(data)
+
+def main():
+  parser = argparse.ArgumentParser(description='Memory of the streamed response content of MicroWebCli')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--sizes', default='65536,1048576')
+  parser.add_argument('--chunkSize', type=int, default=1024)
+  config = parser.parse_args()
+  useHostSockets()
+  rnd = random.Random(config.seed)
+  sizes = [int(size) for size in config.sizes.split(',')]
+  bodies = {size: bytes(rnd.getrandbits(8) for i in range(size)) for size in sizes}
+
+  # Chunks of the chunked content not aligned with the chunk size of IterContent
+  routes = {}
+  for size, body in bodies.items():
+    for framing in ('length', 'chunked', 'close'):
+      routes['/{}/{:d}'.format(framing, size)] = {'body': body, 'framing': framing, 'chunk': 3*config.chunkSize + 17}
+  server = StandInServer(routes)
+  try:
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, 'content.bin')
+      for framing in ('length', 'chunked', 'close'):
+        peaks = {'IterContent': [], 'WriteContentToFile': []}
+        for size in sizes:
+          url = server.url + '{}/{:d}'.format(framing, size)
+          expected = (zlib.crc32(bodies[size]), size)
+          for keepAlive in (False, True):
+            for name, peak, crc, length in (('IterContent',) + iterContent(url, keepAlive, config.chunkSize),
+                                            ('WriteContentToFile',) + writeContentToFile(url, keepAlive, path)):
+              assert (crc, length) == expected, (framing, size, name)
+              assert peak <= config.chunkSize + MEMORY_SLACK, (framing, size, name, peak)
+              peaks[name].append(peak)
+            peak, crc, length = readContent(url, keepAlive)
+            assert (crc, length) == expected, (framing, size, 'ReadContent')
+            assert HostSocket.maxReadSize is not None and HostSocket.maxReadSize <= MicroWebCli.ContentPartMaxSize, HostSocket.maxReadSize
+          print("[INFO] {:7s} content of {:7d} bytes: ReadContent peak {:8d} bytes (reads of at most {:d} bytes)".format(
+            framing, size, peak, HostSocket.maxReadSize))
+        # Streaming: the same peak whatever the size of the content
+        for name in peaks:
+          assert max(peaks[name]) - min(peaks[name]) <= config.chunkSize, (framing, name, peaks[name])
+        print("[INFO] {:7s} content: OK (peak IterContent {:d}-{:d} bytes, WriteContentToFile {:d}-{:d} bytes, chunks of {:d} bytes)".format(
+          framing, min(peaks['IterContent']), max(peaks['IterContent']), min(peaks['WriteContentToFile']), max(peaks['WriteContentToFile']), config.chunkSize))
+  finally:
+    server.stop()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,138 @@
+# Checks of lib/joinAccept.py: round trip of the binary and text #JOINACC#,
+# fuzzing of the parser, and size and air time of both formats (host side, Python 3)
+#
+# Example:
+#   python3 tools/joinAcceptCheck.py --fuzz 200000
+
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from joinAccept import parseJoinAccept, packJoinAccept, formatJoinAccept, JOINACC_MAGIC, MAX_DURATION_OF_PERIOD
+from caraScheduler import createResourceBlocksLists, parseLoadHints, convertSFtoDR, CARASchedule
+from LoRaAirTimeCalc import airtime
+
+def legacyParse(data):
+  # Previous receiveJoinAccept() parsing (valid text #JOINACC# only)
+  fields = data.decode('utf-8').split()
+  caraEnabled = int(fields[1])
+  if caraEnabled != 1:
+    return (caraEnabled, int(fields[2]), None, None)
+  algorithm = int(fields[4]) if len(fields) > 4 else None
+  loadHints = parseLoadHints(fields[5]) if len(fields) > 5 else None
+  return (caraEnabled, int(fields[2]), int(fields[3]), algorithm, loadHints)
+
+def randomJoinAccept(rnd):
+  caraEnabled = rnd.choice((0, 1))
+  if caraEnabled == 0:
+    return {'caraEnabled': 0, 'initialResourceBlock': rnd.randrange(6)}
+  sfMask = rnd.randrange(1, 64)
+  joinAccept = {'caraEnabled': 1, 'initialResourceBlock': rnd.randrange(8*bin(sfMask).count('1')), 'sfMask': sfMask}
+  if rnd.random() < 0.5:
+    joinAccept['algorithm'] = rnd.randrange(4)
+  if rnd.random() < 0.5:
+    joinAccept['durationOfPeriod'] = rnd.randrange(1, 60000)/1000
+  if rnd.random() < 0.5:
+    joinAccept['loadHints'] = [rnd.randrange(256) for i in range(6)]
+  return joinAccept
+
+def checkRoundTrip(rnd, count):
+  for i in range(count):
+    joinAccept = randomJoinAccept(rnd)
+    parsed = parseJoinAccept(packJoinAccept(**joinAccept))
+    assert parsed is not None, joinAccept
+    for key in joinAccept:
+      assert parsed[key] == joinAccept[key], (key, joinAccept, parsed)
+
+    # Text form: same values as the previous parsing (without durationOfPeriod)
+    joinAccept.pop('durationOfPeriod', None)
+    if 'loadHints' in joinAccept and 'algorithm' not in joinAccept:
+      joinAccept.pop('loadHints')
+    text = formatJoinAccept(**joinAccept)
+    parsed = parseJoinAccept(text)
+    assert parsed is not None, text
+    for key in joinAccept:
+      assert parsed[key] == joinAccept[key], (key, text, parsed)
+    legacy = legacyParse(text)
+    assert legacy[0:2] == (parsed['caraEnabled'], parsed['initialResourceBlock'])
+    if parsed['caraEnabled'] == 1:
+      assert legacy[2:] == (parsed['sfMask'], parsed['algorithm'], parsed['loadHints'])
+  print("[INFO] Round trip: OK ({:d} binary and text #JOINACC#)".format(count))
+
+def useJoinAccept(joinAccept):
+  # What receiveJoinAccept() does with a parsed #JOINACC#
+  durationOfPeriod = joinAccept['durationOfPeriod']
+  if durationOfPeriod is not None:
+    assert 0 < durationOfPeriod <= MAX_DURATION_OF_PERIOD, durationOfPeriod
+  if joinAccept['caraEnabled'] == 1:
+    channelsList, sfList = createResourceBlocksLists(joinAccept['sfMask'])
+    convertSFtoDR(sfList[joinAccept['initialResourceBlock']])
+    # Schedule of the assignment (the main loop and the downlink dispatcher)
+    schedule = CARASchedule(joinAccept['sfMask'], joinAccept['initialResourceBlock'], durationOfPeriod or 5.0, joinAccept['algorithm'] or 0)
+    schedule.parametersAt(1000.0)
+  else:
+    assert 0 <= joinAccept['initialResourceBlock'] <= 5
+
+def checkFuzz(rnd, count):
+  # Random bytes, and valid downlinks with random changes or truncated: the parser
+  # never raises, and accepted #JOINACC# can be used. A duration of period of 0
+  # or above MAX_DURATION_OF_PERIOD is rejected
+  for durationOfPeriod in (0, 0.0004, MAX_DURATION_OF_PERIOD + 0.001, 65.535):
+    for caraEnabled, initialResourceBlock in ((1, 3), (0, 5)):
+      data = packJoinAccept(caraEnabled, initialResourceBlock, 63, 1, durationOfPeriod)
+      assert parseJoinAccept(data) is None, (caraEnabled, durationOfPeriod)
+  assert parseJoinAccept(packJoinAccept(1, 3, 63, 1, MAX_DURATION_OF_PERIOD))['durationOfPeriod'] == MAX_DURATION_OF_PERIOD
+  valid = [packJoinAccept(**randomJoinAccept(rnd)) for i in range(100)] + [formatJoinAccept(1, 3, 63, 2, [10, 20]), formatJoinAccept(0, 5)]
+  # Valid ones with a duration of period of 1 ms (0 if the fuzzing changes its low byte)
+  valid = valid + [packJoinAccept(1, rnd.randrange(48), 63, rnd.randrange(4), 0.001), packJoinAccept(0, 5, 0, None, 0.001)]
+  accepted = 0
+  for i in range(count):
+    kind = i % 3
+    if kind == 0:
+      data = bytes(rnd.randrange(256) for j in range(rnd.randrange(0, 65)))
+      if rnd.random() < 0.5 and len(data) > 0:
+        data = bytes([JOINACC_MAGIC]) + data[1:]
+    elif kind == 1:
+      data = bytearray(rnd.choice(valid))
+      for j in range(rnd.randrange(1, 4)):
+        data[rnd.randrange(len(data))] = rnd.randrange(256)
+      data = bytes(data)
+    else:
+      data = rnd.choice(valid)
+      data = data[0:rnd.randrange(len(data))]
+    joinAccept = parseJoinAccept(data)
+    if joinAccept is not None:
+      useJoinAccept(joinAccept)
+      accepted = accepted + 1
+  print("[INFO] Fuzzing: OK ({:d} downlinks, {:d} accepted)".format(count, accepted))
+
+def compareSizes():
+  cases = (
+    ('CARA disabled', {'caraEnabled': 0, 'initialResourceBlock': 5}),
+    ('CARA enabled', {'caraEnabled': 1, 'initialResourceBlock': 17, 'sfMask': 63}),
+    ('+ algorithm', {'caraEnabled': 1, 'initialResourceBlock': 17, 'sfMask': 63, 'algorithm': 3}),
+    ('+ load hints', {'caraEnabled': 1, 'initialResourceBlock': 17, 'sfMask': 63, 'algorithm': 3, 'loadHints': [120, 85, 40, 22, 10, 5]}),
+  )
+  for name, joinAccept in cases:
+    text = len(formatJoinAccept(**joinAccept))
+    binary = len(packJoinAccept(**joinAccept))
+    # LoRaWAN frame: 13 bytes of MAC header, FHDR, FPort and MIC
+    print("[INFO] {:14s}: text {:2d} bytes, binary {:2d} bytes, air time at SF12 {:.3f} s -> {:.3f} s".format(
+      name, text, binary, airtime(13 + text, 12), airtime(13 + binary, 12)))
+
+def main():
+  parser = argparse.ArgumentParser(description='Checks of the binary and text #JOINACC#')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--roundTrips', type=int, default=20000)
+  parser.add_argument('--fuzz', type=int, default=200000)
+  config = parser.parse_args()
+  rnd = random.Random(config.seed)
+  checkRoundTrip(rnd, config.roundTrips)
+  checkFuzz(rnd, config.fuzz)
+  compareSizes()
+
+if __name__ == '__main__':
+  main()
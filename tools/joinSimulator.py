@@ -0,0 +1,119 @@
+# Simulation of the CARA join (#JOINREQ# / #JOINACC#) after a gateway outage
+# (host side, Python 3)
+#
+# All the devices start transmitting their JOINREQ within startSpread seconds
+# (e.g. when the gateway comes back), on a random default channel, and retransmit
+# following lib/joinReqPolicy.py until a JOINREQ is received without collision
+# (the #JOINACC# is then received replyDelay seconds after the JOINREQ).
+#
+# Example (fixed and backoff policies for 1000 devices):
+#   python3 tools/joinSimulator.py --devices 1000
+
+import os
+import sys
+import heapq
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from joinReqPolicy import JoinReqPolicy
+from caraScheduler import convertDRtoSF
+from LoRaAirTimeCalc import airtime
+
+# Default channels of EU868 (JOINREQ is sent before CARA assigns the channels)
+DEFAULT_CHANNELS = (868100000, 868300000, 868500000)
+
+DEFAULT_CONFIG = {
+  'devices': 1000,
+  'seed': 1,
+  'startSpread': 1.0,
+  'replyDelay': 1.0,
+  'payloadsize': 9,
+  'rtxTime': 5.0,
+  'minTime': 1.0,
+  'maxTime': 60.0,
+  'minDR': 3,
+  'escalateEvery': 0,
+  'maxSimulatedTime': 3600.0,
+}
+
+EVENT_END_OF_JOINREQ = 0
+EVENT_JOINACC = 1
+EVENT_JOINREQ = 2
+
+def simulateJoin(config, backoff):
+  config = dict(DEFAULT_CONFIG, **config)
+  rnd = random.Random(config['seed'])
+
+  policies = []
+  events = []
+  for i in range(config['devices']):
+    policies.append(JoinReqPolicy(rnd.random, config['rtxTime'], backoff, config['maxTime'], config['minTime'], 5, config['minDR'], config['escalateEvery']))
+    events.append((rnd.random()*config['startSpread'], EVENT_JOINREQ, i, None))
+  heapq.heapify(events)
+
+  # Frames on air per (channel, SF): [end, collided]
+  active = {}
+  joinTime = [None]*config['devices']
+  deadline = [None]*config['devices']
+  joinReqs = 0
+  while events:
+    t, event, i, frame = heapq.heappop(events)
+    if t > config['maxSimulatedTime']:
+      break
+    if joinTime[i] is not None:
+      continue
+
+    if event == EVENT_JOINREQ:
+      if deadline[i] is not None and t < deadline[i]:
+        continue
+      policy = policies[i]
+      sf = convertDRtoSF(policy.dataRate())
+      key = (DEFAULT_CHANNELS[rnd.randrange(len(DEFAULT_CHANNELS))], sf)
+      frames = [f for f in active.get(key, []) if f[0] > t]
+      frame = [t + airtime(config['payloadsize'], sf), False]
+      for other in frames:
+        other[1] = True
+        frame[1] = True
+      frames.append(frame)
+      active[key] = frames
+      joinReqs += 1
+      heapq.heappush(events, (frame[0], EVENT_END_OF_JOINREQ, i, frame))
+      deadline[i] = t + policy.nextTimeout()
+      heapq.heappush(events, (deadline[i], EVENT_JOINREQ, i, None))
+
+    elif event == EVENT_END_OF_JOINREQ:
+      if not frame[1]:
+        heapq.heappush(events, (t + config['replyDelay'], EVENT_JOINACC, i, None))
+
+    elif event == EVENT_JOINACC:
+      joinTime[i] = t
+
+  joined = sorted(x for x in joinTime if x is not None)
+  def percentile(p):
+    return joined[min(len(joined) - 1, int(p*len(joined)))] if joined else float('nan')
+  return {
+    'backoff': backoff,
+    'joined': len(joined),
+    'joinReqs': joinReqs,
+    'mean': sum(joined)/len(joined) if joined else float('nan'),
+    'p50': percentile(0.5),
+    'p90': percentile(0.9),
+    'p99': percentile(0.99),
+    'max': joined[-1] if joined else float('nan'),
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description='Simulation of the CARA join after a gateway outage')
+  for name in sorted(DEFAULT_CONFIG):
+    parser.add_argument('--' + name, type=type(DEFAULT_CONFIG[name]), default=DEFAULT_CONFIG[name])
+  config = vars(parser.parse_args())
+
+  for backoff in (False, True):
+    result = simulateJoin(config, backoff)
+    print("[INFO] {} policy: {:d}/{:d} devices joined, {:d} JOINREQs sent".format('Backoff' if backoff else 'Fixed', result['joined'], config['devices'], result['joinReqs']))
+    print("[INFO]   join completion time (s): mean {:.1f}, p50 {:.1f}, p90 {:.1f}, p99 {:.1f}, max {:.1f}".format(result['mean'], result['p50'], result['p90'], result['p99'], result['max']))
+
+if __name__ == '__main__':
+  main()
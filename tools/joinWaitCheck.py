@@ -0,0 +1,185 @@
+# Reaction latency and wake ups of the #JOINACC# wait of main.py (waitForJoinAccept
+# of lib/joinWait.py, called by receiveJoinAccept), with a fake LoRa socket and a
+# fake select.poll in virtual time (host side, Python 3)
+#
+# The CARA server answers each #JOINREQ# with a #JOINACC# replyDelay seconds
+# (+-20%) later, except for the lost ones (joinAccLoss); other downlinks (application
+# data) are received every otherDownlinkPeriod seconds. Both loops follow
+# lib/joinReqPolicy.py and the ticks of MicroPython (utime.ticks_ms, which wraps
+# around every 2^30 ms; the boots start just before the wrap):
+#   poll:     waitForJoinAccept, select.poll on the socket until a downlink or the
+#             JOINREQ deadline
+#   polling:  previous loop of main.py, non-blocking recvfrom and time.sleep(0.1)
+# Latency: time from the #JOINACC# reception by the radio to its processing.
+#
+# Example:
+#   python3 tools/joinWaitCheck.py --joins 2000
+
+import os
+import sys
+import random
+import argparse
+import io
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from joinReqPolicy import JoinReqPolicy
+from joinAccept import parseJoinAccept, formatJoinAccept
+from joinWait import waitForJoinAccept
+
+DEFAULT_CONFIG = {
+  'joins': 2000,
+  'seed': 1,
+  'replyDelay': 1.5,
+  'joinAccLoss': 0.3,
+  'otherDownlinkPeriod': 20.0,
+  'rtxTime': 5.0,
+  'minTime': 1.0,
+  'maxTime': 60.0,
+}
+
+# utime.ticks_ms of MicroPython (ports with 30-bit small ints)
+TICKS_PERIOD = 1 << 30
+
+def ticks_add(ticks, delta):
+  return (ticks + delta) % TICKS_PERIOD
+
+def ticks_diff(ticks1, ticks2):
+  return ((ticks1 - ticks2 + TICKS_PERIOD//2) % TICKS_PERIOD) - TICKS_PERIOD//2
+
+class VirtualClock:
+  """ virtual time (ms) and the ticks counter of the device """
+
+  def __init__(self, startTicks):
+    self.t = 0
+    self.startTicks = startTicks
+
+  def ticks_ms(self):
+    return (self.startTicks + self.t) % TICKS_PERIOD
+
+  def sleep_ms(self, ms):
+    self.t = self.t + ms
+
+class FakeLoRaSocket:
+  """ LoRa socket of the device, with the CARA server answering the JOINREQ """
+
+  def __init__(self, clock, rnd, config):
+    self.clock = clock
+    self.rnd = rnd
+    self.config = config
+    # [(arrival (ms), data, port)] in time order
+    self.downlinks = []
+    period = int(1000*config['otherDownlinkPeriod'])
+    t = int(rnd.uniform(0, period))
+    while period > 0 and t < 3600000:
+      self.downlinks.append((t, b'application data', 10))
+      t = t + period
+    self.joinReqs = 0
+
+  def setblocking(self, flag):
+    pass
+
+  def send(self, data):
+    self.joinReqs = self.joinReqs + 1
+    if self.rnd.random() >= self.config['joinAccLoss']:
+      arrival = self.clock.t + int(1000*self.config['replyDelay']*self.rnd.uniform(0.8, 1.2))
+      self.downlinks.append((arrival, formatJoinAccept(1, 3, 63), 2))
+      self.downlinks.sort(key=lambda downlink: downlink[0])
+
+  def nextArrival(self):
+    return self.downlinks[0][0] if len(self.downlinks) > 0 else None
+
+  def recvfrom(self, size):
+    if len(self.downlinks) > 0 and self.downlinks[0][0] <= self.clock.t:
+      t, data, port = self.downlinks.pop(0)
+      self.received = t
+      return (data[0:size], port)
+    return (b'', 2)
+
+class FakePoll:
+  """ select.poll of the socket: returns when a downlink arrives or after timeout ms """
+
+  def __init__(self, clock, s):
+    self.clock = clock
+    self.s = s
+    self.calls = 0
+
+  def poll(self, timeout):
+    self.calls = self.calls + 1
+    arrival = self.s.nextArrival()
+    if arrival is not None and arrival <= self.clock.t + timeout:
+      self.clock.t = max(self.clock.t, arrival)
+      return [(self.s, 1)]
+    self.clock.sleep_ms(timeout)
+    return []
+
+def waitPoll(clock, s, policy):
+  # waitForJoinAccept of lib/joinWait.py: (wake ups, latency (ms))
+  poller = FakePoll(clock, s)
+  joinReqs = []
+  downlinks = []
+  with contextlib.redirect_stdout(io.StringIO()):
+    joinAccept, size, wakeups = waitForJoinAccept(s, poller, policy, clock.ticks_ms, ticks_add, ticks_diff,
+                                                  lambda: joinReqs.append(policy.dataRate()), lambda data, port: downlinks.append(port))
+  assert joinAccept['caraEnabled'] == 1 and size == len(formatJoinAccept(1, 3, 63))
+  # DR of every JOINREQ set before it is sent, every downlink passed to onDownlink
+  assert len(joinReqs) == s.joinReqs and len(downlinks) == wakeups, (len(joinReqs), s.joinReqs, len(downlinks), wakeups)
+  return wakeups, clock.t - s.received
+
+def waitPolling(clock, s, rtxTime):
+  # Previous receiveJoinAccept of main.py: (wake ups, latency (ms))
+  wakeups = 0
+  timeToRetransmitJoinReq = True
+  while True:
+    if timeToRetransmitJoinReq:
+      s.send("#JOINREQ#")
+      timeToRetransmitJoinReq = False
+      timeJoinReq1 = clock.ticks_ms()
+    data, port = s.recvfrom(64)
+    if len(data) > 0 and parseJoinAccept(data) is not None:
+      return wakeups, clock.t - s.received
+    clock.sleep_ms(100)
+    wakeups = wakeups + 1
+    if ticks_diff(clock.ticks_ms(), timeJoinReq1) > 1000*rtxTime:
+      timeToRetransmitJoinReq = True
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(p*len(values)))]
+
+def main():
+  parser = argparse.ArgumentParser(description='Reaction latency and wake ups of the #JOINACC# wait')
+  for name in sorted(DEFAULT_CONFIG):
+    parser.add_argument('--' + name, type=type(DEFAULT_CONFIG[name]), default=DEFAULT_CONFIG[name])
+  config = vars(parser.parse_args())
+  rnd = random.Random(config['seed'])
+
+  results = {}
+  for name in ('poll', 'polling'):
+    latencies = []
+    wakeups = []
+    joinReqs = 0
+    for i in range(config['joins']):
+      # Boots within a minute of the wrap of the ticks counter
+      clock = VirtualClock(TICKS_PERIOD - rnd.randrange(60000))
+      s = FakeLoRaSocket(clock, rnd, config)
+      if name == 'poll':
+        policy = JoinReqPolicy(rnd.random, config['rtxTime'], True, config['maxTime'], config['minTime'])
+        w, latency = waitPoll(clock, s, policy)
+      else:
+        w, latency = waitPolling(clock, s, config['rtxTime'])
+      wakeups.append(w)
+      latencies.append(latency)
+      joinReqs = joinReqs + s.joinReqs
+    results[name] = (latencies, wakeups)
+    print("[INFO] {:7s}: latency mean {:6.1f} ms, max {:5d} ms; wake ups per join mean {:6.1f}, p99 {:4d}; {:.2f} JOINREQ per join".format(
+      name, sum(latencies)/len(latencies), max(latencies), sum(wakeups)/len(wakeups), percentile(wakeups, 0.99), joinReqs/config['joins']))
+
+  # Processed as soon as it is received, waking up only for the downlinks
+  latencies, wakeups = results['poll']
+  assert max(latencies) == 0, max(latencies)
+  assert sum(wakeups)/len(wakeups) < sum(results['polling'][1])/len(results['polling'][1])/10
+
+if __name__ == '__main__':
+  main()
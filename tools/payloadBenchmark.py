@@ -0,0 +1,103 @@
+# Allocations per uplink payload of lib/payloadBuilder.py and of the previous
+# generateMessage() (string concatenation, encoded again by s.send), measured
+# with tracemalloc (host side, Python 3)
+#
+# For every message, the bytes allocated (peak of the traced memory during the
+# call) are measured, twice:
+#   small ints:  message counters and timestamps up to 256, the ints that CPython
+#                does not allocate (as MicroPython up to 2^30): the builder must
+#                allocate 0 bytes
+#   all values:  message counters 0...messages and a current timestamp; CPython
+#                allocates every int greater than 256 (the digits and bytes
+#                computed by the builder), which the device does not
+# The time per message is the one of CPython (the builder writes byte by byte,
+# so it is slower here than a string concatenation in C).
+#
+# Example:
+#   python3 tools/payloadBenchmark.py --messages 20000
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from payloadBuilder import createPayloadBuilder
+
+def generateMessage(messageCounter):
+  # Previous main.py generateMessage()
+  if (messageCounter < 10):
+    message = "Testing data....." + str(messageCounter)
+  elif (messageCounter < 100):
+    message = "Testing data...." + str(messageCounter)
+  elif (messageCounter < 1000):
+    message = "Testing data..." + str(messageCounter)
+  elif (messageCounter < 10000):
+    message = "Testing data.." + str(messageCounter)
+  else:
+    message = "Testing data." + str(messageCounter)
+
+  return message
+
+def legacyPayload(messageCounter):
+  # s.send(message) encodes the string
+  return generateMessage(messageCounter).encode()
+
+# Largest int that CPython does not allocate (cached small ints)
+MAX_SMALL_INT = 256
+
+def measure(build, counters):
+  # (mean bytes allocated per message, max bytes, messages with allocations)
+  total = 0
+  maximum = 0
+  allocating = 0
+  messages = len(counters)
+  tracemalloc.start()
+  for messageCounter in counters:
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    build(messageCounter)
+    allocated = tracemalloc.get_traced_memory()[1] - before
+    total = total + allocated
+    maximum = max(maximum, allocated)
+    if allocated > 0:
+      allocating = allocating + 1
+  tracemalloc.stop()
+  return (total/messages, maximum, allocating)
+
+def timing(build, messages):
+  start = time.perf_counter()
+  for messageCounter in range(messages):
+    build(messageCounter)
+  return (time.perf_counter() - start)/messages*1e6
+
+def main():
+  parser = argparse.ArgumentParser(description='Allocations per uplink payload (tracemalloc)')
+  parser.add_argument('--messages', type=int, default=20000)
+  config = parser.parse_args()
+
+  text = createPayloadBuilder('text')
+  binary = createPayloadBuilder('binary')
+  for c in range(0, 100000, 7):
+    assert bytes(text.build(c)) == legacyPayload(c)
+
+  # (name, build with small ints, build with all values)
+  candidates = (
+    ('generateMessage + encode', legacyPayload, legacyPayload),
+    ('PayloadBuilder text', text.build, text.build),
+    ('PayloadBuilder binary', lambda c: binary.build(c, c), lambda c: binary.build(c, 1709251200 + c)),
+  )
+  smallCounters = [i % (MAX_SMALL_INT + 1) for i in range(config.messages)]
+  for name, buildSmall, build in candidates:
+    small = measure(buildSmall, smallCounters)
+    mean, maximum, allocating = measure(build, range(config.messages))
+    print("[INFO] {:26s}: small ints {:6.1f} bytes allocated per message (max {:d}); all values {:6.1f} bytes (max {:d}, {:5.1f}% messages allocating); {:.2f} us per message".format(
+      name, small[0], small[1], mean, maximum, 100*allocating/config.messages, timing(build, config.messages)))
+    if name.startswith('PayloadBuilder'):
+      # Nothing allocated besides the ints of CPython
+      assert small[1] == 0, (name, small)
+
+if __name__ == '__main__':
+  main()
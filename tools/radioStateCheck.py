@@ -0,0 +1,102 @@
+# Checks of the cache of the radio configuration (lib/radioState.py) with a fake
+# LoRa radio and socket recording the calls, host side, Python 3
+#
+# Sequences of `uplinks` (frequency, DR) as in main.py: fixed channel and DR, a
+# few uplinks per resource block, random blocks, and an invalidation of the
+# channels (join). After each uplink the fake radio must be programmed with the
+# requested frequency (all the channels) and DR; callsIssued must be the number
+# of calls received by the fake radio and callsIssued + callsSaved the calls
+# without the cache.
+#
+# Example:
+#   python3 tools/radioStateCheck.py --uplinks 10000
+
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+import radioState as radioStateModule
+from radioState import RadioState, NO_CHANNELS
+
+FREQUENCIES = (868100000, 868300000, 868500000, 867100000, 867300000, 867500000, 867700000, 867900000)
+
+class FakeSocketModule:
+  """ constants of the socket module of the Pycom firmware """
+  SOL_LORA = 6
+  SO_DR = 3
+
+class FakeLoRa:
+  """ network.LoRa: frequency of each channel """
+
+  def __init__(self):
+    self.channels = {}
+    self.calls = 0
+
+  def add_channel(self, index, frequency=None, dr_min=None, dr_max=None):
+    self.channels[index] = frequency
+    self.calls = self.calls + 1
+
+  def remove_channel(self, index):
+    self.channels.pop(index, None)
+
+class FakeLoRaSocket:
+  """ LoRa socket: DR set with setsockopt """
+
+  def __init__(self, dr):
+    self.dr = dr
+    self.calls = 0
+
+  def setsockopt(self, level, option, value):
+    assert (level, option) == (FakeSocketModule.SOL_LORA, FakeSocketModule.SO_DR)
+    self.dr = value
+    self.calls = self.calls + 1
+
+def sequence(rnd, name, uplinks):
+  # [(frequency, DR)] of the uplinks
+  if name == 'fixed channel and DR':
+    return [(FREQUENCIES[0], 5)]*uplinks
+  if name == 'blocks of 4 uplinks':
+    result = []
+    while len(result) < uplinks:
+      result = result + [(rnd.choice(FREQUENCIES), rnd.randrange(6))]*4
+    return result[0:uplinks]
+  return [(rnd.choice(FREQUENCIES), rnd.randrange(6)) for i in range(uplinks)]
+
+def check(rnd, name, uplinks):
+  lora = FakeLoRa()
+  s = FakeLoRaSocket(5)
+  radio = RadioState(lora, s, 5)
+  invalidateAt = uplinks//2
+  for i, (freq, dr) in enumerate(sequence(rnd, name, uplinks)):
+    if i == invalidateAt:
+      # Join: channels removed and the DR of the JOINREQ set
+      for channel in range(NO_CHANNELS):
+        lora.remove_channel(channel)
+      radio.invalidate()
+      radio.setDataRate(5)
+    radio.setTransmissionParameters(freq, dr)
+    assert lora.channels == {channel: freq for channel in range(NO_CHANNELS)} and s.dr == dr, (name, i)
+  assert radio.callsIssued == lora.calls + s.calls, (name, radio.callsIssued, lora.calls + s.calls)
+  assert radio.callsIssued + radio.callsSaved == (uplinks + 1)*(NO_CHANNELS + 1) - NO_CHANNELS, (name, radio.callsIssued, radio.callsSaved)
+  return radio
+
+def main():
+  parser = argparse.ArgumentParser(description='Cache of the radio configuration with a fake LoRa radio')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--uplinks', type=int, default=10000)
+  config = parser.parse_args()
+  radioStateModule.socket = FakeSocketModule
+  rnd = random.Random(config.seed)
+  for name in ('fixed channel and DR', 'blocks of 4 uplinks', 'random blocks'):
+    radio = check(rnd, name, config.uplinks)
+    print("[INFO] {:20s}: OK ({:d} calls issued, {:d} saved, {:.1f}% saved)".format(
+      name, radio.callsIssued, radio.callsSaved, 100*radio.callsSaved/(radio.callsIssued + radio.callsSaved)))
+  # Fixed channel and DR: only the first uplink and the one after the join program the channels
+  radio = check(rnd, 'fixed channel and DR', config.uplinks)
+  assert radio.callsIssued == 2*NO_CHANNELS, radio.callsIssued
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,149 @@
+# Lateness of the uplinks of the asynchronous runtime (lib/caraRuntime.py) under
+# concurrent load, with stand-ins of the LoRa socket, the radio and the CARA web
+# server (host side, Python 3 asyncio, real time)
+#
+# Scenarios:
+#   idle:       only the scheduler, radio RX and telemetry tasks
+#   load:       also downlinks (downlinkPeriod), refresh of the CARA parameters
+#               (HTTP of httpTime seconds, in a thread) and a CPU task (cpuBurst
+#               seconds between awaits)
+#   blocking:   as load, but the HTTP request blocks the event loop (as a
+#               blocking call in a task would)
+# The times are shortened (fixedTime, randomTime, durationOfPeriod) so each
+# scenario takes `duration` seconds.
+#
+# Example:
+#   python3 tools/runtimeBenchmark.py --duration 20
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from caraRuntime import CARARuntime, AsyncLoRaSocket
+from caraParameters import CARAParameters
+from caraScheduler import CARASchedule
+from txQueue import TxQueue, DutyCycleLedger
+
+DEFAULT_CONFIG = {
+  'seed': 1,
+  'duration': 15.0,
+  'fixedTime': 0.3,
+  'randomTime': 0.3,
+  'durationOfPeriod': 2.0,
+  'telemetryPeriod': 0.2,
+  'downlinkPeriod': 0.5,
+  'refreshPeriod': 1.0,
+  'httpTime': 0.3,
+  'cpuBurst': 0.005,
+}
+
+class FakeLoRaSocket:
+  """ non-blocking LoRa socket: downlinks every downlinkPeriod seconds """
+
+  def __init__(self, downlinkPeriod):
+    self.downlinkPeriod = downlinkPeriod
+    self.nextDownlink = time.monotonic() + downlinkPeriod if downlinkPeriod > 0 else None
+    self.sent = []
+
+  def setblocking(self, flag):
+    pass
+
+  def bind(self, port):
+    pass
+
+  def send(self, data):
+    self.sent.append((time.monotonic(), bytes(data)))
+
+  def recvfrom(self, size):
+    if self.nextDownlink is not None and time.monotonic() >= self.nextDownlink:
+      self.nextDownlink = self.nextDownlink + self.downlinkPeriod
+      return (b'\xca\x01\x01\x00\x3f', 2)
+    return (b'', 2)
+
+class FakeRadioState:
+  """ radioState.RadioState without the radio """
+
+  def __init__(self):
+    self.calls = 0
+
+  def setTransmissionParameters(self, freq, dr):
+    self.calls = self.calls + 1
+
+def newParameters(config):
+  params = CARAParameters()
+  params.randomTimeForJoining = 0.0
+  params.fixedTime = config['fixedTime']
+  params.randomTime = config['randomTime']
+  params.durationOfPeriod = config['durationOfPeriod']
+  params.avoidBorderEffect = 1
+  params.borderEffectGuardTime = 0.01
+  return params
+
+async def cpuLoad(burst):
+  # Task computing burst seconds between awaits
+  while True:
+    end = time.perf_counter() + burst
+    while time.perf_counter() < end:
+      pass
+    await asyncio.sleep(0)
+
+async def blockingRefresh(config, runtime):
+  # Refresh with the HTTP request in the event loop (no thread)
+  while True:
+    await asyncio.sleep(config['refreshPeriod'])
+    time.sleep(config['httpTime'])
+    runtime.pendingParameters = newParameters(config)
+    runtime.refreshes = runtime.refreshes + 1
+
+async def scenario(name, config):
+  rnd = random.Random(config['seed'])
+  start = time.monotonic()
+  now = lambda: int(1000000*(time.monotonic() - start))
+  bLoad = name != 'idle'
+  socket = FakeLoRaSocket(config['downlinkPeriod'] if bLoad else 0)
+  schedule = CARASchedule(1, 0, config['durationOfPeriod'])
+  def fetchParameters():
+    time.sleep(config['httpTime'])
+    return newParameters(config)
+  counter = [0]
+  def sample():
+    counter[0] = counter[0] + 1
+    return counter[0].to_bytes(4, 'big') + bytes(14)
+  runtime = CARARuntime(AsyncLoRaSocket(socket), FakeRadioState(), schedule, newParameters(config), TxQueue(), DutyCycleLedger(), now, rnd.random,
+                        lambda period: CARASchedule(1, 0, period), None,
+                        fetchParameters if name == 'load' else None, config['refreshPeriod'],
+                        sample, config['telemetryPeriod'], None, True)
+  tasks = [runtime.run()]
+  if bLoad:
+    tasks.append(cpuLoad(config['cpuBurst']))
+  if name == 'blocking':
+    tasks.append(blockingRefresh(config, runtime))
+  try:
+    await asyncio.wait_for(asyncio.gather(*tasks), config['duration'])
+  except asyncio.TimeoutError:
+    pass
+  return runtime
+
+def main():
+  parser = argparse.ArgumentParser(description='Uplink lateness of the asynchronous runtime under load')
+  for name in sorted(DEFAULT_CONFIG):
+    parser.add_argument('--' + name, type=type(DEFAULT_CONFIG[name]), default=DEFAULT_CONFIG[name])
+  config = vars(parser.parse_args())
+
+  for name in ('idle', 'load', 'blocking'):
+    runtime = asyncio.run(scenario(name, config))
+    samples = sorted(runtime.latenessSamples())
+    if len(samples) == 0:
+      print("[INFO] {:8s}: no uplinks".format(name))
+      continue
+    print("[INFO] {:8s}: {:3d} uplinks, lateness mean {:6.2f} ms, p50 {:6.2f} ms, p99 {:6.2f} ms, max {:6.2f} ms ({:d} downlinks, {:d} refreshes, {:d} payloads queued, {:d} held by the border effect)".format(
+      name, runtime.framesSent, 1000*sum(samples)/len(samples), 1000*samples[len(samples)//2], 1000*samples[min(len(samples) - 1, int(0.99*len(samples)))],
+      1000*runtime.maxLateness, runtime.downlinksReceived, runtime.refreshes, runtime.txQueue.count, runtime.framesBorderHeld))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,62 @@
+# Micro-benchmark of the resource block selection (host side, Python 3)
+#
+# Compares assignmentAlgorithm1 (lists of channels and SFs) with the packed
+# CARASchedule of lib/caraScheduler.py for random transmission times spread over
+# several days, and checks that both give the same channel and DR.
+#
+# Example:
+#   python3 tools/scheduleBenchmark.py --lookups 1000000 --days 7
+
+import os
+import sys
+import random
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from caraScheduler import createResourceBlocksLists, assignmentAlgorithm1, CARASchedule
+
+def main():
+  parser = argparse.ArgumentParser(description='Micro-benchmark of the CARA resource block selection')
+  parser.add_argument('--lookups', type=int, default=200000)
+  parser.add_argument('--days', type=float, default=7.0)
+  parser.add_argument('--sfMask', type=int, default=63)
+  parser.add_argument('--initialResourceBlock', type=int, default=5)
+  parser.add_argument('--durationOfPeriod', type=float, default=5.0)
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--repeat', type=int, default=5)
+  args = parser.parse_args()
+
+  rnd = random.Random(args.seed)
+  times = [rnd.random()*args.days*86400.0 for i in range(args.lookups)]
+  timesUs = [int(round(t*1000000)) for t in times]
+  channelsList, sfList = createResourceBlocksLists(args.sfMask)
+  schedule = CARASchedule(args.sfMask, args.initialResourceBlock, args.durationOfPeriod)
+
+  for t in times[:10000]:
+    if schedule.parametersAt(t) != assignmentAlgorithm1(t, channelsList, sfList, args.initialResourceBlock, args.durationOfPeriod):
+      raise AssertionError("Different resource block at t={:.3f}".format(t))
+
+  def lists():
+    for t in times:
+      assignmentAlgorithm1(t, channelsList, sfList, args.initialResourceBlock, args.durationOfPeriod)
+
+  def table():
+    parametersAt = schedule.parametersAt
+    for t in times:
+      parametersAt(t)
+
+  def tableUs():
+    # (main.py and caraRuntime.py, integer us of the time base)
+    parametersAtUs = schedule.parametersAtUs
+    for us in timesUs:
+      parametersAtUs(us)
+
+  for name, function in (('assignmentAlgorithm1', lists), ('CARASchedule.parametersAt', table), ('CARASchedule.parametersAtUs', tableUs)):
+    elapsed = min(timeit.repeat(function, number=1, repeat=args.repeat))
+    print("[INFO] {:s}: {:.3f} s, {:.0f} ns per lookup".format(name, elapsed, 1e9*elapsed/args.lookups))
+  print("[INFO] Resource blocks table: {:d} bytes for {:.0f} periods".format(sum(len(a)*a.itemsize for a in (schedule.table, schedule.freqs, schedule.drs)), args.days*86400.0/args.durationOfPeriod))
+
+if __name__ == '__main__':
+  main()
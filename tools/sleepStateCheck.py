@@ -0,0 +1,111 @@
+# Checks of the state kept across deep sleep (lib/sleepState.py) on the host
+# (Python 3): save and load, invalid files, and the CARA schedule and time base
+# restored after waking up.
+#
+# Example:
+#   python3 tools/sleepStateCheck.py
+
+import os
+import sys
+import json
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from sleepState import saveSleepState, loadSleepState, clearSleepState, EnergyEstimate, SLEEP_STATE_KEYS, SLEEP_STATE_VERSION
+from caraScheduler import CARASchedule, knownAssignmentAlgorithm
+from caraClock import CARAClock, rtcToUs, usToRtc
+
+class VirtualRTC:
+  """ machine.RTC with a fixed time """
+
+  def __init__(self, us):
+    self.us = us
+
+  def now(self):
+    return usToRtc(self.us)
+
+  def init(self, datetime):
+    self.us = rtcToUs(datetime)
+
+def exampleState():
+  energy = EnergyEstimate()
+  energy.add(airTime=0.4, awakeTime=35.2, sleepTime=3600.0)
+  return {
+    'messageCounter': 42, 'timeLastTransmissionUs': 86395250000, 'nextRandNo': 97.5,
+    'randomTimeForJoining': 60.0, 'fixedTime': 60.0, 'randomTime': 60.0, 'durationOfPeriod': 5.0, 'durationOfPeriodFromJoinAccept': True,
+    'avoidBorderEffect': 1, 'borderEffectGuardTime': 0.1,
+    'caraEnabled': 1, 'initialResourceBlock': 17, 'sfMask': 63, 'selectedDR': 3,
+    'algorithm': 1, 'loadHints': [10, 5, 0, 0, 0, 0], 'framesDeferred': 3, 'framesBorderHeld': 1, 'frameHeldAtBorder': True,
+    'epochDayUs': rtcToUs((2021, 6, 1, 0, 0, 0, 0, None)), 'wakeUpUs': rtcToUs((2021, 6, 2, 0, 1, 32, 750000, None)), 'energy': energy.asList(),
+    'dutyCycle': [[1, 86300.5, 1.482], [2, 86390.0, 0.071]], 'txQueue': [list(b'Testing data...41')],
+  }
+
+def checkRoundTrip(path):
+  state = exampleState()
+  saveSleepState(state, path)
+  loaded = loadSleepState(path)
+  assert loaded is not None
+  for key in SLEEP_STATE_KEYS:
+    assert loaded[key] == state[key], key
+  assert not os.path.exists(path + '.tmp')
+  # Saving again replaces the file
+  state['messageCounter'] = 43
+  saveSleepState(state, path)
+  assert loadSleepState(path)['messageCounter'] == 43
+  print("[INFO] Save and load: OK ({:d} bytes)".format(os.path.getsize(path)))
+
+def checkInvalid(path):
+  clearSleepState(path)
+  assert loadSleepState(path) is None
+  with open(path, 'w') as f:
+    f.write('{"messageCounter": 4')
+  assert loadSleepState(path) is None
+  state = exampleState()
+  state['version'] = SLEEP_STATE_VERSION + 1
+  with open(path, 'w') as f:
+    f.write(json.dumps(state))
+  assert loadSleepState(path) is None
+  state = exampleState()
+  del state['sfMask']
+  saveSleepState(state, path)
+  assert loadSleepState(path) is None
+  clearSleepState(path)
+  assert not os.path.exists(path)
+  print("[INFO] Invalid states: OK")
+
+def checkResume(path):
+  state = exampleState()
+  saveSleepState(state, path)
+  loaded = loadSleepState(path)
+  before = CARASchedule(state['sfMask'], state['initialResourceBlock'], state['durationOfPeriod'], state['algorithm'], b'\x01'*8, state['loadHints'])
+  after = CARASchedule(loaded['sfMask'], loaded['initialResourceBlock'], loaded['durationOfPeriod'], loaded['algorithm'], b'\x01'*8, loaded['loadHints'])
+  us = loaded['timeLastTransmissionUs'] + int(1000000*loaded['nextRandNo'])
+  for i in range(1000):
+    assert before.parametersAtUs(us + 5000000*i) == after.parametersAtUs(us + 5000000*i)
+  # Woken up after midnight (RTC lost and restored): the time continues from
+  # the midnight of the previous day, after the last transmission
+  rtc = VirtualRTC(0)
+  if rtc.now()[0] < 2020:
+    rtc.init(usToRtc(loaded['wakeUpUs']))
+  ticks = [0]
+  clock = CARAClock(rtc, lambda: ticks[0], lambda a, b: a - b, lambda us: None, loaded['epochDayUs'])
+  assert clock.nowUs() > loaded['timeLastTransmissionUs']
+  assert abs(clock.now() - (86400 + 92.75)) < 1e-6
+  energy = EnergyEstimate(*loaded['energy'])
+  assert energy.asList() == state['energy']
+  # Algorithm unknown to this firmware (main.py falls back to assignmentAlgorithm)
+  assert knownAssignmentAlgorithm(loaded['algorithm']) and knownAssignmentAlgorithm('loadAware')
+  for algorithm in (9, -1, 'unknown'):
+    assert not knownAssignmentAlgorithm(algorithm), algorithm
+  print("[INFO] Resume: OK (t = {:.3f} s)".format(clock.now()))
+
+def main():
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'caraState.json')
+    checkRoundTrip(path)
+    checkInvalid(path)
+    checkResume(path)
+
+if __name__ == '__main__':
+  main()
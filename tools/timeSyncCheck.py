@@ -0,0 +1,194 @@
+# Checks of lib/timeSync.py with a simulated RTC and a controllable NTP server
+# (host side, Python 3)
+#
+# The simulated RTC drifts (ppm) from the true (virtual) time and is set to the
+# true time by the NTP server latency seconds after rtc.ntp_sync(), if the server
+# is reachable. The virtual sleep only advances the virtual time.
+#
+# Example:
+#   python3 tools/timeSyncCheck.py
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from caraClock import rtcToUs, usToRtc
+from timeSync import TimeSync, widenedGuardTime, NTP_UNCERTAINTY, DEFAULT_DRIFT_PPM
+
+# 2024-03-01 00:00:00
+START_US = 1709251200000000
+
+class FakeNTP:
+  """ NTP server: reachable or not (or from a true time), and latency of a synchronization (s) """
+
+  def __init__(self, reachable=True, latency=1.0, reachableFromUs=None):
+    self.reachable = reachable
+    self.latency = latency
+    self.reachableFromUs = reachableFromUs
+
+  def reachableAt(self, trueUs):
+    return self.reachable or (self.reachableFromUs is not None and trueUs >= self.reachableFromUs)
+
+class SimulatedRTC:
+  """ machine.RTC with drift, synchronized by a FakeNTP, and virtual utime """
+
+  def __init__(self, ntp, rtcUs=0, driftPpm=0):
+    self.ntp = ntp
+    self.trueUs = START_US
+    self.rtcUs = rtcUs
+    self.driftPpm = driftPpm
+    self.syncAt = None
+    self.bSynced = False
+    self.syncs = 0
+
+  def advance(self, us):
+    self.trueUs = self.trueUs + us
+    self.rtcUs = self.rtcUs + us + us*self.driftPpm//1000000
+    if self.syncAt is not None and self.ntp.reachableAt(self.trueUs) and self.trueUs >= self.syncAt:
+      self.rtcUs = self.trueUs
+      self.bSynced = True
+      self.syncAt = None
+      self.syncs = self.syncs + 1
+
+  def now(self):
+    return usToRtc(self.rtcUs)
+
+  def init(self, datetime):
+    self.rtcUs = rtcToUs(datetime)
+
+  def ntp_sync(self, server, update_period=3600):
+    self.bSynced = False
+    self.syncAt = None if server is None else self.trueUs + int(1000000*self.ntp.latency)
+
+  def synced(self):
+    return self.bSynced
+
+  def ticks_ms(self):
+    return self.trueUs//1000
+
+  def ticks_diff(self, end, start):
+    return end - start
+
+  def sleep_ms(self, ms):
+    self.advance(1000*ms)
+
+  def errorUs(self):
+    return abs(self.rtcUs - self.trueUs)
+
+def newTimeSync(rtc, stateFile, deadline=30.0, resyncPeriod=3600.0):
+  return TimeSync(rtc, 'pool.ntp.org', deadline, resyncPeriod, 0.1, stateFile, rtc.ticks_ms, rtc.ticks_diff, rtc.sleep_ms)
+
+def checkSync(directory):
+  # NTP reachable: synchronized after the latency
+  rtc = SimulatedRTC(FakeNTP(True, 1.5))
+  timeSync = newTimeSync(rtc, os.path.join(directory, 'sync.json'))
+  start = rtc.trueUs
+  assert timeSync.uncertainty() is None
+  assert timeSync.synchronize()
+  assert rtc.trueUs - start < 1700000
+  assert rtc.errorUs() == 0
+  assert abs(timeSync.uncertainty() - NTP_UNCERTAINTY) < 1e-3
+  print("[INFO] NTP reachable: OK (synchronized in {:.1f} s)".format((rtc.trueUs - start)/1000000))
+
+def checkDeadline(directory):
+  # NTP unreachable, RTC not set and no saved state: synchronize() returns at the
+  # deadline, the time is unknown and the guard time is the maximum one
+  ntp = FakeNTP(False)
+  rtc = SimulatedRTC(ntp)
+  timeSync = newTimeSync(rtc, os.path.join(directory, 'deadline.json'), deadline=10.0)
+  start = rtc.trueUs
+  assert not timeSync.synchronize()
+  waited = (rtc.trueUs - start)/1000000
+  assert 10.0 <= waited < 10.2, waited
+  assert timeSync.uncertainty() is None
+  assert widenedGuardTime(0.1, timeSync.uncertainty(), 1.0) == 1.0
+
+  # The synchronization goes on in the background when NTP becomes reachable
+  ntp.reachable = True
+  for i in range(50):
+    rtc.sleep_ms(100)
+    timeSync.poll()
+  assert timeSync.syncs == 1 and rtc.errorUs() == 0
+  assert abs(timeSync.uncertainty() - NTP_UNCERTAINTY) < 1e-3
+  print("[INFO] NTP unreachable: OK (synchronize() returned after {:.1f} s, synchronized later in the background)".format(waited))
+
+def checkFallback(directory):
+  # Synchronized, then reset 2 hours later without NTP: the RTC keeps its time and
+  # the uncertainty grows with the time since the last synchronization
+  stateFile = os.path.join(directory, 'fallback.json')
+  ntp = FakeNTP(True)
+  rtc = SimulatedRTC(ntp, driftPpm=40)
+  assert newTimeSync(rtc, stateFile).synchronize()
+  ntp.reachable = False
+  rtc.advance(7200*1000000)
+  timeSync = newTimeSync(rtc, stateFile)
+  assert not timeSync.synchronize()
+  uncertainty = timeSync.uncertainty()
+  expected = NTP_UNCERTAINTY + 7230*DEFAULT_DRIFT_PPM/1000000
+  assert abs(uncertainty - expected) < 0.01, (uncertainty, expected)
+  assert rtc.errorUs() <= 1000000*uncertainty
+  # Widened to the uncertainty (not by it), only when it is larger than the guard time
+  guardTime = widenedGuardTime(0.1, uncertainty, 1.0)
+  assert uncertainty > 0.1 and guardTime == uncertainty, (guardTime, uncertainty)
+  assert widenedGuardTime(0.1, NTP_UNCERTAINTY, 1.0) == 0.1
+  assert widenedGuardTime(0.5, uncertainty, 1.0) == 0.5
+  assert widenedGuardTime(0.1, 5.0, 1.0) == 1.0
+  print("[INFO] Fallback: OK (uncertainty {:.3f} s after 2 h, error {:.3f} s, guard time {:.3f} s)".format(uncertainty, rtc.errorUs()/1000000, guardTime))
+
+def checkPowerLoss(directory):
+  # Synchronized, then a power loss (RTC back to 1970) and NTP unreachable for 10
+  # minutes: the saved state does not give the time, so the time is unknown and
+  # waitUntilKnown() holds the device until NTP sets the RTC
+  stateFile = os.path.join(directory, 'powerLoss.json')
+  ntp = FakeNTP(True)
+  rtc = SimulatedRTC(ntp)
+  assert newTimeSync(rtc, stateFile).synchronize()
+  ntp.reachable = False
+  rtc.advance(3600*1000000)
+  rtc.rtcUs = 0
+  ntp.reachableFromUs = rtc.trueUs + 600*1000000
+  timeSync = newTimeSync(rtc, stateFile)
+  assert timeSync.lastSyncUs is not None
+  assert not timeSync.synchronize()
+  assert not timeSync.timeKnown() and timeSync.uncertainty() is None
+  assert widenedGuardTime(0.1, timeSync.uncertainty(), 1.0) == 1.0
+  start = rtc.trueUs
+  waited = timeSync.waitUntilKnown(lambda: True)
+  assert timeSync.timeKnown() and rtc.errorUs() == 0
+  assert abs(timeSync.uncertainty() - NTP_UNCERTAINTY) < 1e-3
+  assert abs(waited - (rtc.trueUs - start)/1000000) < 1e-3 and 570 <= waited <= 572, waited
+  # Time already known: no wait
+  assert timeSync.waitUntilKnown(lambda: True) == 0
+  print("[INFO] Power loss without NTP: OK (time unknown, held {:.0f} s until the synchronization)".format(waited))
+
+def checkDrift(directory, driftPpm):
+  # Resync every hour: the drift of the RTC is estimated, and then the error of the
+  # RTC stays below the uncertainty
+  rtc = SimulatedRTC(FakeNTP(True, 0.5), driftPpm=driftPpm)
+  timeSync = newTimeSync(rtc, os.path.join(directory, 'drift.json'))
+  assert timeSync.synchronize()
+  maxRatio = 0.0
+  for i in range(24*360):
+    rtc.sleep_ms(10000)
+    timeSync.poll()
+    if timeSync.syncs >= 2:
+      maxRatio = max(maxRatio, rtc.errorUs()/(1000000*timeSync.uncertainty()))
+  assert timeSync.syncs >= 23, timeSync.syncs
+  assert abs(timeSync.driftPpm - max(10, abs(driftPpm))) <= 2, timeSync.driftPpm
+  assert maxRatio <= 1.0, maxRatio
+  print("[INFO] Drift {:+d} ppm: OK (estimated {:d} ppm after {:d} resyncs, max error/uncertainty {:.2f})".format(driftPpm, timeSync.driftPpm, timeSync.syncs, maxRatio))
+
+def main():
+  with tempfile.TemporaryDirectory() as directory:
+    checkSync(directory)
+    checkDeadline(directory)
+    checkFallback(directory)
+    checkPowerLoss(directory)
+    for driftPpm in (-200, 0, 30, 150):
+      checkDrift(directory, driftPpm)
+  print("[INFO] All time synchronization checks passed")
+
+if __name__ == '__main__':
+  main()
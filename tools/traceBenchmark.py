@@ -0,0 +1,166 @@
+# Overhead and accuracy of the latency tracing of the uplink pipeline
+# (lib/tracer.py), host side, Python 3
+#
+#   overhead:    time per span (start() + end()) enabled and disabled, compared
+#                with the same loop without tracing
+#   allocations: bytes allocated per span (tracemalloc). CPython allocates every
+#                int greater than 256 (the tick counter and the spans), MicroPython
+#                does not allocate small ints (up to 2^30)
+#   aggregates:  min/mean/max/p99 of random spans compared with the exact ones
+#   pipeline:    report of the stages of main.py uplinks (CARA schedule, border
+#                effect, duty cycle ledger, and stand-ins of the radio and s.send)
+#
+# Example:
+#   python3 tools/traceBenchmark.py --spans 200000
+
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from tracer import Tracer, TRACE_SIZE, STAGE_NAMES, STAGE_SCHEDULE, STAGE_BORDER_EFFECT, STAGE_RADIO_CONFIG, STAGE_DUTY_CYCLE, STAGE_SEND, STAGE_CLOCK, STAGE_WAKE_TO_AIR, STAGE_CLOCK_CORRECT
+from caraScheduler import CARASchedule, checkBorderEffect
+from txQueue import DutyCycleLedger
+
+def ticks_us():
+  return time.perf_counter_ns()//1000
+
+def ticks_diff(a, b):
+  return a - b
+
+def newTracer(enabled):
+  return Tracer(enabled, ticks_us=ticks_us, ticks_diff=ticks_diff)
+
+def loopTime(tracer, spans):
+  # Seconds of spans iterations with (tracer) or without (None) tracing
+  start = time.perf_counter()
+  if tracer is None:
+    for i in range(spans):
+      pass
+  else:
+    for i in range(spans):
+      t0 = tracer.start()
+      tracer.end(STAGE_SEND, t0)
+  return time.perf_counter() - start
+
+def measureOverhead(spans):
+  bare = min(loopTime(None, spans) for i in range(3))
+  for enabled in (False, True):
+    tracer = newTracer(enabled)
+    elapsed = min(loopTime(tracer, spans) for i in range(3))
+    print("[INFO] Tracing {:8s}: {:7.1f} ns per span ({:7.1f} ns without tracing)".format(
+      'enabled' if enabled else 'disabled', 1e9*elapsed/spans, 1e9*bare/spans))
+
+def allocatedPerSpan(tracer, spans, span):
+  # Bytes allocated per span (tracemalloc), span(i) called outside the measure,
+  # without the allocations of the same loop without tracing (None)
+  allocated = array('q', [0]*spans)
+  tracemalloc.start()
+  for i in range(spans):
+    value = span(i)
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    if tracer is None:
+      pass
+    elif value is None:
+      t0 = tracer.start()
+      tracer.end(i % len(STAGE_NAMES), t0)
+    else:
+      tracer.record(i % len(STAGE_NAMES), value)
+    allocated[i] = tracemalloc.get_traced_memory()[1] - before
+  tracemalloc.stop()
+  if tracer is None:
+    return sum(allocated)/spans
+  return sum(allocated)/spans - allocatedPerSpan(None, spans, span)
+
+def measureAllocations(spans):
+  print("[INFO] Tracing disabled:           {:5.1f} bytes allocated per span".format(allocatedPerSpan(newTracer(False), spans, lambda i: None)))
+  print("[INFO] Tracing enabled:            {:5.1f} bytes allocated per span (CPython ints of the tick counter)".format(allocatedPerSpan(newTracer(True), spans, lambda i: None)))
+  # Ring buffer and aggregates only, with every int (spans, sums and counters)
+  # below 257 as the small ints of the device
+  tracer = newTracer(True)
+  print("[INFO] Tracing enabled, record():  {:5.1f} bytes allocated per span (spans of 0 or 1 us, ints < 257)".format(
+    allocatedPerSpan(tracer, 256 - 1, lambda i: i % 2)))
+
+def checkAggregates(rnd, spans):
+  tracer = newTracer(True)
+  exact = [[] for name in STAGE_NAMES]
+  for i in range(spans):
+    stage = rnd.randrange(len(STAGE_NAMES))
+    span = int(rnd.lognormvariate(7, 1.5))
+    tracer.record(stage, span)
+    exact[stage].append((i, span))
+  for stage in range(len(STAGE_NAMES)):
+    stats = tracer.stats(stage)
+    values = [span for i, span in exact[stage]]
+    assert stats['count'] == len(values)
+    assert stats['min'] == min(values) and stats['max'] == max(values)
+    assert abs(stats['mean'] - sum(values)/len(values)) < 1e-6*max(1, sum(values)/len(values)), (stats['mean'], sum(values)/len(values))
+    # p99 of the spans still in the ring buffer
+    recent = sorted(span for i, span in exact[stage] if i >= spans - TRACE_SIZE)
+    assert stats['p99'] == recent[min(len(recent) - 1, int(0.99*len(recent)))]
+  print("[INFO] Aggregates: OK ({:d} spans, {:d} stages)".format(spans, len(STAGE_NAMES)))
+
+class FakeRadioState:
+  """ radioState.RadioState: lora.add_channel / setsockopt of about 200 us """
+
+  def setTransmissionParameters(self, freq, dr):
+    end = time.perf_counter() + 200e-6
+    while time.perf_counter() < end:
+      pass
+
+def pipeline(rnd, uplinks, sendTime):
+  # Stages of main.py uplinks (CARA enabled, avoiding the border effect)
+  tracer = newTracer(True)
+  schedule = CARASchedule(63, 5, 5.0)
+  ledger = DutyCycleLedger()
+  radioState = FakeRadioState()
+  t = 0.0
+  for i in range(uplinks):
+    t = t + 10.0 + rnd.uniform(0, 10.0)
+    t0 = tracer.start()
+    selectedFreq, selectedDR = schedule.parametersAt(t)
+    tracer.end(STAGE_SCHEDULE, t0)
+    t0 = tracer.start()
+    checkBorderEffect(t, selectedFreq, selectedDR, 0.1, 18, 5.0)
+    tracer.end(STAGE_BORDER_EFFECT, t0)
+    t0 = tracer.start()
+    radioState.setTransmissionParameters(selectedFreq, selectedDR)
+    tracer.end(STAGE_RADIO_CONFIG, t0)
+    wakeUp = tracer.start()
+    t0 = tracer.start()
+    ledger.allowed(selectedFreq, 0.1, t)
+    tracer.end(STAGE_DUTY_CYCLE, t0)
+    t0 = tracer.start()
+    time.sleep(sendTime)
+    tracer.end(STAGE_SEND, t0)
+    tracer.end(STAGE_WAKE_TO_AIR, wakeUp)
+    t0 = tracer.start()
+    time.monotonic()
+    tracer.end(STAGE_CLOCK, t0)
+    ledger.record(selectedFreq, t, 0.1)
+    t0 = tracer.start()
+    time.time()
+    tracer.end(STAGE_CLOCK_CORRECT, t0)
+  tracer.dump()
+
+def main():
+  parser = argparse.ArgumentParser(description='Overhead and accuracy of the uplink pipeline tracing')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--spans', type=int, default=200000)
+  parser.add_argument('--uplinks', type=int, default=200)
+  parser.add_argument('--sendTime', type=float, default=0.002)
+  config = parser.parse_args()
+  rnd = random.Random(config.seed)
+  measureOverhead(config.spans)
+  measureAllocations(min(config.spans, 50000))
+  checkAggregates(rnd, config.spans)
+  pipeline(rnd, config.uplinks, config.sendTime)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,195 @@
+# Checks of lib/txQueue.py: accuracy of the duty cycle ledger, and throughput of
+# the transmit queue with bursty producers (host side, Python 3)
+#
+# The throughput simulation has one transmission time every fixedTime +
+# rand(randomTime) seconds (as main.py) on the CARA channels (sequential
+# resource blocks), and producers pushing bursts of payloads (Poisson bursts,
+# geometric burst sizes). Frames are sent only if the duty cycle allows them.
+#
+# Example:
+#   python3 tools/txQueueCheck.py --hours 48 --burstRate 0.01
+
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from txQueue import TxQueue, DutyCycleLedger, splitMergedFrame, subBandOf, SUB_BANDS, DUTY_CYCLE_WINDOW, LEDGER_SIZE, MIN_FRAME_AIR_TIME
+from caraScheduler import CARASchedule
+from LoRaAirTimeCalc import airtime
+
+DEFAULT_CONFIG = {
+  'seed': 1,
+  'hours': 24.0,
+  'fixedTime': 10.0,
+  'randomTime': 10.0,
+  'burstRate': 0.02,
+  'meanBurstSize': 4.0,
+  'minPayloadSize': 4,
+  'maxPayloadSize': 20,
+  'sf': 10,
+  'queueSize': 16,
+}
+
+FREQS = [867100000 + 200000*channel for channel in range(8)]
+
+def usedInWindow(transmissions, freq, now, window=DUTY_CYCLE_WINDOW):
+  # Exact air time of the sub-band of freq within (now - window, now]
+  band = subBandOf(freq)
+  used = 0.0
+  for f, start, airTime in transmissions:
+    if subBandOf(f) == band:
+      used = used + max(0.0, min(now, start + airTime) - max(now - window, start))
+  return used
+
+def checkLedger(rnd, ledgerSize, minInterval=0.0, count=3000):
+  # Transmissions sent only if the ledger allows them (as in main.py), at least
+  # minInterval seconds apart. The ledger never underestimates the air time of
+  # the window; it overestimates it at most by the transmission crossing the start
+  # of the window if the ring buffer is never full (the CARA uplinks, one per
+  # minute at most), and at most by the budget (frames held, never sent over the
+  # duty cycle) if the coalesced transmissions are counted longer
+  ledger = DutyCycleLedger(ledgerSize)
+  transmissions = []
+  t = 0.0
+  now = 0.0
+  maxError = 0.0
+  held = 0
+  for i in range(count):
+    # Transmissions and queries in time order (as in main.py)
+    t = max(now, t + minInterval + rnd.expovariate(1/20.0))
+    freq = rnd.choice(FREQS)
+    airTime = rnd.uniform(0.05, 2.0)
+    if ledger.allowed(freq, airTime, t):
+      ledger.record(freq, t, airTime)
+      transmissions.append((freq, t, airTime))
+      transmissions = [tx for tx in transmissions if tx[1] + tx[2] > t - 2*DUTY_CYCLE_WINDOW]
+      assert usedInWindow(transmissions, freq, t + airTime) <= ledger.budget(freq) + 1e-6
+    else:
+      held = held + 1
+    now = t + airTime + rnd.uniform(0, 10)
+    for freq in (FREQS[0], FREQS[7]):
+      used = ledger.usedAirTime(freq, now)
+      exact = usedInWindow(transmissions, freq, now)
+      assert used >= exact - 1e-6, (used, exact)
+      maxError = max(maxError, used - exact)
+  if minInterval >= 60.0 and ledgerSize >= LEDGER_SIZE:
+    assert ledger.coalesced == 0, ledger.coalesced
+  bound = 2.0 if ledger.coalesced == 0 else ledger.budget(FREQS[0])
+  assert maxError <= bound + 1e-6, (ledgerSize, maxError, bound)
+  print("[INFO] Ledger ({:d} entries, {:.0f} s apart at least): OK (max overestimation {:.3f} s, bound {:.1f} s, {:d} coalesced, {:d} of {:d} transmissions held)".format(
+    ledgerSize, minInterval, maxError, bound, ledger.coalesced, held, count))
+
+def checkLedgerThroughput(windows=4):
+  # Shortest frames back to back in a 1% sub-band: the ring buffer is full and the
+  # oldest transmissions are merged, the duty cycle is respected and most of the
+  # budget is still used
+  ledger = DutyCycleLedger()
+  freq = FREQS[0]
+  budget = ledger.budget(freq)
+  transmissions = []
+  t = 0.0
+  while t < windows*DUTY_CYCLE_WINDOW:
+    t = ledger.nextAllowedTime(freq, MIN_FRAME_AIR_TIME, t)
+    ledger.record(freq, t, MIN_FRAME_AIR_TIME)
+    transmissions.append((freq, t, MIN_FRAME_AIR_TIME))
+    t = t + MIN_FRAME_AIR_TIME
+  assert ledger.coalesced > 0
+  for f, start, airTime in transmissions[::50]:
+    assert usedInWindow(transmissions, freq, start + airTime) <= budget + 1e-6, start
+  # Air time sent per window after the first one (steady state)
+  used = sum(airTime for f, start, airTime in transmissions if start >= DUTY_CYCLE_WINDOW)/(windows - 1)
+  assert used >= 0.9*budget, used
+  print("[INFO] Ledger throughput: OK ({:d} entries, frames of {:.3f} s back to back, {:.1f} s of {:.0f} s sent per window)".format(
+    LEDGER_SIZE, MIN_FRAME_AIR_TIME, used, budget))
+
+def checkNextAllowedTime(rnd):
+  ledger = DutyCycleLedger()
+  t = 0.0
+  freq = FREQS[0]
+  budget = ledger.budget(freq)
+  while ledger.usedAirTime(freq, t) + 1.5 <= budget:
+    ledger.record(freq, t, 1.5)
+    t = t + 10.0
+  nextTime = ledger.nextAllowedTime(freq, 1.5, t)
+  assert nextTime > t
+  # (queries in time order: expired transmissions are removed)
+  assert not ledger.allowed(freq, 1.5, nextTime - 0.01)
+  assert ledger.allowed(freq, 1.5, nextTime)
+  print("[INFO] Next allowed time: OK (budget {:.0f} s used at t={:.0f} s, next at t={:.1f} s)".format(budget, t, nextTime))
+
+def simulate(rnd, config, bMerge):
+  queue = TxQueue(config['queueSize'])
+  ledger = DutyCycleLedger()
+  schedule = CARASchedule(1 << (config['sf'] - 7), 0, 5.0)
+  end = 3600*config['hours']
+  # Payload i: (production time); payloads carry their number
+  produced = []
+  t = 0.0
+  nextBurst = rnd.expovariate(config['burstRate'])
+  received = []
+  transmissions = []
+  held = 0
+  frames = 0
+  while t < end:
+    t = t + config['fixedTime'] + rnd.uniform(0, config['randomTime'])
+    # Producers: bursts until t
+    while nextBurst <= t:
+      size = 1
+      while rnd.random() > 1/config['meanBurstSize']:
+        size = size + 1
+      for i in range(size):
+        number = len(produced)
+        produced.append(nextBurst)
+        length = rnd.randint(config['minPayloadSize'], config['maxPayloadSize'])
+        queue.push(number.to_bytes(4, 'big') + bytes(length - 4))
+      nextBurst = nextBurst + rnd.expovariate(config['burstRate'])
+
+    size, payloads = queue.frameSize(bMerge)
+    if payloads == 0:
+      continue
+    freq, dr = schedule.parametersAt(t)
+    airTime = airtime(size, 12 - dr)
+    if not ledger.allowed(freq, airTime, t):
+      held = held + 1
+      continue
+    frame = bytes(queue.pop(payloads))
+    ledger.record(freq, t, airTime)
+    transmissions.append((freq, t, airTime))
+    frames = frames + 1
+    for data in (splitMergedFrame(frame) if payloads > 1 else [frame]):
+      received.append((int.from_bytes(data[0:4], 'big'), t + airTime))
+
+  # Payloads received in order, and the duty cycle of every sub-band respected
+  numbers = [number for number, receivedAt in received]
+  assert numbers == sorted(numbers)
+  for freq, start, airTime in transmissions:
+    assert usedInWindow(transmissions, freq, start + airTime) <= ledger.budget(freq) + 1e-6
+  latencies = sorted(receivedAt - produced[number] for number, receivedAt in received)
+  return {
+    'produced': len(produced), 'received': len(received), 'dropped': queue.dropped, 'frames': frames, 'held': held,
+    'meanLatency': sum(latencies)/max(1, len(latencies)), 'p99Latency': latencies[int(0.99*len(latencies))] if latencies else 0.0,
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description='Duty cycle ledger and transmit queue checks')
+  for name in sorted(DEFAULT_CONFIG):
+    parser.add_argument('--' + name, type=type(DEFAULT_CONFIG[name]), default=DEFAULT_CONFIG[name])
+  config = vars(parser.parse_args())
+  rnd = random.Random(config['seed'])
+
+  checkLedger(rnd, LEDGER_SIZE, 60.0)
+  checkLedger(rnd, LEDGER_SIZE)
+  checkLedger(rnd, 8)
+  checkLedgerThroughput()
+  checkNextAllowedTime(rnd)
+  for bMerge in (False, True):
+    result = simulate(random.Random(config['seed']), config, bMerge)
+    print("[INFO] {:14s}: {:d} payloads produced, {:d} received ({:.1f}%), {:d} dropped (queue full), {:d} frames, {:d} held (duty cycle), latency mean {:.0f} s, p99 {:.0f} s".format(
+      'Merged' if bMerge else 'One per frame', result['produced'], result['received'], 100*result['received']/max(1, result['produced']),
+      result['dropped'], result['frames'], result['held'], result['meanLatency'], result['p99Latency']))
+
+if __name__ == '__main__':
+  main()
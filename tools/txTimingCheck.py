@@ -0,0 +1,210 @@
+# Checks of lib/txTiming.py: maths of the lateness histogram (quantiles, mean,
+# halving) and timing records, and replay of a trace of timing records with the
+# static and the automatic border effect guard time (host side, Python 3)
+#
+# Replay: for every frame of the trace, the border effect is checked at its
+# scheduled time with the guard time (CARA schedule of 18-byte frames); if it is
+# sent, it starts after its lateness (start of s.send - scheduled time) and is
+# counted as crossing if it ends after the end of its period (the collisions the
+# guard time has to avoid), and as a miss if its lateness is larger than the guard
+# time (about 1% of the frames with the p99 of the lateness). The automatic guard
+# time only uses the lateness of the frames sent before (as main.py). The trace is a file written by TimingLog.save()
+# on the device (--trace), or a synthetic one (jitter of the loop, garbage
+# collection pauses and rare long pauses).
+#
+# Example:
+#   python3 tools/txTimingCheck.py --frames 20000
+#   python3 tools/txTimingCheck.py --trace timing.bin
+
+import os
+import sys
+import math
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from txTiming import TimingLog, LatenessHistogram, autoGuardTime, parseTimingRecords, HISTOGRAM_BINS, HISTOGRAM_BIN_US, HISTOGRAM_WINDOW
+from caraScheduler import CARASchedule, checkBorderEffect, convertDRtoSF
+from LoRaAirTimeCalc import airtime
+
+DEFAULT_CONFIG = {
+  'seed': 1,
+  'frames': 20000,
+  'fixedTime': 10.0,
+  'randomTime': 10.0,
+  'durationOfPeriod': 10.0,
+  'sfMask': 63,
+  'staticGuardTimes': '0.01,0.1',
+  'meanLateness': 0.003,
+  'gcProbability': 0.03,
+  'gcPause': 0.04,
+  'longPauseProbability': 0.002,
+  'longPause': 0.15,
+}
+
+def exactQuantile(values, q):
+  # Sample of the q quantile (the first one with q of the samples up to it)
+  ordered = sorted(values)
+  return ordered[max(0, math.ceil(q*len(ordered)) - 1)]
+
+def distributions(rnd):
+  # Lateness samples (us)
+  return {
+    'jitter': lambda: int(max(0.0, rnd.gauss(2000, 500))),
+    'gc pauses': lambda: int(rnd.uniform(20000, 60000)) if rnd.random() < 0.05 else int(max(0.0, rnd.gauss(2000, 500))),
+    'lognormal': lambda: int(rnd.lognormvariate(8, 1)),
+    'early/overflow': lambda: rnd.choice((-500, rnd.randrange(0, 10000), rnd.randrange(300000, 500000))),
+  }
+
+def checkHistogram(rnd):
+  for name, sample in distributions(rnd).items():
+    # Without halving: quantiles within one bin above the exact ones, mean within half a bin
+    histogram = LatenessHistogram()
+    values = [sample() for i in range(HISTOGRAM_WINDOW - 1)]
+    for value in values:
+      histogram.add(value)
+    for q in (0.5, 0.9, 0.99):
+      exact = exactQuantile(values, q)
+      estimate = histogram.quantile(q)
+      if exact >= (HISTOGRAM_BINS - 1)*HISTOGRAM_BIN_US:
+        assert estimate >= exact, (name, q, exact, estimate)
+      else:
+        assert exact < estimate <= max(0, exact) + HISTOGRAM_BIN_US, (name, q, exact, estimate)
+    clamped = [min(max(0, value), HISTOGRAM_BINS*HISTOGRAM_BIN_US - 1) for value in values]
+    assert abs(histogram.mean() - sum(clamped)/len(clamped)) <= HISTOGRAM_BIN_US/2, name
+    # With halving (stationary lateness): still close to the exact p99
+    for i in range(10*HISTOGRAM_WINDOW):
+      value = sample()
+      values.append(value)
+      histogram.add(value)
+    assert histogram.count < HISTOGRAM_WINDOW
+    exact = exactQuantile(values, 0.99)
+    estimate = histogram.quantile(0.99)
+    assert abs(estimate - exact) <= max(2*HISTOGRAM_BIN_US, 0.2*exact), (name, exact, estimate)
+    print("[INFO] Histogram {:14s}: OK (p99 exact {:7.1f} ms, histogram {:7.1f} ms after halving)".format(name, exact/1000, estimate/1000))
+
+  # Step change of the lateness: frames until the p99 follows it
+  samples = distributions(rnd)
+  histogram = LatenessHistogram()
+  for i in range(3*HISTOGRAM_WINDOW):
+    histogram.add(samples['jitter']())
+  before = histogram.quantile(0.99)
+  frames = 0
+  while histogram.quantile(0.99) < 20000:
+    histogram.add(samples['gc pauses']())
+    frames = frames + 1
+    assert frames <= HISTOGRAM_WINDOW, frames
+  print("[INFO] Histogram step change: OK (p99 {:.1f} ms -> {:.1f} ms after {:d} frames with GC pauses)".format(before/1000, histogram.quantile(0.99)/1000, frames))
+
+  # One very late frame, then late frames in the last bin: the p99 follows the
+  # maximum of the last windows, not the old frame
+  histogram = LatenessHistogram()
+  lateUs = 5000000
+  histogram.add(lateUs)
+  recent = []
+  for i in range(3*HISTOGRAM_WINDOW):
+    value = rnd.randrange(300000, 400000)
+    recent.append(value)
+    histogram.add(value)
+  estimate = histogram.quantile(0.99)
+  assert HISTOGRAM_BINS*HISTOGRAM_BIN_US <= estimate <= max(recent[-2*HISTOGRAM_WINDOW:]), estimate
+  print("[INFO] Histogram maximum: OK (p99 {:.1f} ms after a frame {:.1f} ms late)".format(estimate/1000, lateUs/1000))
+
+def checkTimingLog(rnd):
+  log = TimingLog(16)
+  expected = []
+  for i in range(40):
+    scheduledUs = rnd.randrange(0, 3*86400*1000000)
+    wakeUs = scheduledUs + rnd.randrange(-1000, 5000)
+    sendUs = wakeUs + rnd.randrange(0, 50000)
+    sentUs = sendUs + rnd.randrange(0, 3000000)
+    log.add(scheduledUs, wakeUs, sendUs, sentUs)
+    expected.append((scheduledUs//1000, wakeUs - scheduledUs, sendUs - scheduledUs, sentUs - sendUs))
+  assert log.records() == expected[-16:]
+  with tempfile.TemporaryDirectory() as directory:
+    fileName = os.path.join(directory, 'timing.bin')
+    log.save(fileName)
+    with open(fileName, 'rb') as f:
+      data = f.read()
+  assert len(data) == 16*16 and parseTimingRecords(data) == expected[-16:]
+  # Out of range differences are clamped
+  log.add(0, 0, 1 << 40, (1 << 40) - (1 << 41))
+  assert log.records()[-1][2:] == (0x7FFFFFFF, -0x7FFFFFFF)
+  print("[INFO] Timing records: OK (ring buffer, save and parse, clamping)")
+
+def syntheticTrace(rnd, config):
+  # Records (scheduled ms, wake-up us, send us, duration us) of frames sent by the loop
+  records = []
+  t = 0.0
+  for i in range(config['frames']):
+    t = t + config['fixedTime'] + rnd.uniform(0, config['randomTime'])
+    lateness = rnd.expovariate(1/config['meanLateness'])
+    if rnd.random() < config['gcProbability']:
+      lateness = lateness + rnd.uniform(0.5, 1.0)*config['gcPause']
+    if rnd.random() < config['longPauseProbability']:
+      lateness = lateness + rnd.uniform(0.5, 1.0)*config['longPause']
+    wake = int(1000000*lateness*rnd.uniform(0.2, 0.5))
+    records.append((int(1000*t), wake, int(1000000*lateness), 100000))
+  return records
+
+def replay(records, config, staticGuardTime=None):
+  # Static (staticGuardTime) or automatic guard time: frames dropped, frames later
+  # than the guard time and frames ending after their period
+  schedule = CARASchedule(config['sfMask'], 0, config['durationOfPeriod'])
+  histogram = LatenessHistogram()
+  dropped = 0
+  crossing = 0
+  misses = 0
+  guardTimes = 0.0
+  for scheduledMs, wakeLateness, sendLateness, sendDuration in records:
+    t = scheduledMs/1000
+    freq, dr = schedule.parametersAt(t)
+    guardTime = staticGuardTime if staticGuardTime is not None else autoGuardTime(histogram, 0.1)
+    guardTimes = guardTimes + guardTime
+    if checkBorderEffect(t, freq, dr, guardTime, 18, config['durationOfPeriod']):
+      dropped = dropped + 1
+      continue
+    histogram.add(sendLateness)
+    if sendLateness/1000000 > guardTime:
+      misses = misses + 1
+    if t + sendLateness/1000000 + airtime(18, convertDRtoSF(dr)) > schedule.nextBoundary(t):
+      crossing = crossing + 1
+  return {'dropped': dropped, 'crossing': crossing, 'misses': misses, 'sent': len(records) - dropped, 'meanGuardTime': guardTimes/len(records), 'p99': histogram.quantile(0.99)}
+
+def main():
+  parser = argparse.ArgumentParser(description='Lateness histogram and automatic guard time checks')
+  for name in sorted(DEFAULT_CONFIG):
+    parser.add_argument('--' + name, type=type(DEFAULT_CONFIG[name]), default=DEFAULT_CONFIG[name])
+  parser.add_argument('--trace', default=None, help='timing records saved by the device (TimingLog.save)')
+  config = vars(parser.parse_args())
+  rnd = random.Random(config['seed'])
+
+  checkHistogram(rnd)
+  checkTimingLog(rnd)
+
+  if config['trace'] is not None:
+    with open(config['trace'], 'rb') as f:
+      records = parseTimingRecords(f.read())
+    print("[INFO] Replaying {:d} frames of {}".format(len(records), config['trace']))
+  else:
+    records = syntheticTrace(rnd, config)
+    print("[INFO] Replaying {:d} frames of a synthetic trace".format(len(records)))
+  results = []
+  for staticGuardTime in [float(value) for value in config['staticGuardTimes'].split(',')] + [None]:
+    result = replay(records, config, staticGuardTime)
+    results.append((staticGuardTime, result))
+    print("[INFO] Guard time {:10s}: mean {:.3f} s, {:5d} frames dropped ({:5.2f}%), lateness above the guard time in {:5.2f}% of the frames sent, {:3d} frames crossing the end of their period".format(
+      'automatic' if staticGuardTime is None else '{:.3f} s'.format(staticGuardTime), result['meanGuardTime'],
+      result['dropped'], 100*result['dropped']/len(records), 100*result['misses']/max(1, result['sent']), result['crossing']))
+  if config['trace'] is None:
+    # The automatic guard time covers the lateness of about 99% of the frames, and
+    # drops at most as the largest static one
+    automatic = results[-1][1]
+    static = [result for guardTime, result in results[:-1]]
+    assert automatic['misses'] <= 0.015*automatic['sent'], automatic
+    assert automatic['dropped'] <= max(result['dropped'] for result in static)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,128 @@
+# Wi-Fi connection latency of lib/wifiManager.py and of the previous connect loop
+# (wlan.connect, then sleep wifiRetryTime before checking), with a fake WLAN in
+# virtual time (host side, Python 3)
+#
+# The fake WLAN scans all the channels (scanTime) unless the BSSID is given,
+# associates after a random time (log-normal, associationTime) and fails an
+# attempt with probability failureProbability.
+#
+# Example:
+#   python3 tools/wifiBenchmark.py --connections 10000 --failureProbability 0.2
+
+import os
+import sys
+import math
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from wifiManager import WiFiManager
+
+DEFAULT_CONFIG = {
+  'connections': 10000,
+  'seed': 1,
+  'scanTime': 1.5,
+  'associationTime': 1.0,
+  'failureProbability': 0.1,
+  'wifiRetryTime': 20.0,
+  'pollInterval': 0.1,
+  'attemptTimeout': 10.0,
+  'deadline': 120.0,
+}
+
+BSSID = b'\x24\x0a\xc4\x12\x34\x56'
+
+class VirtualTime:
+  """ utime.ticks_ms, ticks_diff and sleep_ms in virtual time """
+
+  def __init__(self):
+    self.ms = 0
+
+  def ticks_ms(self):
+    return self.ms
+
+  def ticks_diff(self, end, start):
+    return end - start
+
+  def sleep_ms(self, ms):
+    self.ms = self.ms + ms
+
+class FakeWLAN:
+  """ network.WLAN in station mode """
+
+  WPA2 = 3
+
+  def __init__(self, clock, rnd, config):
+    self.clock = clock
+    self.rnd = rnd
+    self.config = config
+    self.connectedAt = None
+
+  def connect(self, ssid, auth=None, bssid=None, timeout=None):
+    delay = 0.0 if bssid == BSSID else self.config['scanTime']
+    delay = delay + self.rnd.lognormvariate(math.log(self.config['associationTime']), 0.5)
+    if self.rnd.random() < self.config['failureProbability']:
+      self.connectedAt = None
+    else:
+      self.connectedAt = self.clock.ms + int(1000*delay)
+
+  def disconnect(self):
+    self.connectedAt = None
+
+  def isconnected(self):
+    return self.connectedAt is not None and self.clock.ms >= self.connectedAt
+
+  def joined_ap_info(self):
+    return (BSSID, 'CARA', 6, -60, 3)
+
+def legacyConnect(wlan, clock, wifiRetryTime):
+  # Previous connectWiFi(): connect, sleep wifiRetryTime, check
+  start = clock.ms
+  while not wlan.isconnected():
+    wlan.connect('CARA', auth=(FakeWLAN.WPA2, 'password'))
+    clock.sleep_ms(int(1000*wifiRetryTime))
+  return (clock.ms - start)/1000
+
+def percentiles(values):
+  values = sorted(values)
+  def p(q):
+    return values[min(len(values) - 1, int(q*len(values)))]
+  return "mean {:.2f} s, p50 {:.2f} s, p90 {:.2f} s, p99 {:.2f} s, max {:.2f} s".format(sum(values)/len(values), p(0.5), p(0.9), p(0.99), values[-1])
+
+def main():
+  parser = argparse.ArgumentParser(description='Wi-Fi connection latency with a fake WLAN')
+  for name in sorted(DEFAULT_CONFIG):
+    parser.add_argument('--' + name, type=type(DEFAULT_CONFIG[name]), default=DEFAULT_CONFIG[name])
+  config = vars(parser.parse_args())
+  rnd = random.Random(config['seed'])
+
+  results = {'legacy': [], 'manager': [], 'cached': []}
+  attempts = 0
+  failed = 0
+  with tempfile.TemporaryDirectory() as directory:
+    cacheFile = os.path.join(directory, 'wifiCache.json')
+    for i in range(config['connections']):
+      clock = VirtualTime()
+      results['legacy'].append(legacyConnect(FakeWLAN(clock, rnd, config), clock, config['wifiRetryTime']))
+
+      for name in ('manager', 'cached'):
+        if name == 'manager' and os.path.exists(cacheFile):
+          os.remove(cacheFile)
+        clock = VirtualTime()
+        manager = WiFiManager(FakeWLAN(clock, rnd, config), 'CARA', 'password', None, config['pollInterval'], config['attemptTimeout'],
+                              config['deadline'], 1.0, config['wifiRetryTime'], rnd.random, cacheFile, clock.ticks_ms, clock.ticks_diff, clock.sleep_ms)
+        if manager.connect():
+          results[name].append(manager.connectTime)
+          attempts = attempts + manager.attempts
+        else:
+          failed = failed + 1
+
+  print("[INFO] Previous loop (sleep {:.0f} s):  {}".format(config['wifiRetryTime'], percentiles(results['legacy'])))
+  print("[INFO] Connection manager:        {}".format(percentiles(results['manager'])))
+  print("[INFO] Manager, cached BSSID:     {}".format(percentiles(results['cached'])))
+  print("[INFO] Manager: {:.2f} attempts per connection, {:d} connections after the deadline".format(attempts/max(1, len(results['manager']) + len(results['cached'])), failed))
+
+if __name__ == '__main__':
+  main()